@@ -349,12 +349,12 @@ class MainController:
         # ===== 启动前预检：数据库结构升级 + 历史邮件同步 =====
         # 目的：把“已手动发送过的舱单邮件”同步进数据库，避免自动回复时重复发送。
         try:
-            import subprocess
-            # 1) 数据库结构升级（补齐 sync_source 列）
+            # 1) 数据库结构升级（按 user_version 版本迁移，已是最新版本时只读取版本号）
             try:
-                subprocess.run([sys.executable, 'UpdateDatabaseSchema.py'], check=False)
+                import db_schema
+                db_schema.migrate_all()
             except Exception as e:
-                logger.warning(f"⚠️ 数据库结构升级脚本执行失败: {e}")
+                logger.warning(f"⚠️ 数据库结构升级失败: {e}")
 
 
             # 修改为正确的代码：
@@ -4,18 +4,22 @@
 避免系统重复发送
 """
 
-import poplib
 import email
 from email.parser import Parser
 from email.policy import default
-import time
 import os
 import logging
 from datetime import datetime, timedelta
-import sqlite3
+import db_access
+import db_schema
+import email_store
 import re
 import sys
 from email.header import decode_header
+from mail_connection import get_connection_factory
+from pop3_pipelining import POP3Pipeline
+from attachment_spool import ManifestText, text_head, iter_text_lines, is_manifest_candidate, iter_manifest_texts
+from itertools import islice
 
 # 导入现有模块的函数
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -30,6 +34,12 @@ pop3_port = 995
 IMPORT_DB_FILE = 'processed_emails_import.db'
 EXPORT_DB_FILE = 'processed_emails.db'
 
+# 同步记录先缓存，攒够这么多条再一次性写入
+SYNC_BATCH_SIZE = 50
+
+# 写入成功后累加的统计项
+SYNCED_STATS = {IMPORT_DB_FILE: 'import_synced', EXPORT_DB_FILE: 'export_synced'}
+
 # 关键词配置（应该从配置文件读取）
 IMPORT_KEYWORDS = ['Calcium Nitrate', 'Calcium Nitrate Tetrahydrate', 'Magnesium Nitrate Hexahydrate']
 EXPORT_KEYWORDS = ['Calcium Nitrate', 'Calcium Nitrate Tetrahydrate', 'Magnesium Nitrate Hexahydrate']
@@ -65,6 +75,10 @@ class HistoryMailSync:
             'error': 0
         }
         
+        # 数据库中已有的UID（每次同步开始时一次性加载）和待写入的记录
+        self.known_uids = None
+        self.pending = {IMPORT_DB_FILE: [], EXPORT_DB_FILE: []}
+        
     def load_email_config(self):
         """加载邮箱配置"""
         try:
@@ -174,7 +188,7 @@ class HistoryMailSync:
             if not txt_content:
                 return False
             
-            sample = txt_content[:500] if len(txt_content) > 500 else txt_content
+            sample = text_head(txt_content, 500)
             
             if "00NCLCONTAINER LIST" in sample:
                 return True
@@ -182,12 +196,9 @@ class HistoryMailSync:
             if "00:IFCSUM:" in sample:
                 return False
             
-            lines = txt_content.split('\n')
             colon_count = 0
-            total_lines_checked = min(20, len(lines))
             
-            for i in range(total_lines_checked):
-                line = lines[i]
+            for line in islice(iter_text_lines(txt_content), 20):
                 if ':' in line and line.count(':') >= 5:
                     colon_count += 1
             
@@ -205,7 +216,7 @@ class HistoryMailSync:
             if not txt_content:
                 return False
             
-            sample = txt_content[:500] if len(txt_content) > 500 else txt_content
+            sample = text_head(txt_content, 500)
             
             if "00:IFCSUM:" in sample:
                 return True
@@ -213,10 +224,9 @@ class HistoryMailSync:
             if "00NCLCONTAINER LIST" in sample:
                 return False
             
-            lines = txt_content.split('\n')
             import_pattern_count = 0
             
-            for line in lines[:30]:
+            for line in islice(iter_text_lines(txt_content), 30):
                 if line.startswith(('00:', '10:', '11:', '12:', '13:', '16:', '17:', '18:', '41:', '44:', '47:', '51:')):
                     import_pattern_count += 1
             
@@ -236,6 +246,15 @@ class HistoryMailSync:
         keywords = self.email_config['keywords'][keyword_type]
         found_keywords = []
         
+        # 大附件逐行检查，不拼成完整字符串
+        if isinstance(text, ManifestText):
+            found = set()
+            for line in text.iter_lines():
+                found.update(self.check_keywords_in_text(line, keyword_type))
+                if len(found) == len(keywords):
+                    break
+            return [keyword for keyword in keywords if keyword in found]
+        
         for keyword in keywords:
             if keyword.lower() in text.lower():
                 found_keywords.append(keyword)
@@ -254,19 +273,20 @@ class HistoryMailSync:
                 if filename:
                     decoded_filename = self.decode_email_header(filename)
                     
-                    # 读取附件内容
+                    # 只解码TXT附件（含压缩包中的TXT）内容，其他附件只记录文件名
                     try:
-                        file_content = part.get_payload(decode=True)
-                        if isinstance(file_content, bytes):
-                            try:
-                                file_content = file_content.decode('utf-8', errors='ignore')
-                            except:
-                                file_content = file_content.decode('gbk', errors='ignore')
+                        if not is_manifest_candidate(decoded_filename):
+                            attachments.append({
+                                'filename': decoded_filename,
+                                'content': None
+                            })
+                            continue
                         
-                        attachments.append({
-                            'filename': decoded_filename,
-                            'content': file_content
-                        })
+                        for txt_name, file_content in iter_manifest_texts(part, decoded_filename):
+                            attachments.append({
+                                'filename': txt_name,
+                                'content': file_content
+                            })
                     except Exception as e:
                         logging.error(f"读取附件失败: {e}")
         
@@ -298,26 +318,18 @@ class HistoryMailSync:
                 self.stats['no_attachment'] += 1
                 return False
             
-            # 检查是否已处理（检查数据库）
-            for db_file, db_type in [(IMPORT_DB_FILE, 'import'), (EXPORT_DB_FILE, 'export')]:
-                if os.path.exists(db_file):
-                    conn = sqlite3.connect(db_file)
-                    cursor = conn.cursor()
-                    
-                    # 检查keyword_emails表
-                    cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE email_uid = ?', (email_uid,))
-                    if cursor.fetchone()[0] > 0:
-                        logging.info(f"邮件已存在数据库: {email_uid}")
-                        self.stats['already_processed'] += 1
-                        conn.close()
-                        return False
-                    
-                    conn.close()
+            # 检查是否已处理（使用同步开始时加载的UID集合，不再逐封查询数据库）
+            if self.known_uids is None:
+                self.prepare_sync()
+            if email_uid in self.known_uids:
+                logging.info(f"邮件已存在数据库: {email_uid}")
+                self.stats['already_processed'] += 1
+                return False
             
             # 处理每个附件
             processed = False
             for attachment in attachments:
-                if attachment['filename'].lower().endswith('.txt'):
+                if attachment['content'] is not None:
                     txt_content = attachment['content']
                     
                     # 判断舱单类型并同步到对应数据库
@@ -325,16 +337,19 @@ class HistoryMailSync:
                         processed = self.sync_to_import_db(email_uid, subject, from_addr, date, 
                                                          attachment['filename'], txt_content)
                         if processed:
-                            self.stats['import_synced'] += 1
                             break
                     
                     elif self.is_export_manifest(txt_content):
                         processed = self.sync_to_export_db(email_uid, subject, from_addr, date,
                                                          attachment['filename'], txt_content)
                         if processed:
-                            self.stats['export_synced'] += 1
                             break
             
+            # 释放大附件占用的内存映射和临时文件
+            for attachment in attachments:
+                if attachment['content'] is not None:
+                    attachment['content'].close()
+            
             if not processed:
                 logging.info(f"邮件未包含可识别的舱单附件: {subject}")
             
@@ -345,134 +360,81 @@ class HistoryMailSync:
             self.stats['error'] += 1
             return False
     
+    def prepare_sync(self):
+        """每次同步开始时调用一次：迁移表结构，并一次性加载两个数据库中已有的UID"""
+        self.known_uids = set()
+        for db_file in (IMPORT_DB_FILE, EXPORT_DB_FILE):
+            db_schema.migrate(db_file)
+            rows = db_access.query_all(db_file, 'SELECT email_uid FROM keyword_emails')
+            self.known_uids.update(row[0] for row in rows)
+        logging.info(f"数据库中已有 {len(self.known_uids)} 封邮件记录")
+    
+    def queue_sync_record(self, db_file, email_uid, subject, sender, date, filename, matched_keywords_str):
+        """把一条同步记录放入写入缓冲区，攒够一批后写入"""
+        self.pending[db_file].append({
+            'email_uid': email_uid,
+            'sender': sender,
+            'sender_address': sender,
+            'subject': subject,
+            'received_date': date,
+            'received_ts': db_schema.parse_received_ts(date),
+            'matched_keywords': matched_keywords_str,
+            'txt_attachment': filename,
+            'container_count': 0,
+            'attachment_names': filename,
+            'sync_source': 'history_sync'
+        })
+        self.known_uids.add(email_uid)
+        if len(self.pending[db_file]) >= SYNC_BATCH_SIZE:
+            self.flush_pending(db_file)
+    
+    def flush_pending(self, db_file=None):
+        """把缓冲区中的记录批量写入数据库（一个事务），提交后才计入同步数；失败时列出丢弃的记录"""
+        for target in ([db_file] if db_file else list(self.pending)):
+            records, self.pending[target] = self.pending[target], []
+            if not records:
+                continue
+            try:
+                # 明细、每日汇总和关键词索引在同一个事务中写入
+                written = email_store.save_keyword_emails(target, records, replace=False)
+                self.stats[SYNCED_STATS[target]] += written
+                logging.info(f"✅ 已批量写入 {target}: {written} 条")
+            except Exception as e:
+                logging.error(f"批量写入 {target} 失败，丢弃 {len(records)} 条记录: {e}")
+                for record in records:
+                    logging.error(f"   未写入: {record['email_uid']} {record['subject']}")
+                    # 本次同步中不再视为已存在
+                    self.known_uids.discard(record['email_uid'])
+                self.stats['error'] += len(records)
+    
     def sync_to_import_db(self, email_uid, subject, sender, date, filename, content):
         """同步到进口数据库"""
         try:
-            self.ensure_sync_column_exists(IMPORT_DB_FILE)
             # 检查是否包含关键词
             found_keywords = self.check_keywords_in_text(content, 'import')
             matched_keywords_str = ','.join(found_keywords) if found_keywords else '历史同步'
             
-            # 连接进口数据库
-            conn = sqlite3.connect(IMPORT_DB_FILE)
-            cursor = conn.cursor()
-            
-            # 确保表存在
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS keyword_emails (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email_uid TEXT NOT NULL,
-                sender TEXT NOT NULL,
-                sender_address TEXT,
-                subject TEXT NOT NULL,
-                received_date TEXT,
-                processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                matched_keywords TEXT NOT NULL,
-                excel_sent INTEGER DEFAULT 1,
-                txt_attachment TEXT,
-                container_count INTEGER DEFAULT 0,
-                attachment_names TEXT,
-                sync_source TEXT DEFAULT 'history_sync',
-                UNIQUE(email_uid)
-            )
-            ''')
-            
-            # 插入记录
-            cursor.execute('''
-            INSERT OR IGNORE INTO keyword_emails 
-            (email_uid, sender, sender_address, subject, received_date, matched_keywords, 
-             txt_attachment, container_count, attachment_names, sync_source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (email_uid, sender, sender, subject, date, matched_keywords_str,
-                  filename, 0, filename, 'history_sync'))
-            
-            conn.commit()
-            conn.close()
-            
-            logging.info(f"✅ 已同步到进口数据库: {subject}")
-            return True
+            self.queue_sync_record(IMPORT_DB_FILE, email_uid, subject, sender, date, filename,
+                                   matched_keywords_str)
             
-        except Exception as e:
-            logging.error(f"同步到进口数据库失败: {e}")
-            return False
-
-    ##新增
-    def ensure_sync_column_exists(self, db_file):
-        """确保数据库表中有sync_source列"""
-        try:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            
-            # 检查表是否存在
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails'")
-            if not cursor.fetchone():
-                logging.error(f"表keyword_emails不存在于{db_file}")
-                conn.close()
-                return False
-            
-            # 检查列是否存在
-            cursor.execute("PRAGMA table_info(keyword_emails)")
-            columns = [info[1] for info in cursor.fetchall()]
-            
-            if 'sync_source' not in columns:
-                logging.info(f"在{db_file}中添加sync_source列...")
-                cursor.execute("ALTER TABLE keyword_emails ADD COLUMN sync_source TEXT DEFAULT ''")
-                conn.commit()
-                logging.info(f"✅ 已添加sync_source列到{db_file}")
-            
-            conn.close()
+            logging.info(f"已加入进口数据库写入队列: {subject}")
             return True
             
         except Exception as e:
-            logging.error(f"确保sync_source列存在失败: {e}")
+            logging.error(f"同步到进口数据库失败: {e}")
             return False
-
     
     def sync_to_export_db(self, email_uid, subject, sender, date, filename, content):
         """同步到出口数据库"""
         try:
-            self.ensure_sync_column_exists(IMPORT_DB_FILE)
             # 检查是否包含关键词
             found_keywords = self.check_keywords_in_text(content, 'export')
             matched_keywords_str = ','.join(found_keywords) if found_keywords else '历史同步'
             
-            # 连接出口数据库
-            conn = sqlite3.connect(EXPORT_DB_FILE)
-            cursor = conn.cursor()
-            
-            # 确保表存在
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS keyword_emails (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email_uid TEXT NOT NULL,
-                sender TEXT NOT NULL,
-                sender_address TEXT,
-                subject TEXT NOT NULL,
-                received_date TEXT,
-                processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                matched_keywords TEXT NOT NULL,
-                excel_sent INTEGER DEFAULT 1,
-                txt_attachment TEXT,
-                container_count INTEGER DEFAULT 0,
-                attachment_names TEXT,
-                sync_source TEXT DEFAULT 'history_sync',
-                UNIQUE(email_uid)
-            )
-            ''')
-            
-            # 插入记录
-            cursor.execute('''
-            INSERT OR IGNORE INTO keyword_emails 
-            (email_uid, sender, sender_address, subject, received_date, matched_keywords, 
-             txt_attachment, container_count, attachment_names, sync_source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (email_uid, sender, sender, subject, date, matched_keywords_str,
-                  filename, 0, filename, 'history_sync'))
-            
-            conn.commit()
-            conn.close()
-            
-            logging.info(f"✅ 已同步到出口数据库: {subject}")
+            self.queue_sync_record(EXPORT_DB_FILE, email_uid, subject, sender, date, filename,
+                                   matched_keywords_str)
+            
+            logging.info(f"已加入出口数据库写入队列: {subject}")
             return True
             
         except Exception as e:
@@ -491,8 +453,8 @@ class HistoryMailSync:
             logging.info(f"开始同步{folder}文件夹...")
             
             # 连接邮箱服务器
-            server = poplib.POP3_SSL(self.email_config['pop3_server'], 
-                                     self.email_config['pop3_port'], timeout=30)
+            server = get_connection_factory().pop3(self.email_config['pop3_server'], 
+                                                   self.email_config['pop3_port'], timeout=30)
             
             # 登录
             server.user(self.email_config['email_address'])
@@ -515,13 +477,19 @@ class HistoryMailSync:
                 if len(parts) >= 2:
                     uids.append(parts[1])
             
-            # 处理邮件（从最新开始）
-            for i in range(1, process_count + 1):
+            # 建表并加载已有UID（整个同步过程只做一次）
+            self.prepare_sync()
+            
+            # 处理邮件（从最新开始），批量获取邮件内容
+            pipeline = POP3Pipeline(server)
+            for i, result in pipeline.retr_many(range(1, process_count + 1)):
                 try:
                     uid = uids[i-1]
                     
                     # 获取邮件内容
-                    response, lines, _ = server.retr(i)
+                    if isinstance(result, Exception):
+                        raise result
+                    response, lines, _ = result
                     msg_content = b'\r\n'.join(lines).decode('utf-8', errors='ignore')
                     msg = Parser(policy=default).parsestr(msg_content)
                     
@@ -534,13 +502,13 @@ class HistoryMailSync:
                     if i % 10 == 0:
                         logging.info(f"已处理 {i}/{process_count} 封邮件")
                     
-                    # 避免请求过快
-                    time.sleep(0.1)
-                    
                 except Exception as e:
                     logging.error(f"处理第 {i} 封邮件失败: {e}")
                     self.stats['error'] += 1
             
+            # 写入剩余的缓冲记录
+            self.flush_pending()
+            
             # 关闭连接
             server.quit()
             logging.info(f"{folder}文件夹同步完成")
@@ -548,6 +516,8 @@ class HistoryMailSync:
             return True
             
         except Exception as e:
+            # 已解析的记录仍然写入
+            self.flush_pending()
             logging.error(f"同步{folder}文件夹失败: {e}")
             return False
     
@@ -566,8 +536,8 @@ class HistoryMailSync:
             }
             
             # 连接邮箱服务器
-            server = poplib.POP3_SSL(self.email_config['pop3_server'], 
-                                    self.email_config['pop3_port'])
+            server = get_connection_factory().pop3(self.email_config['pop3_server'], 
+                                                   self.email_config['pop3_port'], timeout=30)
             
             # 登录
             server.user(self.email_config['email_address'])
@@ -605,8 +575,12 @@ class HistoryMailSync:
                 if len(parts) >= 2:
                     uids.append(parts[1])
             
-            # 处理邮件（从最新开始）
-            for i in range(1, process_count + 1):
+            # 建表并加载已有UID（整个同步过程只做一次）
+            self.prepare_sync()
+            
+            # 处理邮件（从最新开始），批量获取邮件内容
+            pipeline = POP3Pipeline(server)
+            for i, result in pipeline.retr_many(range(1, process_count + 1)):
                 try:
                     # 检查是否需要停止
                     if progress_callback and not progress_callback(i-1, process_count, f"处理第 {i}/{process_count} 封邮件"):
@@ -617,7 +591,9 @@ class HistoryMailSync:
                     uid = uids[i-1] if (i-1) < len(uids) else str(i)
                     
                     # 获取邮件内容
-                    response, lines, _ = server.retr(i)
+                    if isinstance(result, Exception):
+                        raise result
+                    response, lines, _ = result
                     msg_content = b'\r\n'.join(lines).decode('utf-8', errors='ignore')
                     msg = Parser(policy=default).parsestr(msg_content)
                     
@@ -634,13 +610,13 @@ class HistoryMailSync:
                     if progress_callback:
                         progress_callback(i, process_count, f"已处理 {i}/{process_count} 封邮件")
                     
-                    # 避免请求过快
-                    time.sleep(0.1)
-                    
                 except Exception as e:
                     logging.error(f"处理第 {i} 封邮件失败: {e}")
                     self.stats['error'] += 1
             
+            # 写入剩余的缓冲记录（包括用户中途停止的情况）
+            self.flush_pending()
+            
             # 关闭连接
             server.quit()
             
@@ -662,6 +638,8 @@ class HistoryMailSync:
             }
             
         except Exception as e:
+            # 已解析的记录仍然写入
+            self.flush_pending()
             logging.error(f"同步文件夹失败: {e}")
             import traceback
             logging.error(traceback.format_exc())
@@ -7,24 +7,32 @@ import os
 import logging
 from datetime import datetime, timedelta
 import re
-from openpyxl import Workbook
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
-import sqlite3
-import csv
+import db_access
+import processing_log
+import db_schema
+import email_store
+import manifest_store
+import manifest_goods
+import keyword_rescan
+import goods_index
+from keyword_matcher import KeywordMatcher
+import retention
 from config_manager import ConfigManager
+from mail_connection import get_connection_factory
+from pop3_pipelining import POP3Pipeline
+from attachment_spool import text_head, iter_text_lines, is_manifest_candidate, iter_manifest_texts
+from itertools import islice
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-# 初始化配置管理器
-config_manager = ConfigManager()
-config = config_manager.get_all_configs()
 # 添加统计系统导入
 try:
-    from statistics_system import StatisticsSystem
+    from statistics_system import AttachmentRecorder
     STATS_SYSTEM_AVAILABLE = True
 except ImportError:
     STATS_SYSTEM_AVAILABLE = False
@@ -37,150 +45,150 @@ import urllib.parse
 import urllib.error
 from xml.dom.minidom import parseString
 
-# 配置参数
-email_address = config['email']['import_email']
-password =config['email']['import_password'] 
-pop3_server = config['email']['pop3_server']
-pop3_port = config['email']['pop3_port']
+# 配置参数（导入模块时不读取配置，由 init_config() 显式初始化）
+config_manager = None
+config = None
+email_address = ""
+password = ""
+pop3_server = ""
+pop3_port = 995
 
 # SMTP配置（用于发送回复邮件）
-smtp_server =  config['email']['smtp_server']
-smtp_port = config['email']['smtp_port']
+smtp_server = ""
+smtp_port = 465
 
 # 关键词配置
-keywords = config['keywords']['import']
+keywords = []
+
+# 预先标准化的关键词（按 [keyword_match] 配置的匹配方式，见 keyword_matcher）
+keyword_matcher = KeywordMatcher([])
+
+# 本次运行使用的关键词集合版本（记录在处理日志中，关键词变更后据此重扫，见 keyword_rescan）
+KEYWORD_SET_VERSION = 0
 
 # 关键词 -> 中文货名映射（由配置文件自动维护；未知关键词默认回填英文关键词）
-keyword_translation = config_manager.get_keyword_translation_map()
+keyword_translation = {}
 
-def get_chinese_goods_name(main_keyword: str, fallback_english: str) -> str:
-    """根据关键词获取中文货名（配置缺失时使用英文兜底）"""
-    try:
-        if not main_keyword:
-            return fallback_english
-        return keyword_translation.get(main_keyword, fallback_english)
-    except Exception:
-        return fallback_english
 # SQLite数据库文件（只记录匹配关键词并已回复的邮件）
-db_file = config['files']['import_db']
+db_file = None
 
 # 主日志文件（记录所有邮件的处理状态，按配置自动清理）
-LOG_CSV_FILE = config['files']['import_log']
+LOG_CSV_FILE = None
 
 # 按需求：
 # - 自动检测只检测最近 50 天的邮件
 # - 日志文件每 51 天清理一次（避免日志过大）
 SCAN_DAYS = 50
-try:
-    LOG_RETENTION_DAYS = int(config['settings'].get('log_retention_days', 51))
-except Exception:
-    LOG_RETENTION_DAYS = 51
+LOG_RETENTION_DAYS = 51
 
 # 短信配置
-SMS_ACCOUNT = config['sms']['account']
-SMS_PASSWORD = config['sms']['password']
-SMS_MOBILES = config['sms']['mobiles']
-SMS_CONTENT_TEMPLATE = config['sms']['import_template']
-SMS_API_URL = config['sms']['api_url']
+SMS_ACCOUNT = ""
+SMS_PASSWORD = ""
+SMS_MOBILES = ""
+SMS_CONTENT_TEMPLATE = ""
+SMS_API_URL = ""
 
 
-# 设置日志
-logging.basicConfig(
-    level=logging.DEBUG,  # 改为DEBUG级别，可以看到更多调试信息
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # 只输出到控制台，不保存到文件
-    ]
-)
+def init_config(config_path='config.ini'):
+    """显式初始化配置和日志（可重复调用，只在第一次调用时生效）
+    
+    导入本模块不会读取 config.ini 或设置日志，
+    主控制器、Web界面等只在真正运行处理程序或发送短信时才调用本函数。
+    """
+    global config_manager, config
+    global email_address, password, pop3_server, pop3_port, smtp_server, smtp_port
+    global keywords, keyword_matcher, keyword_translation, db_file, LOG_CSV_FILE, LOG_RETENTION_DAYS
+    global SMS_ACCOUNT, SMS_PASSWORD, SMS_MOBILES, SMS_CONTENT_TEMPLATE, SMS_API_URL
+    
+    if config_manager is not None:
+        return config
+    
+    # 设置日志
+    logging.basicConfig(
+        level=logging.DEBUG,  # 改为DEBUG级别，可以看到更多调试信息
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()  # 只输出到控制台，不保存到文件
+        ]
+    )
+    
+    # 初始化配置管理器
+    config_manager = ConfigManager(config_path)
+    config = config_manager.get_all_configs()
+    
+    email_address = config['email']['import_email']
+    password = config['email']['import_password']
+    pop3_server = config['email']['pop3_server']
+    pop3_port = config['email']['pop3_port']
+    smtp_server = config['email']['smtp_server']
+    smtp_port = config['email']['smtp_port']
+    
+    keywords = config['keywords']['import']
+    match_config = config_manager.get_keyword_match_config()
+    keyword_matcher = KeywordMatcher(keywords, match_config['modes'], match_config['default'])
+    keyword_translation = config_manager.get_keyword_translation_map()
+    
+    db_file = config['files']['import_db']
+    LOG_CSV_FILE = config['files']['import_log']
+    try:
+        LOG_RETENTION_DAYS = int(config['settings'].get('log_retention_days', 51))
+    except Exception:
+        LOG_RETENTION_DAYS = 51
+    
+    SMS_ACCOUNT = config['sms']['account']
+    SMS_PASSWORD = config['sms']['password']
+    SMS_MOBILES = config['sms']['mobiles']
+    SMS_CONTENT_TEMPLATE = config['sms']['import_template']
+    SMS_API_URL = config['sms']['api_url']
+    return config
+
+def get_chinese_goods_name(main_keyword: str, fallback_english: str) -> str:
+    """根据关键词获取中文货名（配置缺失时使用英文兜底）"""
+    try:
+        if not main_keyword:
+            return fallback_english
+        return keyword_translation.get(main_keyword, fallback_english)
+    except Exception:
+        return fallback_english
 
 def init_log_file():
-    """初始化或清理日志文件，只保留 LOG_RETENTION_DAYS 天内的记录"""
+    """初始化处理日志表（首次运行时导入旧CSV日志）；过期记录由后台保留期任务清理"""
     try:
-        # 如果日志文件不存在，创建它并写入标题行
-        if not os.path.exists(LOG_CSV_FILE):
-            with open(LOG_CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['timestamp', 'email_uid', 'sender', 'subject', 
-                                'has_keyword', 'excel_sent', 'matched_keywords', 'container_count'])
-            logging.info(f"✅ 创建日志文件: {LOG_CSV_FILE}")
-            return True
-        
-        # 清理历史日志记录
-        cleanup_old_log_entries()
+        db_schema.migrate(db_file)
+        processing_log.init_processing_log(db_file, LOG_CSV_FILE)
         return True
     except Exception as e:
         logging.error(f"❌ 初始化日志文件失败: {e}")
         return False
 
-def cleanup_old_log_entries():
-    """清理超过 LOG_RETENTION_DAYS 天的日志记录"""
+def is_email_processed(email_uid):
+    """检查邮件是否已在日志中处理过"""
     try:
-        cutoff_time = datetime.now() - timedelta(days=LOG_RETENTION_DAYS)
-        
-        # 读取所有记录
-        rows = []
-        with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            header = next(reader)  # 读取标题行
-            rows.append(header)
-            
-            for row in reader:
-                if len(row) >= 1:
-                    timestamp_str = row[0]
-                    try:
-                        # 解析时间戳
-                        log_time = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                        # 只保留 LOG_RETENTION_DAYS 天内的记录
-                        if log_time >= cutoff_time:
-                            rows.append(row)
-                    except:
-                        # 如果时间戳格式错误，保留该行
-                        rows.append(row)
-        
-        # 写回文件
-        with open(LOG_CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
-        
-        logging.info(f"🗑️ 已清理超过 {LOG_RETENTION_DAYS} 天的日志记录，当前保留 {len(rows)-1} 条记录")
-        return True
+        return processing_log.is_processed(db_file, email_uid)
     except Exception as e:
-        logging.error(f"❌ 清理日志记录失败: {e}")
+        logging.error(f"❌ 检查邮件处理状态失败: {e}")
         return False
 
-def is_email_processed(email_uid):
-    """检查邮件是否已在日志中处理过"""
+def get_processed_uids(uids):
+    """批量检查邮件是否处理过，返回已处理的UID集合"""
     try:
-        if not os.path.exists(LOG_CSV_FILE):
-            return False
-        
-        with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            
-            for row in reader:
-                if len(row) >= 2 and row[1] == email_uid:
-                    return True
-        
-        return False
+        return processing_log.processed_uids(db_file, uids)
     except Exception as e:
         logging.error(f"❌ 检查邮件处理状态失败: {e}")
-        return False
+        return set()
 
-def log_email_processed(email_uid, sender, subject, has_keyword=False, excel_sent=0, matched_keywords="", container_count=0):
-    """记录邮件处理状态到日志文件"""
+def log_email_processed(email_uid, sender, subject, has_keyword=False, excel_sent=0, matched_keywords="", container_count=0,
+                        manifest_hashes="", received_date=""):
+    """记录邮件处理状态到日志表"""
     try:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
         # 截断过长的字段
         sender_display = sender[:100] if len(sender) > 100 else sender
         subject_display = subject[:200] if len(subject) > 200 else subject
         matched_keywords_display = matched_keywords[:100] if len(matched_keywords) > 100 else matched_keywords
         
-        with open(LOG_CSV_FILE, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, email_uid, sender_display, subject_display, 
-                           int(has_keyword), excel_sent, matched_keywords_display, container_count])
+        processing_log.log_processed(db_file, email_uid, sender_display, subject_display,
+                                     has_keyword, excel_sent, matched_keywords_display, container_count,
+                                     manifest_hashes, KEYWORD_SET_VERSION, received_date)
         
         logging.info(f"📝 已记录邮件处理状态: {email_uid}")
         return True
@@ -188,65 +196,76 @@ def log_email_processed(email_uid, sender, subject, has_keyword=False, excel_sen
         logging.error(f"❌ 记录邮件处理状态失败: {e}")
         return False
 
+def store_manifest(txt_name, content):
+    """保存舱单原文（按内容去重），返回哈希；保存失败不影响邮件处理，返回空字符串"""
+    try:
+        manifest_hash = manifest_store.default_store().put(content, txt_name)
+    except Exception as e:
+        logging.warning(f"⚠️ 保存舱单原文失败 {txt_name}: {e}")
+        return ""
+    try:
+        # 全部货物描述写入倒排索引，用于按货名查舱单和关键词变更后的重扫
+        goods_index.index_manifest(db_file, manifest_hash, content, 'import')
+    except Exception as e:
+        logging.warning(f"⚠️ 建立舱单货名索引失败 {txt_name}: {e}")
+    return manifest_hash
+
+def send_rescan_replies():
+    """发送关键词重扫后排队的回复（见 keyword_rescan），发送成功后按正常流程保存关键词邮件"""
+    try:
+        matches = keyword_rescan.queued_replies(db_file)
+    except Exception as e:
+        logging.error(f"❌ 读取重扫回复队列失败: {e}")
+        return 0
+    
+    sent = 0
+    for match in matches:
+        try:
+            container_data = []
+            for container in match['containers']:
+                english_goods = extract_cargo_name(container['goods_description'])
+                container_data.append({
+                    'container_no': container['container_no'],
+                    'english_goods_description': english_goods,
+                    'chinese_goods_description': get_chinese_goods_name(container['keywords'][0], english_goods),
+                    'bill_of_lading': container['bill_of_lading'] or "未知提单号"
+                })
+            
+            excel_filename = f"processed_import_rescan_{match['id']}.xlsx"
+            if create_excel_file(container_data, excel_filename) and \
+                    send_reply_with_attachment_fixed(match['sender'], match['subject'], excel_filename, match['subject'], 'import'):
+                save_keyword_email(
+                    email_uid=match['email_uid'],
+                    sender=match['sender'],
+                    sender_address=extract_email_address(match['sender']),
+                    subject=match['subject'],
+                    received_date=match['received_date'],
+                    matched_keywords=match['keywords'],
+                    container_count=len(container_data),
+                    english_goods_descriptions=",".join(c['english_goods_description'] for c in container_data),
+                    chinese_goods_descriptions=",".join(c['chinese_goods_description'] for c in container_data),
+                    container_data=container_data,
+                    manifest_hash=match['manifest_hash'],
+                    merge=True
+                )
+                keyword_rescan.mark_reply(db_file, match['id'], keyword_rescan.REPLY_SENT)
+                logging.info(f"✅ 已发送重扫回复: {match['subject']}（{match['keywords']}）")
+                sent += 1
+            else:
+                keyword_rescan.mark_reply(db_file, match['id'], keyword_rescan.REPLY_FAILED)
+                logging.error(f"❌ 发送重扫回复失败: {match['subject']}")
+                if os.path.exists(excel_filename):
+                    os.remove(excel_filename)
+        except Exception as e:
+            logging.error(f"❌ 处理重扫回复时出错: {e}")
+            keyword_rescan.mark_reply(db_file, match['id'], keyword_rescan.REPLY_FAILED)
+    return sent
+
 def init_database():
     """初始化数据库 - 只保存匹配到关键词且已发送Excel的邮件"""
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        
-        # 创建已处理邮件表 - 添加中英文货名字段
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS keyword_emails (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email_uid TEXT NOT NULL,
-            sender TEXT NOT NULL,
-            sender_address TEXT,
-            subject TEXT NOT NULL,
-            received_date TEXT,
-            processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            matched_keywords TEXT NOT NULL,
-            excel_sent INTEGER DEFAULT 1,
-            txt_attachment TEXT,
-            container_count INTEGER DEFAULT 0,
-            attachment_names TEXT,
-            english_goods_descriptions TEXT,  -- 新增：英文货名列表
-            chinese_goods_descriptions TEXT,  -- 新增：中文货名列表
-            sync_source TEXT DEFAULT '',  -- 新增：同步来源
-            UNIQUE(email_uid)
-        )
-        ''')
-        
-        # 检查并添加缺失的列（如果表已存在但缺少新列）
-        cursor.execute("PRAGMA table_info(keyword_emails)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # 添加缺失的列
-        if 'english_goods_descriptions' not in columns:
-            cursor.execute('ALTER TABLE keyword_emails ADD COLUMN english_goods_descriptions TEXT')
-            logging.info("🔄 已添加缺失的列: english_goods_descriptions")
-        
-        if 'chinese_goods_descriptions' not in columns:
-            cursor.execute('ALTER TABLE keyword_emails ADD COLUMN chinese_goods_descriptions TEXT')
-            logging.info("🔄 已添加缺失的列: chinese_goods_descriptions")
-        
-        if 'sync_source' not in columns:
-            cursor.execute('ALTER TABLE keyword_emails ADD COLUMN sync_source TEXT DEFAULT ""')
-            logging.info("🔄 已添加缺失的列: sync_source")
-        
-        # 创建索引以提高查询速度
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_uid ON keyword_emails(email_uid)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_date ON keyword_emails(processed_date)')
-        
-        # 清理旧记录（保留最近90天的记录）
-        ninety_days_ago = datetime.now() - timedelta(days=90)
-        cursor.execute('DELETE FROM keyword_emails WHERE processed_date < ?', (ninety_days_ago.strftime('%Y-%m-%d'),))
-        deleted_count = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
-        
-        if deleted_count > 0:
-            logging.info(f"🗑️ 已清理 {deleted_count} 条旧记录（90天前）")
+        # 表结构按 user_version 版本迁移，已是最新版本时只读取一次版本号
+        db_schema.migrate(db_file)
         
         logging.info("✅ 数据库初始化完成")
         return True
@@ -256,25 +275,33 @@ def init_database():
 
 def save_keyword_email(email_uid, sender, sender_address, subject, received_date, matched_keywords, 
                        txt_attachment=None, container_count=0, attachment_names="", 
-                       english_goods_descriptions="", chinese_goods_descriptions=""):
-    """保存匹配到关键词且已发送Excel的邮件信息到数据库"""
+                       english_goods_descriptions="", chinese_goods_descriptions="", container_data=None,
+                       manifest_hash="", merge=False):
+    """
+    保存匹配到关键词且已发送Excel的邮件信息到数据库
+    merge=True 时（关键词重扫补发回复）把新的关键词和箱号并入该邮件已有的记录
+    """
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        
-        # 插入新记录
-        cursor.execute('''
-        INSERT OR REPLACE INTO keyword_emails 
-        (email_uid, sender, sender_address, subject, received_date, matched_keywords, 
-         txt_attachment, container_count, attachment_names, 
-         english_goods_descriptions, chinese_goods_descriptions)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (email_uid, sender, sender_address, subject, received_date, matched_keywords, 
-              txt_attachment, container_count, attachment_names,
-              english_goods_descriptions, chinese_goods_descriptions))
-        
-        conn.commit()
-        conn.close()
+        record = {
+            'email_uid': email_uid,
+            'sender': sender,
+            'sender_address': sender_address,
+            'subject': subject,
+            'received_date': received_date,
+            'received_ts': db_schema.parse_received_ts(received_date),
+            'matched_keywords': matched_keywords,
+            'txt_attachment': txt_attachment,
+            'container_count': container_count,
+            'attachment_names': attachment_names,
+            'english_goods_descriptions': english_goods_descriptions,
+            'chinese_goods_descriptions': chinese_goods_descriptions,
+            'manifest_hash': manifest_hash
+        }
+        # 明细、每日汇总和箱号明细在同一个事务中写入
+        if merge:
+            email_store.merge_keyword_email(db_file, record, containers=container_data, direction='import')
+        else:
+            email_store.save_keyword_email(db_file, record, containers=container_data, direction='import')
         logging.info(f"✅ 关键词邮件已保存到数据库: {subject}")
         return True
     except Exception as e:
@@ -284,16 +311,29 @@ def save_keyword_email(email_uid, sender, sender_address, subject, received_date
 
 
 
+# 附件统计写入器（整个进程共用一个，记录按条数/时间批量写入）
+_attachment_recorder = None
+
+def get_attachment_recorder():
+    """获取附件统计写入器，第一次使用时创建"""
+    global _attachment_recorder
+    if _attachment_recorder is None:
+        _attachment_recorder = AttachmentRecorder('import')
+    return _attachment_recorder
+
+def close_attachment_recorder():
+    """写完缓存中的附件统计记录（程序退出前调用）"""
+    if _attachment_recorder is not None:
+        _attachment_recorder.close()
+
 def add_attachment_statistics(email_uid, sender, sender_address, subject, received_date, 
                              txt_attachment, container_data, matched_keywords):
-    """添加附件统计记录"""
+    """添加附件统计记录（放入写入器缓存，批量写入数据库）"""
     try:
         if not STATS_SYSTEM_AVAILABLE:
             logging.debug("统计系统不可用，跳过统计记录")
             return False
         
-        stats = StatisticsSystem()
-        
         if txt_attachment and container_data:
             # 检查是否包含危险品
             has_dangerous = 1 if container_data and len(container_data) > 0 else 0
@@ -307,10 +347,10 @@ def add_attachment_statistics(email_uid, sender, sender_address, subject, receiv
                 'subject': subject
             }
             
-            # 添加记录
-            success = stats.add_attachment_record('import', attachment_info)
+            # 放入写入器缓存，攒够一批或到时间后统一写入
+            success = get_attachment_recorder().add(attachment_info)
             if success:
-                logging.info(f"✅ 已添加进口附件统计记录: {txt_attachment}")
+                logging.info(f"✅ 已记录进口附件统计: {txt_attachment}")
             return success
         return False
     except Exception as e:
@@ -381,22 +421,15 @@ def extract_email_address(email_string):
         logging.error(f"提取邮箱地址失败: {e}, 原始字符串: {email_string}")
         return email_string
 
-def normalize_keyword(keyword):
-    """标准化关键词（大写并移除空格）"""
-    return keyword.upper().replace(' ', '')
-
 def check_keywords_in_text(text):
-    """检查文本中是否包含关键词（不区分大小写）"""
-    if not text:
-        return []
-    
-    found_keywords = []
-    for keyword in keywords:
-        # 直接使用不区分大小写的搜索
-        if keyword.lower() in text.lower():
-            found_keywords.append(keyword)
-    
-    return found_keywords
+    """检查文本中是否包含关键词（按各关键词配置的匹配方式）"""
+    return keyword_matcher.match(text)
+
+def find_keyword_hits(text):
+    """货物描述中的关键词命中，返回 (关键词列表, 命中的原文片段列表)"""
+    hits = keyword_matcher.find(text)
+    found_keywords = [keyword for keyword in keywords if any(hit.keyword == keyword for hit in hits)]
+    return found_keywords, [hit.text for hit in hits]
 
 
 def get_email_body(msg):
@@ -432,7 +465,7 @@ def is_import_manifest(txt_content):
             return False
         
         # 检查前500个字符
-        sample = txt_content[:500] if len(txt_content) > 500 else txt_content
+        sample = text_head(txt_content, 500)
         
         # 特征1: 进口舱单通常以"00:IFCSUM:"开头
         if "00:IFCSUM:" in sample:
@@ -445,10 +478,9 @@ def is_import_manifest(txt_content):
             return False
         
         # 特征3: 检查是否有典型的进口舱单记录
-        lines = txt_content.split('\n')
         import_pattern_count = 0
         
-        for line in lines[:30]:  # 检查前30行
+        for line in islice(iter_text_lines(txt_content), 30):  # 检查前30行
             if line.startswith(('00:', '10:', '11:', '12:', '13:', '16:', '17:', '18:', '41:', '44:', '47:', '51:')):
                 import_pattern_count += 1
         
@@ -509,90 +541,27 @@ def parse_import_manifest_content(txt_content):
             logging.warning("⚠️ 检测到非进口舱单格式，跳过处理")
             return None
         
-        lines = txt_content.split('\n')
-        
-        # 存储解析结果
+        # 逐个箱子读取箱号、提单号和货物描述（见 manifest_goods），按关键词筛选
         container_data = []
-        current_bl_no = None  # 当前提单号
-        goods_desc_parts = []  # 货物描述部分
         
-        # 存储每个提单对应的货物描述
-        bl_goods_desc = {}
-        
-        for line in lines:
-            # 去掉行尾的单引号和换行符
-            line = line.strip().rstrip("'")
-            
-            if not line:
-                continue
+        for container_no, current_bl_no, goods_desc in manifest_goods.iter_import_goods(txt_content):
+            # 检查货物描述是否包含关键词
+            found_keywords, matched_texts = find_keyword_hits(goods_desc) if goods_desc else ([], [])
+            if goods_desc and found_keywords:
+                # 提取具体的货物名称（英文）
+                english_cargo_name = extract_cargo_name(goods_desc)
                 
-            # 按冒号分割，但保留空字段
-            parts = line.split(':')
-            record_id = parts[0] if len(parts) > 0 else ''
-            
-            # 12行：提单记录开始 - 提取提单号
-            if record_id == '12' and len(parts) > 1:
-                # 如果有之前的提单和货物描述，保存它们
-                if current_bl_no and goods_desc_parts:
-                    # 合并货物描述
-                    combined_desc = ' '.join(goods_desc_parts)
-                    bl_goods_desc[current_bl_no] = combined_desc
-                    goods_desc_parts = []
+                # 获取中文货名：用“匹配到的关键词”去查中文映射，未知则回填英文
+                main_keyword = found_keywords[0]
+                chinese_cargo_name = get_chinese_goods_name(main_keyword, english_cargo_name)
                 
-                # 提单号是第二个字段（索引1）
-                current_bl_no = parts[1] if len(parts) > 1 else ''
-                logging.info(f"开始解析提单: {current_bl_no}")
-            
-            # 44行：唛头信息
-            elif record_id == '44':
-                if len(parts) > 1:
-                    # 合并第2个字段及之后的所有内容
-                    mark_info = ':'.join(parts[1:])
-                    if mark_info and mark_info.strip() and mark_info.strip().upper() != 'N/M':
-                        goods_desc_parts.append(mark_info)
-            
-            # 47行：货物描述
-            elif record_id == '47':
-                if len(parts) > 1:
-                    # 合并第2个字段及之后的所有内容
-                    cargo_desc = ':'.join(parts[1:])
-                    if cargo_desc and cargo_desc.strip() and cargo_desc.strip().upper() != 'N/M':
-                        goods_desc_parts.append(cargo_desc)
-            
-            # 51行：集装箱信息
-            elif record_id == '51':
-                if len(parts) >= 2:
-                    container_no = parts[1]
-                    if container_no and container_no.strip():
-                        # 检查当前提单是否有货物描述
-                        goods_desc = ""
-                        if current_bl_no in bl_goods_desc:
-                            goods_desc = bl_goods_desc[current_bl_no]
-                        elif goods_desc_parts:
-                            goods_desc = ' '.join(goods_desc_parts)
-                        
-                        # 检查货物描述是否包含关键词
-                        found_keywords = check_keywords_in_text(goods_desc) if goods_desc else []
-                        if goods_desc and found_keywords:
-                            # 提取具体的货物名称（英文）
-                            english_cargo_name = extract_cargo_name(goods_desc)
-                            
-                            # 获取中文货名：用“匹配到的关键词”去查中文映射，未知则回填英文
-                            main_keyword = found_keywords[0]
-                            chinese_cargo_name = get_chinese_goods_name(main_keyword, english_cargo_name)
-                            
-                            container_data.append({
-                                'container_no': container_no,
-                                'english_goods_description': english_cargo_name,
-                                'chinese_goods_description': chinese_cargo_name,
-                                'bill_of_lading': current_bl_no if current_bl_no else "未知提单号"
-                            })
-                            logging.info(f"找到匹配的箱号: {container_no}, 提单号: {current_bl_no}, 英文货名: {english_cargo_name}, 中文货名: {chinese_cargo_name}")
-        
-        # 处理最后一个提单
-        if current_bl_no and goods_desc_parts:
-            combined_desc = ' '.join(goods_desc_parts)
-            bl_goods_desc[current_bl_no] = combined_desc
+                container_data.append({
+                    'container_no': container_no,
+                    'english_goods_description': english_cargo_name,
+                    'chinese_goods_description': chinese_cargo_name,
+                    'bill_of_lading': current_bl_no if current_bl_no else "未知提单号"
+                })
+                logging.info(f"找到匹配的箱号: {container_no}, 提单号: {current_bl_no}, 英文货名: {english_cargo_name}, 中文货名: {chinese_cargo_name}, 匹配原文: {matched_texts}")
         
         if not container_data:
             logging.warning("未找到匹配关键词的进口舱单箱号记录")
@@ -607,6 +576,9 @@ def parse_import_manifest_content(txt_content):
 def create_excel_file(container_data, excel_filename):
     """根据解析的数据创建Excel文件 - 四列版本：提单号、箱号、英文货名、中文货名"""
     try:
+        # openpyxl 较重，只在真正生成Excel时才导入
+        from openpyxl import Workbook
+        
         wb = Workbook()
         ws = wb.active
         ws.title = "进口舱单"
@@ -745,7 +717,7 @@ def send_reply_with_attachment_fixed(to_addr, subject, excel_file_path, original
         # 发送邮件
         logging.info("正在连接SMTP服务器...")
         try:
-            server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=30)
+            server = get_connection_factory().smtp(smtp_server, smtp_port, timeout=30)
             logging.info("✅ SMTP_SSL连接成功")
             
             server.ehlo()
@@ -860,6 +832,8 @@ def send_sms_notification(account, password, mobiles, content, error_info=""):
 
 def send_exit_notification(error_info="", is_manual=False):
     """发送程序退出通知"""
+    init_config()
+    
     if not SMS_ACCOUNT or not SMS_PASSWORD or not SMS_MOBILES:
         logging.warning("⚠️ 短信配置不完整，跳过短信通知")
         return False
@@ -873,6 +847,7 @@ def send_exit_notification(error_info="", is_manual=False):
 
 def process_email(msg, email_uid):
     """处理单封邮件"""
+    txt_attachments = []  # 存储TXT附件信息（大附件占用的内存映射和临时文件在 finally 中释放）
     try:
         # 获取邮件基本信息（解码邮件头）
         subject = decode_email_header(msg.get('subject', '无主题'))
@@ -892,7 +867,6 @@ def process_email(msg, email_uid):
         # 收集所有附件文件名
         attachment_filenames = []
         found_keywords_in_attachments = []
-        txt_attachments = []  # 存储TXT附件信息
         
         for part in msg.walk():
             content_disposition = str(part.get("Content-Disposition"))
@@ -909,20 +883,21 @@ def process_email(msg, email_uid):
                     if found_in_filename:
                         found_keywords_in_attachments.extend(found_in_filename)
                     
-                    # 如果是TXT文件，保存附件内容
-                    if decoded_filename.lower().endswith('.txt'):
+                    # 如果是TXT文件或压缩包，保存其中的TXT内容
+                    if is_manifest_candidate(decoded_filename):
                         try:
-                            file_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                            
-                            # 检查是否为进口舱单
-                            if is_import_manifest(file_content):
-                                txt_attachments.append({
-                                    'filename': decoded_filename,
-                                    'content': file_content
-                                })
-                                logging.info(f"📄 发现进口舱单TXT附件: {decoded_filename}")
-                            else:
-                                logging.info(f"📄 跳过非进口舱单TXT附件: {decoded_filename}")
+                            for txt_name, file_content in iter_manifest_texts(part, decoded_filename):
+                                # 检查是否为进口舱单
+                                if is_import_manifest(file_content):
+                                    txt_attachments.append({
+                                        'filename': txt_name,
+                                        'content': file_content,
+                                        'hash': store_manifest(txt_name, file_content)
+                                    })
+                                    logging.info(f"📄 发现进口舱单TXT附件: {txt_name}")
+                                else:
+                                    file_content.close()
+                                    logging.info(f"📄 跳过非进口舱单TXT附件: {txt_name}")
                         except Exception as e:
                             logging.error(f"❌ 读取TXT附件 {decoded_filename} 时出错: {e}")
         
@@ -930,6 +905,7 @@ def process_email(msg, email_uid):
         container_data = None
         matched_keywords_str = ""
         txt_attachment_name = ""
+        manifest_hash = ""
         container_count = 0
         excel_sent = 0
         english_goods_list = []
@@ -946,6 +922,7 @@ def process_email(msg, email_uid):
                 if container_data:
                     container_count = len(container_data)
                     txt_attachment_name = txt_attachment['filename']
+                    manifest_hash = txt_attachment['hash']
                     logging.info(f"✅ 进口舱单附件解析成功，找到 {container_count} 条匹配的数据")
                     
                     # 从所有箱子中收集中英文货名
@@ -988,7 +965,9 @@ def process_email(msg, email_uid):
                                 container_count=container_count,
                                 attachment_names=attachment_names_str,
                                 english_goods_descriptions=english_goods_str,
-                                chinese_goods_descriptions=chinese_goods_str
+                                chinese_goods_descriptions=chinese_goods_str,
+                                container_data=container_data,
+                                manifest_hash=manifest_hash
                             )
                         else:
                             logging.error("❌ 发送回复邮件失败")
@@ -1006,6 +985,8 @@ def process_email(msg, email_uid):
         else:
             logging.info("📭 未发现进口舱单TXT附件")
         
+        manifest_hashes = ",".join(t['hash'] for t in txt_attachments if t['hash'])
+        
         # 合并所有找到的关键词
         all_found_keywords = found_keywords_in_subject + found_keywords_in_body + found_keywords_in_attachments
         
@@ -1031,7 +1012,9 @@ def process_email(msg, email_uid):
                 has_keyword=True,
                 excel_sent=excel_sent,
                 matched_keywords=matched_keywords_str,
-                container_count=container_count
+                container_count=container_count,
+                manifest_hashes=manifest_hashes,
+                received_date=date
             )
             
             return True, from_addr, subject, "keyword_match", matched_keywords_str, excel_sent
@@ -1044,7 +1027,9 @@ def process_email(msg, email_uid):
                 has_keyword=False,
                 excel_sent=0,
                 matched_keywords="",
-                container_count=0
+                container_count=0,
+                manifest_hashes=manifest_hashes,
+                received_date=date
             )
             
             logging.info(f"📭 邮件未匹配关键词 - 主题: {subject}, 发件人: {from_header}")
@@ -1053,6 +1038,10 @@ def process_email(msg, email_uid):
     except Exception as e:
         logging.error(f"❌ 处理邮件时出错: {e}")
         return False, None, None, None, "", 0
+    finally:
+        # 解析、生成Excel或发送失败时也要释放
+        for txt_attachment in txt_attachments:
+            txt_attachment['content'].close()
 
 def get_email_uids(server):
     """安全地获取所有邮件的UID列表"""
@@ -1097,6 +1086,13 @@ def get_email_received_datetime(server, msg_no: int):
     """尽量只获取邮件头部并解析 Date，用于“最近N天扫描”优化"""
     try:
         resp, lines, _ = server.top(msg_no, 0)
+        return parse_received_datetime(lines)
+    except Exception:
+        return None
+
+def parse_received_datetime(lines):
+    """从 TOP 返回的头部行解析 Date"""
+    try:
         raw = b'\r\n'.join(lines).decode('utf-8', errors='ignore')
         msg = Parser(policy=default).parsestr(raw)
         date_hdr = msg.get('Date')
@@ -1112,12 +1108,7 @@ def get_email_received_datetime(server, msg_no: int):
 def get_keyword_emails_count():
     """获取关键词邮件数量（数据库中）"""
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM keyword_emails')
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        return db_access.query_value(db_file, 'SELECT COUNT(*) FROM keyword_emails', default=0)
     except Exception as e:
         logging.error(f"❌ 获取关键词邮件数量失败: {e}")
         return 0
@@ -1125,81 +1116,53 @@ def get_keyword_emails_count():
 def get_today_keyword_emails():
     """获取今天的关键词邮件数量（数据库中）"""
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
         today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (today,))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        return db_access.query_value(db_file, 'SELECT COUNT(*) FROM keyword_emails WHERE processed_day = ?',
+                                     (today,), default=0)
     except Exception as e:
         logging.error(f"❌ 获取今天关键词邮件数量失败: {e}")
         return 0
 
 def view_log_summary():
     """查看日志文件摘要"""
+    init_config()
+    
     try:
-        if not os.path.exists(LOG_CSV_FILE):
-            print(f"❌ 日志文件不存在: {LOG_CSV_FILE}")
-            return
+        db_schema.migrate(db_file)
+        processing_log.init_processing_log(db_file, LOG_CSV_FILE)
         
         print("📊 邮件处理日志摘要（进口舱单）")
         print("=" * 60)
         
-        with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            header = next(reader)  # 读取标题行
-            
-            # 统计信息
-            total_count = 0
-            keyword_count = 0
-            excel_sent_count = 0
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_count = 0
-            
-            for row in reader:
-                total_count += 1
-                if len(row) >= 5 and row[4] == '1':  # has_keyword列
-                    keyword_count += 1
-                if len(row) >= 6 and row[5] == '1':  # excel_sent列
-                    excel_sent_count += 1
-                if len(row) >= 1 and row[0].startswith(today):  # timestamp列
-                    today_count += 1
+        stats = processing_log.summary(db_file)
         
         print(f"📈 统计信息:")
-        print(f"   总处理邮件: {total_count} 封")
-        print(f"   关键词邮件: {keyword_count} 封")
-        print(f"   已发送Excel: {excel_sent_count} 封")
-        print(f"   今日处理邮件: {today_count} 封")
+        print(f"   总处理邮件: {stats['total']} 封")
+        print(f"   关键词邮件: {stats['keyword']} 封")
+        print(f"   已发送Excel: {stats['excel_sent']} 封")
+        print(f"   今日处理邮件: {stats['today']} 封")
         
         # 显示最新记录
         print(f"\n📨 最新处理记录 (最近5条):")
         
-        # 重新读取文件获取最后几行
-        with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # 显示最后5条记录（不包括标题行）
-        for line in lines[-5:]:
-            if line.startswith('timestamp'):
-                continue  # 跳过标题行
+        for entry in processing_log.tail(db_file, 5):
+            timestamp = entry['timestamp']
+            uid = entry['email_uid'][:10] + '...' if len(entry['email_uid']) > 10 else entry['email_uid']
+            sender = entry['sender'][:20] + '...' if len(entry['sender'] or '') > 20 else entry['sender']
+            subject = entry['subject'][:30] + '...' if len(entry['subject'] or '') > 30 else entry['subject']
             
-            parts = line.strip().split(',')
-            if len(parts) >= 4:
-                timestamp = parts[0]
-                uid = parts[1][:10] + '...' if len(parts[1]) > 10 else parts[1]
-                sender = parts[2][:20] + '...' if len(parts[2]) > 20 else parts[2]
-                subject = parts[3][:30] + '...' if len(parts[3]) > 30 else parts[3]
-                
-                print(f"   {timestamp} | {uid} | {sender} | {subject}")
+            print(f"   {timestamp} | {uid} | {sender} | {subject}")
         
     except Exception as e:
         print(f"❌ 查看日志摘要失败: {e}")
 
 def view_database_simple():
     """简单的数据库查看函数"""
+    init_config()
+    
     try:
-        conn = sqlite3.connect(db_file)
+        db_schema.migrate(db_file)
+        conn = db_access.connect(db_file)
         cursor = conn.cursor()
         
         print("📊 关键词邮件数据库（仅包含已发送Excel的邮件）")
@@ -1209,7 +1172,7 @@ def view_database_simple():
         cursor.execute('SELECT COUNT(*) FROM keyword_emails')
         total = cursor.fetchone()[0]
         
-        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = DATE("now")')
+        cursor.execute("SELECT COUNT(*) FROM keyword_emails WHERE processed_day = DATE('now')")
         today = cursor.fetchone()[0]
         
         print(f"📈 统计信息:")
@@ -1260,12 +1223,15 @@ def view_database_simple():
         print(f"❌ 查看数据库失败: {e}")
 
 def main():
+    global KEYWORD_SET_VERSION
+    init_config()
+    
     logging.info("🚀 启动进口舱单邮件处理程序...")
     logging.info(f"📧 邮箱: {email_address}")
     logging.info(f"🔑 关键词: {keywords}")
     logging.info(f"📮 SMTP服务器: {smtp_server}:{smtp_port}")
     logging.info(f"🗄️  关键词邮件数据库: {db_file}")
-    logging.info(f"📝 邮件处理日志: {LOG_CSV_FILE}")
+    logging.info(f"📝 邮件处理日志: {db_file} (processing_log 表)")
     
     # 初始化日志文件
     if not init_log_file():
@@ -1277,6 +1243,10 @@ def main():
         logging.error("❌ 数据库初始化失败，程序退出")
         return
     
+    # 登记本次使用的关键词集合，处理日志记录其版本号
+    KEYWORD_SET_VERSION = keyword_rescan.register_keyword_set(db_file, keywords)
+    logging.info(f"🔑 关键词集合版本: {KEYWORD_SET_VERSION}")
+    
     # 显示统计信息
     keyword_count = get_keyword_emails_count()
     today_keyword = get_today_keyword_emails()
@@ -1285,9 +1255,8 @@ def main():
     
     check_interval = config['settings']['check_interval']
     
-    # 添加一个计数器，每24小时清理一次旧日志
-    cleanup_counter = 0
-    cleanup_interval = config['settings']['log_retention_days'] * 24 * 60 * 60
+    # 后台定期清理过期记录（邮件保留90天，日志保留 LOG_RETENTION_DAYS 天）
+    retention.start_retention_job(db_file, email_days=90, log_days=LOG_RETENTION_DAYS)
     
     try:
         while True:
@@ -1295,15 +1264,9 @@ def main():
                 current_time = time.strftime('%Y-%m-%d %H:%M:%S')
                 logging.info(f"⏰ {current_time} 开始检查新邮件...")
                 
-                # 定期清理日志文件（每24小时一次）
-                cleanup_counter += check_interval
-                if cleanup_counter >= cleanup_interval:
-                    cleanup_old_log_entries()
-                    cleanup_counter = 0
-                
                 # 连接POP3服务器
                 logging.info(f"🔗 正在连接服务器 {pop3_server}:{pop3_port}...")
-                server = poplib.POP3_SSL(pop3_server, pop3_port, timeout=30)
+                server = get_connection_factory().pop3(pop3_server, pop3_port, timeout=30)
                 logging.info("✅ 服务器连接成功！")
                 
                 # 登录邮箱
@@ -1334,42 +1297,43 @@ def main():
 
                 # POP3 的序号通常按时间从旧到新排列：1最旧，N最新。
                 # 这里从最新开始逆序处理，遇到超过 SCAN_DAYS 的邮件则直接停止遍历。
-                for i in range(min(email_count, len(all_uids)), 0, -1):
+                processed_uids = get_processed_uids(all_uids)
+                pending = [i for i in range(min(email_count, len(all_uids)), 0, -1)
+                           if all_uids[i-1] not in processed_uids]
+                pipeline = POP3Pipeline(server)
+
+                # “最近N天”过滤：批量只取头部判断日期
+                to_fetch = []
+                for i, result in pipeline.top_many(pending, 0):
+                    received_dt = None if isinstance(result, Exception) else parse_received_datetime(result[1])
+                    if received_dt and received_dt < cutoff_scan_time:
+                        # 该邮件已早于扫描窗口；因为在倒序遍历，后续只会更旧，直接停止。
+                        break
+                    to_fetch.append(i)
+
+                # 批量获取邮件内容并逐封处理
+                for i, result in pipeline.retr_many(to_fetch):
                     try:
                         uid = all_uids[i-1]
                         
-                        # 检查邮件是否已在日志中处理过
-                        if is_email_processed(uid):
+                        if isinstance(result, Exception):
+                            logging.error(f"❌ 获取第 {i} 封邮件内容失败: {result}")
                             continue
                         
-                        # “最近N天”过滤：尽量只取头部判断日期
-                        received_dt = get_email_received_datetime(server, i)
-                        if received_dt and received_dt < cutoff_scan_time:
-                            break
-
-                        # 安全地获取邮件内容
-                        try:
-                            result = server.retr(i)
-                            if len(result) >= 2:
-                                lines = result[1]
-                                msg_content = b'\r\n'.join(lines).decode('utf-8', errors='ignore')
-                                msg = Parser(policy=default).parsestr(msg_content)
-                                
-                                # 处理邮件
-                                has_match, from_addr, subject, match_type, matched_keywords, excel_sent = process_email(msg, uid)
-                                
-                                if has_match:
-                                    keyword_emails_found += 1
-                                
-                                new_emails_processed += 1
-                                
-                                # 处理完一封邮件后稍作休息，避免服务器压力
-                                time.sleep(0.5)
-                            else:
-                                logging.error(f"❌ 获取第 {i} 封邮件内容失败")
-                        except Exception as e:
-                            logging.error(f"❌ 处理第 {i} 封邮件内容时出错: {e}")
-                            continue
+                        lines = result[1]
+                        msg_content = b'\r\n'.join(lines).decode('utf-8', errors='ignore')
+                        msg = Parser(policy=default).parsestr(msg_content)
+                        
+                        # 处理邮件
+                        has_match, from_addr, subject, match_type, matched_keywords, excel_sent = process_email(msg, uid)
+                        
+                        if has_match:
+                            keyword_emails_found += 1
+                        
+                        new_emails_processed += 1
+                        
+                        # 处理完一封邮件后稍作休息，避免服务器压力
+                        time.sleep(0.5)
                         
                     except Exception as e:
                         logging.error(f"❌ 处理第 {i} 封邮件时出错: {e}")
@@ -1389,6 +1353,10 @@ def main():
                 # 关闭连接
                 server.quit()
                 logging.info("🔌 已断开服务器连接")
+                get_connection_factory().log_handshake_stats()
+                
+                # 发送关键词重扫后排队的回复
+                send_rescan_replies()
                 
                 # 更新统计信息
                 today_keyword = get_today_keyword_emails()
@@ -1419,6 +1387,9 @@ def main():
         logging.error(f"❌ {error_msg}")
         send_exit_notification(str(e)[:100])
         raise  # 重新抛出异常
+    finally:
+        # 退出前写完缓存的附件统计记录
+        close_attachment_recorder()
 
 if __name__ == "__main__":
     try:
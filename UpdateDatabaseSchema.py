@@ -1,84 +1,36 @@
 """
 数据库表结构升级脚本
-用于添加sync_source列和其他必要的字段
+表结构变更统一由 db_schema 按 PRAGMA user_version 版本迁移，处理程序、历史同步和网页端启动时会自动执行；
+本脚本用于手动升级并查看各数据库的表结构版本。
 """
 
-import sqlite3
 import os
+import sqlite3
 
-def check_and_add_column(db_file, table_name, column_name, column_type="TEXT"):
-    """
-    检查并添加列到表中
-    """
-    try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        
-        # 检查表是否存在
-        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-        if not cursor.fetchone():
-            print(f"❌ 表 {table_name} 不存在于 {db_file}")
-            conn.close()
-            return False
-        
-        # 检查列是否存在
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [info[1] for info in cursor.fetchall()]
-        
-        if column_name in columns:
-            print(f"✅ {db_file} 中的 {table_name} 表已存在 {column_name} 列")
-            conn.close()
-            return True
-        else:
-            # 添加列
-            print(f"🔧 正在为 {db_file} 中的 {table_name} 表添加 {column_name} 列...")
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type} DEFAULT ''")
-            conn.commit()
-            print(f"✅ 成功添加 {column_name} 列到 {db_file}")
-            conn.close()
-            return True
-            
-    except Exception as e:
-        print(f"❌ 更新 {db_file} 失败: {e}")
-        return False
+import db_schema
 
-def upgrade_import_db():
-    """升级进口数据库"""
-    if not os.path.exists('processed_emails_import.db'):
-        print("❌ 进口数据库文件不存在")
+def upgrade_db(db_file, label):
+    """升级单个数据库"""
+    if not os.path.exists(db_file):
+        print(f"❌ {label}数据库文件不存在")
         return False
     
     print("=" * 60)
-    print("升级进口数据库表结构")
+    print(f"升级{label}数据库表结构")
     print("=" * 60)
     
-    success = check_and_add_column('processed_emails_import.db', 'keyword_emails', 'sync_source')
-    
-    if success:
-        print("✅ 进口数据库升级完成")
-    else:
-        print("❌ 进口数据库升级失败")
-    
-    return success
-
-def upgrade_export_db():
-    """升级出口数据库"""
-    if not os.path.exists('processed_emails.db'):
-        print("❌ 出口数据库文件不存在")
+    try:
+        before = db_schema.schema_version(db_file)
+        db_schema.migrate(db_file)
+        after = db_schema.schema_version(db_file)
+        if before == after:
+            print(f"✅ {db_file} 已是最新版本 {after}")
+        else:
+            print(f"✅ {db_file} 已从版本 {before} 升级到 {after}")
+        return True
+    except Exception as e:
+        print(f"❌ 更新 {db_file} 失败: {e}")
         return False
-    
-    print("\n" + "=" * 60)
-    print("升级出口数据库表结构")
-    print("=" * 60)
-    
-    success = check_and_add_column('processed_emails.db', 'keyword_emails', 'sync_source')
-    
-    if success:
-        print("✅ 出口数据库升级完成")
-    else:
-        print("❌ 出口数据库升级失败")
-    
-    return success
 
 def check_table_structure(db_file, table_name):
     """检查表结构"""
@@ -103,13 +55,13 @@ def check_table_structure(db_file, table_name):
 def main():
     """主函数"""
     print("数据库表结构升级工具")
-    print("=" * 60)
+    print(f"程序支持的表结构版本: {db_schema.SCHEMA_VERSION}")
     
     # 升级进口数据库
-    import_success = upgrade_import_db()
+    import_success = upgrade_db('processed_emails_import.db', '进口')
     
     # 升级出口数据库
-    export_success = upgrade_export_db()
+    export_success = upgrade_db('processed_emails.db', '出口')
     
     # 显示表结构
     if os.path.exists('processed_emails_import.db'):
@@ -126,4 +78,4 @@ def main():
     print("=" * 60)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,320 @@
+"""
+keyword_emails 按月归档
+保留期清理原来直接删除 90 天前的记录，删掉后就无法再做长期审计；全部留在主库又会拖慢日常查询。
+这里把过期记录按处理月份移入月度归档库：
+    archive/<数据库名>_<YYYY-MM>.db
+归档库中 keyword_emails 的列与主库相同（ID 保持不变），附件名、货名等大文本列用 zlib 压缩存储；
+另有同结构的每日汇总表和只存索引、不存原文的全文索引（contentless FTS5）。
+统计和检索的日期范围覆盖到已归档的月份时，直接读取对应的归档库，结果与主库合并。
+
+整月都已过期的归档库会 VACUUM 压实并设为只读，之后以 immutable 方式打开（不加锁、不检查改动）。
+集装箱明细不归档，归档记录保留 container_count。
+"""
+
+import os
+import re
+import stat
+import time
+import zlib
+import sqlite3
+import logging
+from urllib.request import pathname2url
+
+import db_access
+import email_store
+import email_search
+
+ARCHIVE_DIR = 'archive'
+
+# 归档库中 keyword_emails 的列（与主库相同）
+COLUMNS = [
+    'id', 'email_uid', 'sender', 'sender_address', 'subject', 'received_date', 'processed_date',
+    'matched_keywords', 'excel_sent', 'txt_attachment', 'container_count', 'attachment_names',
+    'english_goods_descriptions', 'chinese_goods_descriptions', 'sync_source', 'processed_day', 'received_ts',
+    'manifest_hash',
+]
+
+# 压缩存储的大文本列
+COMPRESSED_COLUMNS = ['txt_attachment', 'attachment_names', 'english_goods_descriptions', 'chinese_goods_descriptions']
+
+COMPRESS_LEVEL = 9
+
+# 每批归档的行数
+ARCHIVE_CHUNK_SIZE = 500
+
+_MONTH_PATTERN = re.compile(r'_(\d{4}-\d{2})\.db$')
+
+
+def archive_path(db_file, month):
+    """主库某个月份对应的归档库路径"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(db_file)), ARCHIVE_DIR)
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    return os.path.join(directory, f'{stem}_{month}.db')
+
+
+def archive_files(db_file, start_day=None, end_day=None):
+    """与日期范围有重叠的归档库，返回按月份排序的 [(月份, 路径)]"""
+    directory = os.path.dirname(archive_path(db_file, '0000-00'))
+    if not os.path.isdir(directory):
+        return []
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    files = []
+    for name in os.listdir(directory):
+        match = _MONTH_PATTERN.search(name)
+        if not match or name != f'{stem}_{match.group(1)}.db':
+            continue
+        month = match.group(1)
+        if start_day and month < start_day[:7]:
+            continue
+        if end_day and month > end_day[:7]:
+            continue
+        files.append((month, os.path.join(directory, name)))
+    return sorted(files)
+
+
+def is_sealed(path):
+    """归档库是否已封存（文件没有任何写权限）"""
+    return not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _compress(value):
+    if value is None:
+        return None
+    return zlib.compress(str(value).encode('utf-8'), COMPRESS_LEVEL)
+
+
+def _decompress(value):
+    if value is None:
+        return None
+    return zlib.decompress(value).decode('utf-8')
+
+
+def _fts_columns():
+    return [name for name, _ in email_search.FTS_COLUMNS]
+
+
+def _create_schema(conn):
+    column_defs = ', '.join(
+        'id INTEGER PRIMARY KEY' if c == 'id' else
+        'email_uid TEXT NOT NULL UNIQUE' if c == 'email_uid' else
+        f'{c} BLOB' if c in COMPRESSED_COLUMNS else c
+        for c in COLUMNS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS keyword_emails ({column_defs})')
+    # 早先建立的归档库补齐后来增加的列
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(keyword_emails)').fetchall()}
+    for column in COLUMNS:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE keyword_emails ADD COLUMN {column}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_day ON keyword_emails(processed_day)')
+    conn.execute('CREATE TABLE IF NOT EXISTS archive_meta (key TEXT PRIMARY KEY, value TEXT)')
+    email_store.create_rollup_table(conn)
+    try:
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {email_search.FTS_TABLE} USING fts5(
+                {', '.join(_fts_columns())},
+                content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        # SQLite 未启用 FTS5 时归档库只是不能检索
+        pass
+
+
+def _has_fts(conn):
+    return conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                        (email_search.FTS_TABLE,)).fetchone() is not None
+
+
+def _open_for_write(path):
+    """打开归档库用于写入；已封存的先恢复可写"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path) and is_sealed(path):
+        os.chmod(path, 0o644)
+    conn = sqlite3.connect(path, timeout=db_access.BUSY_TIMEOUT_MS / 1000)
+    # 归档库不用 WAL，封存后是一个独立完整的文件
+    conn.execute('PRAGMA journal_mode = DELETE')
+    _create_schema(conn)
+    conn.execute("INSERT OR REPLACE INTO archive_meta (key, value) VALUES ('sealed', '0')")
+    conn.commit()
+    return conn
+
+
+def open_archive(path):
+    """以只读方式打开归档库；已封存的以 immutable 方式打开"""
+    uri = f'file:{pathname2url(os.path.abspath(path))}?mode=ro'
+    if is_sealed(path):
+        uri += '&immutable=1'
+    return sqlite3.connect(uri, uri=True, timeout=db_access.BUSY_TIMEOUT_MS / 1000)
+
+
+def write_archive(path, rows):
+    """把主库的记录（列名 -> 值 的字典）写入归档库，已归档的 email_uid 忽略，返回新增条数"""
+    conn = _open_for_write(path)
+    try:
+        fts = _has_fts(conn)
+        fts_columns = _fts_columns()
+        placeholders = ', '.join('?' * len(COLUMNS))
+        inserted = []
+        with conn:
+            for row in rows:
+                values = [_compress(row[c]) if c in COMPRESSED_COLUMNS else row[c] for c in COLUMNS]
+                cursor = conn.execute(f"INSERT OR IGNORE INTO keyword_emails ({', '.join(COLUMNS)}) "
+                                      f"VALUES ({placeholders})", values)
+                if cursor.rowcount <= 0:
+                    continue
+                inserted.append(row)
+                if fts:
+                    conn.execute(f"INSERT INTO {email_search.FTS_TABLE} (rowid, {', '.join(fts_columns)}) "
+                                 f"VALUES (?{', ?' * len(fts_columns)})",
+                                 [row['id']] + [row[c] for c in fts_columns])
+            email_store.apply_rollup(conn, [(row['processed_day'], None, row['matched_keywords'],
+                                             row['sync_source'] or '', 1, row['container_count'])
+                                            for row in inserted], 1, hourly=False)
+        return len(inserted)
+    finally:
+        conn.close()
+
+
+def seal(path):
+    """压实并封存归档库（设为只读）"""
+    conn = _open_for_write(path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO archive_meta (key, value) VALUES ('sealed', '1')")
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.chmod(path, 0o444)
+    logging.info(f"📦 归档库已封存: {path}（{os.path.getsize(path) / 1024:.1f} KB）")
+
+
+def archive_before(db_file, cutoff_date, chunk_size=ARCHIVE_CHUNK_SIZE, pause=0):
+    """
+    把 processed_date 早于 cutoff_date 的记录移入月度归档库，返回移出的条数
+    每批先写入归档库，再在主库的短事务中删除（同时扣减汇总）；中途中断时重复归档的记录会被忽略。
+    整月都早于 cutoff_date 的归档库随后封存
+    """
+    moved = 0
+    while True:
+        with db_access.connection(db_file) as conn:
+            rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM keyword_emails "
+                                f"WHERE processed_date < ? ORDER BY id LIMIT ?",
+                                (cutoff_date, chunk_size)).fetchall()
+        if not rows:
+            break
+
+        months = {}
+        for values in rows:
+            row = dict(zip(COLUMNS, values))
+            if not row['processed_day']:
+                row['processed_day'] = str(row['processed_date'])[:10]
+            months.setdefault(row['processed_day'][:7], []).append(row)
+        for month, month_rows in months.items():
+            write_archive(archive_path(db_file, month), month_rows)
+
+        with db_access.transaction(db_file) as conn:
+            moved += email_store.delete_rows(conn, [values[0] for values in rows])
+        if len(rows) < chunk_size:
+            break
+        if pause:
+            # 让出写锁，处理程序的写入可以插进来
+            time.sleep(pause)
+
+    for month, path in archive_files(db_file):
+        if month < cutoff_date[:7] and not is_sealed(path):
+            seal(path)
+    return moved
+
+
+def _range_clause(column, start_day, end_day):
+    conditions = []
+    params = []
+    if start_day:
+        conditions.append(f'{column} >= ?')
+        params.append(start_day)
+    if end_day:
+        conditions.append(f'{column} <= ?')
+        params.append(end_day)
+    return ''.join(f' AND {c}' for c in conditions), params
+
+
+def keyword_counts(db_file, start_day=None, end_day=None):
+    """按关键词统计归档邮件数（读各归档库的每日汇总表），返回 ({关键词: 邮件数}, 邮件总数)"""
+    where, params = _range_clause('day', start_day, end_day)
+    counts = {}
+    for _, path in archive_files(db_file, start_day, end_day):
+        conn = open_archive(path)
+        try:
+            for keyword, count in conn.execute(f'''
+                SELECT keyword, SUM(email_count) FROM {email_store.ROLLUP_TABLE}
+                WHERE 1=1{where} GROUP BY keyword
+            ''', params):
+                counts[keyword] = counts.get(keyword, 0) + count
+        finally:
+            conn.close()
+    total = counts.pop(email_store.TOTAL_KEYWORD, 0)
+    return counts, total
+
+
+def daily_counts(db_file, start_day=None, end_day=None, keyword=email_store.TOTAL_KEYWORD):
+    """按天统计归档邮件数（keyword 为空时是全部邮件），返回 {日期: 邮件数}"""
+    where, params = _range_clause('day', start_day, end_day)
+    counts = {}
+    for _, path in archive_files(db_file, start_day, end_day):
+        conn = open_archive(path)
+        try:
+            for day, count in conn.execute(f'''
+                SELECT day, SUM(email_count) FROM {email_store.ROLLUP_TABLE}
+                WHERE keyword = ?{where} GROUP BY day
+            ''', [keyword] + params):
+                counts[day] = counts.get(day, 0) + count
+        finally:
+            conn.close()
+    return counts
+
+
+def search(db_file, text, start_day=None, end_day=None, limit=50):
+    """
+    在归档库中全文检索，返回 (匹配总数, 结果列表)
+    结果字段与 email_search.search 相同，另加 archive_month；按相关度排序，最多返回 limit 条
+    """
+    match = email_search.build_match_query(text)
+    if not match:
+        return 0, []
+    fts = email_search.FTS_TABLE
+    where, params = _range_clause('e.processed_day', start_day, end_day)
+    weights = ', '.join(str(weight) for _, weight in email_search.FTS_COLUMNS)
+    keys = ['id', 'email_uid', 'sender', 'subject', 'processed_date', 'matched_keywords',
+            'container_count', 'english_goods_descriptions', 'chinese_goods_descriptions', 'score']
+
+    total = 0
+    results = []
+    for month, path in archive_files(db_file, start_day, end_day):
+        conn = open_archive(path)
+        try:
+            if not _has_fts(conn):
+                continue
+            total += conn.execute(f'''
+                SELECT COUNT(*) FROM {fts} JOIN keyword_emails e ON e.id = {fts}.rowid
+                WHERE {fts} MATCH ?{where}
+            ''', [match] + params).fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT e.id, e.email_uid, e.sender, e.subject, e.processed_date, e.matched_keywords,
+                       e.container_count, e.english_goods_descriptions, e.chinese_goods_descriptions,
+                       bm25({fts}, {weights}) AS score
+                FROM {fts} JOIN keyword_emails e ON e.id = {fts}.rowid
+                WHERE {fts} MATCH ?{where}
+                ORDER BY score
+                LIMIT ?
+            ''', [match] + params + [int(limit)]).fetchall()
+        finally:
+            conn.close()
+        for values in rows:
+            row = dict(zip(keys, values))
+            row['english_goods_descriptions'] = _decompress(row['english_goods_descriptions'])
+            row['chinese_goods_descriptions'] = _decompress(row['chinese_goods_descriptions'])
+            row['archive_month'] = month
+            results.append(row)
+
+    results.sort(key=lambda row: row['score'])
+    return total, results[:limit]
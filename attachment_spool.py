@@ -0,0 +1,264 @@
+"""
+TXT舱单附件的内容容器
+小附件直接保存在内存；超过阈值的附件边解码边写入临时文件，解析时通过 mmap 按行读取，
+避免整份附件同时以 bytes、str 和 split 后的行列表多份驻留内存。
+压缩附件（.zip/.gz）中的TXT成员同样边解压边写入，不整体解压到内存。
+"""
+
+import binascii
+import gzip
+import io
+import logging
+import mmap
+import os
+import tempfile
+import zipfile
+
+# 超过该大小（字节）的附件写入临时文件
+SPILL_THRESHOLD = 2 * 1024 * 1024
+
+# 流式解码时每次处理的编码文本长度
+_DECODE_CHUNK = 64 * 1024
+
+# 压缩附件限制，防止压缩炸弹
+MAX_ARCHIVE_MEMBERS = 50
+MAX_MEMBER_SIZE = 50 * 1024 * 1024
+MAX_ARCHIVE_TOTAL_SIZE = 200 * 1024 * 1024
+
+MANIFEST_SUFFIXES = ('.txt', '.zip', '.gz')
+
+
+class ManifestText:
+    """附件文本内容：按需读取开头片段或逐行遍历，不一次性解码成完整字符串"""
+
+    def __init__(self, filename, threshold=SPILL_THRESHOLD):
+        self.filename = filename
+        self.threshold = threshold
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def from_part(cls, part, filename, threshold=SPILL_THRESHOLD):
+        """从邮件附件流式解码内容"""
+        text = cls(filename, threshold)
+        cte = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+        payload = part.get_payload(decode=False)
+
+        if isinstance(payload, str) and cte == 'base64':
+            text._write_base64(payload)
+        elif isinstance(payload, str) and cte == 'quoted-printable':
+            for line in io.StringIO(payload):
+                text.write(binascii.a2b_qp(line))
+        else:
+            data = part.get_payload(decode=True)
+            if data:
+                text.write(data)
+        return text.finish()
+
+    @classmethod
+    def from_bytes(cls, filename, data, threshold=SPILL_THRESHOLD):
+        text = cls(filename, threshold)
+        text.write(data)
+        return text.finish()
+
+    def _write_base64(self, payload):
+        pending = ''
+        for start in range(0, len(payload), _DECODE_CHUNK):
+            pending += ''.join(payload[start:start + _DECODE_CHUNK].split())
+            usable = len(pending) - len(pending) % 4
+            if usable:
+                self.write(binascii.a2b_base64(pending[:usable]))
+                pending = pending[usable:]
+        if pending:
+            # 末尾残缺的填充按 email 包的宽松方式补齐
+            pending += '=' * (-len(pending) % 4)
+            try:
+                self.write(binascii.a2b_base64(pending))
+            except binascii.Error:
+                pass
+
+    def write(self, data):
+        """追加解码后的字节，超过阈值时转存到临时文件"""
+        if not data:
+            return
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > self.threshold:
+            self._file = tempfile.TemporaryFile(prefix='manifest_')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+            logging.info(f"💾 附件 {self.filename} 超过 {self.threshold // 1024}KB，已转存临时文件解析")
+
+    def finish(self):
+        """写入结束，大附件建立内存映射"""
+        if self._file is not None and self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def _raw(self):
+        return self._mmap if self._mmap is not None else self._buffer
+
+    def head(self, size=500):
+        """返回开头 size 个字符"""
+        return bytes(self._raw()[:size * 4]).decode('utf-8', errors='ignore')[:size]
+
+    def iter_lines(self):
+        """按 '\\n' 逐行产出文本（与 str.split('\\n') 一致，保留行尾的 '\\r'）"""
+        raw = self._raw()
+        start = 0
+        end = len(raw)
+        while start < end:
+            pos = raw.find(b'\n', start)
+            if pos == -1:
+                pos = end
+            yield bytes(raw[start:pos]).decode('utf-8', errors='ignore')
+            start = pos + 1
+
+    def open_raw(self):
+        """以二进制文件对象的形式读取内容（用于压缩附件）"""
+        if self._file is not None:
+            self._file.seek(0)
+            return self._file
+        return io.BytesIO(self._buffer)
+
+    def read_text(self):
+        """返回完整文本（仅用于需要整体内容的场景）"""
+        return bytes(self._raw()).decode('utf-8', errors='ignore')
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def text_head(content, size=500):
+    """取附件内容开头片段，兼容 str 和 ManifestText"""
+    if isinstance(content, ManifestText):
+        return content.head(size)
+    return content[:size]
+
+
+def iter_text_lines(content):
+    """逐行遍历附件内容，兼容 str 和 ManifestText"""
+    if isinstance(content, ManifestText):
+        return content.iter_lines()
+    return iter(content.split('\n'))
+
+
+def is_manifest_candidate(filename):
+    """附件是否可能包含舱单（TXT或压缩包）"""
+    return bool(filename) and filename.lower().endswith(MANIFEST_SUFFIXES)
+
+
+def iter_manifest_texts(part, filename):
+    """
+    产出附件中可能是舱单的TXT内容 (文件名, ManifestText)
+    .txt 直接解码；.zip 只解压其中的 .txt 成员；.gz 只解压 .txt.gz（与 zip 成员相同的文件名规则）
+    """
+    lower = filename.lower()
+    if lower.endswith('.txt'):
+        yield filename, ManifestText.from_part(part, filename)
+        return
+    if not lower.endswith(('.zip', '.gz')):
+        return
+
+    with ManifestText.from_part(part, filename) as archive:
+        if lower.endswith('.zip'):
+            yield from _iter_zip_members(archive, filename)
+        else:
+            name = filename[:-3]
+            if not name.lower().endswith('.txt'):
+                logging.warning(f"⚠️ 压缩附件 {filename} 解压后不是TXT文件，跳过")
+                return
+            text = _decompress_member(gzip.GzipFile(fileobj=archive.open_raw()), name, filename)
+            if text is not None:
+                yield name, text
+
+
+def _zip_member_name(info):
+    """Windows 压缩工具常以GBK保存中文文件名，zipfile 会按cp437解出乱码"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _iter_zip_members(archive, filename):
+    try:
+        zf = zipfile.ZipFile(archive.open_raw())
+    except (zipfile.BadZipFile, OSError) as e:
+        logging.error(f"❌ 无法读取压缩附件 {filename}: {e}")
+        return
+
+    with zf:
+        members = [info for info in zf.infolist()
+                   if not info.is_dir() and _zip_member_name(info).lower().endswith('.txt')]
+        if len(members) > MAX_ARCHIVE_MEMBERS:
+            logging.warning(f"⚠️ 压缩附件 {filename} 包含 {len(members)} 个TXT文件，超过上限 {MAX_ARCHIVE_MEMBERS}，跳过")
+            return
+
+        total = 0
+        for info in members:
+            name = os.path.basename(_zip_member_name(info))
+            if info.file_size > MAX_MEMBER_SIZE:
+                logging.warning(f"⚠️ 压缩附件 {filename} 中的 {name} 过大（{info.file_size} 字节），跳过")
+                continue
+            if total + info.file_size > MAX_ARCHIVE_TOTAL_SIZE:
+                logging.warning(f"⚠️ 压缩附件 {filename} 解压总量超过上限，停止解压")
+                return
+            try:
+                text = _decompress_member(zf.open(info), name, filename)
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                # 加密或不支持的压缩方式
+                logging.error(f"❌ 解压 {filename} 中的 {name} 失败: {e}")
+                continue
+            if text is not None:
+                total += len(text)
+                yield name, text
+
+
+def _decompress_member(stream, name, archive_name):
+    """边解压边写入 ManifestText，实际解压量超过上限时放弃（不信任压缩包头里的大小）"""
+    text = ManifestText(name)
+    try:
+        with stream:
+            while True:
+                chunk = stream.read(_DECODE_CHUNK)
+                if not chunk:
+                    break
+                if text.size + len(chunk) > MAX_MEMBER_SIZE:
+                    logging.warning(f"⚠️ 压缩附件 {archive_name} 中的 {name} 解压后超过 {MAX_MEMBER_SIZE // 1024 // 1024}MB，跳过")
+                    text.close()
+                    return None
+                text.write(chunk)
+    except (OSError, EOFError, zipfile.BadZipFile) as e:
+        logging.error(f"❌ 解压 {archive_name} 中的 {name} 失败: {e}")
+        text.close()
+        return None
+    logging.info(f"📦 已从压缩附件 {archive_name} 中解压 {name}（{text.size} 字节）")
+    return text.finish()
@@ -21,8 +21,6 @@ def setup_logging():
     )
     return logging.getLogger(__name__)
 
-logger = setup_logging()
-
 def check_config():
     """检查配置文件"""
     print("\n" + "="*60)
@@ -142,6 +140,75 @@ def check_modules():
         except ImportError as e:
             print(f"❌ {module}: {e}")
 
+# 冷启动导入耗时预算（秒）：Web界面和主控制器启动时不应加载 pandas/matplotlib/openpyxl，
+# 处理程序模块导入时不应读取配置或设置日志
+IMPORT_TIME_BUDGETS = [
+    ('web_interface', 'Web管理界面', 2.0),
+    ('AutoRW_MainController_fixed', '主控制器', 0.5),
+    ('InputAutoRW_FullFunc_2_0', '进口处理程序', 0.5),
+    ('OutputAutoRWwithSend_3_0', '出口处理程序', 0.5),
+]
+HEAVY_MODULES = ('pandas', 'matplotlib', 'openpyxl')
+
+def measure_import_time(module_name):
+    """在独立的Python进程中测量模块冷启动导入耗时"""
+    import json
+    import subprocess
+    
+    code = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        f"mod = __import__({module_name!r})\n"
+        "elapsed = time.perf_counter() - t\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "configured = getattr(mod, 'config_manager', None) is not None and hasattr(mod, 'init_config')\n"
+        "sys.__stdout__.write('IMPORT_TIME ' + json.dumps({'elapsed': elapsed, 'heavy': heavy, 'configured': configured}) + '\\n')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='ignore',
+        timeout=60,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith('IMPORT_TIME '):
+            return json.loads(line[len('IMPORT_TIME '):])
+    
+    error_lines = (result.stderr or '').strip().splitlines()
+    return {'error': error_lines[-1] if error_lines else f'退出码 {result.returncode}'}
+
+def check_import_time():
+    """检查Web界面和主控制器的冷启动导入耗时是否在预算内"""
+    print("\n" + "="*60)
+    print("检查冷启动导入耗时")
+    print("="*60)
+    
+    all_ok = True
+    for module_name, label, budget in IMPORT_TIME_BUDGETS:
+        result = measure_import_time(module_name)
+        if 'error' in result:
+            print(f"⚠️ {label} ({module_name}): 无法导入 - {result['error']}")
+            continue
+        
+        problems = []
+        if result['elapsed'] > budget:
+            problems.append(f"超出预算 {budget:.2f}s")
+        if result['heavy']:
+            problems.append(f"导入时加载了重量级依赖 {result['heavy']}")
+        if result['configured']:
+            problems.append("导入时读取了配置")
+        
+        if problems:
+            all_ok = False
+            print(f"❌ {label} ({module_name}): {result['elapsed']:.3f}s - {'; '.join(problems)}")
+        else:
+            print(f"✅ {label} ({module_name}): {result['elapsed']:.3f}s (预算 {budget:.2f}s)")
+    
+    return all_ok
+
 def test_email_config():
     """测试邮件配置"""
     print("\n" + "="*60)
@@ -190,10 +257,16 @@ def main():
     check_keywords()
     check_modules()
     test_email_config()
+    check_import_time()
     
     print("\n" + "="*60)
     print("诊断完成")
     print("="*60)
 
 if __name__ == "__main__":
+    # 只在作为脚本运行时设置诊断日志，测试导入本模块不产生日志文件
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == 'startup':
+        # 只检查冷启动耗时，超出预算时返回非0退出码（可用于CI）
+        sys.exit(0 if check_import_time() else 1)
     main()
\ No newline at end of file
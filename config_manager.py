@@ -5,6 +5,8 @@ import json
 from datetime import datetime
 import logging
 
+import keyword_matcher
+
 # 设置日志记录器
 def setup_logger(name):
     """设置日志记录器"""
@@ -33,7 +35,7 @@ class ConfigManager:
     def _ensure_sections(self):
         """确保所有必要的配置节存在"""
         required_sections = [
-            'email', 'keywords', 'keyword_translation', 'sms', 'files',
+            'email', 'keywords', 'keyword_translation', 'keyword_match', 'sms', 'files',
             'settings', 'web', 'additional_recipients'
         ]
         for section in required_sections:
@@ -345,6 +347,47 @@ class ConfigManager:
             return {}
 
     # （已移除重复的 _sync_keyword_translations / get_keyword_translation_map 实现）
+
+    def get_keyword_match_config(self):
+        """获取关键词匹配方式：{'default': 默认方式, 'modes': {关键词: 方式}}（exact / normalized，见 keyword_matcher）"""
+        result = {'default': keyword_matcher.DEFAULT_MODE, 'modes': {}}
+        try:
+            if not self.config.has_section('keyword_match'):
+                return result
+            for key, value in self.config.items('keyword_match'):
+                value = value.strip().lower()
+                if value not in keyword_matcher.MODES:
+                    self.logger.warning(f"未知的关键词匹配方式: {key} = {value}")
+                    continue
+                if key == '默认匹配方式':
+                    result['default'] = value
+                else:
+                    result['modes'][key] = value
+        except Exception as e:
+            self.logger.error(f"获取关键词匹配方式失败: {e}")
+        return result
+
+    def set_keyword_match_config(self, modes, default=None):
+        """保存关键词匹配方式（modes 为 {关键词: 方式}，替换原有的逐个关键词配置）"""
+        try:
+            if not self.config.has_section('keyword_match'):
+                self.config.add_section('keyword_match')
+            for key in list(self.config['keyword_match'].keys()):
+                if key != '默认匹配方式':
+                    del self.config['keyword_match'][key]
+            if default in keyword_matcher.MODES:
+                self.config.set('keyword_match', '默认匹配方式', default)
+            for keyword, mode in (modes or {}).items():
+                if keyword and keyword.strip() and mode in keyword_matcher.MODES:
+                    self.config.set('keyword_match', keyword.strip(), mode)
+            if self.save_config():
+                self.update_runtime_config()
+                self.logger.info("关键词匹配方式已保存")
+                return True
+            return False
+        except Exception as e:
+            self.logger.error(f"保存关键词匹配方式失败: {e}")
+            return False
     
     # 短信配置
     def get_sms_config(self):
@@ -523,6 +566,7 @@ class ConfigManager:
             return {
                 'email': self.get_email_config(),
                 'keywords': self.get_keywords(),
+                'keyword_match': self.get_keyword_match_config(),
                 'sms': self.get_sms_config(),
                 'files': self.get_file_paths(),
                 'settings': self.get_system_settings(),
@@ -0,0 +1,115 @@
+"""
+集装箱明细表
+解析出的箱号/提单原来只写进回复的Excel，数据库里只有逗号拼接的货名和 container_count，
+要回答“某个箱号有没有被标记过”只能扫描文本。这里在每个数据库中维护 containers 表：
+    email_id         keyword_emails.id
+    container_no     箱号（大写、去空格）
+    bill_of_lading   提单号（大写、去空格，未知时为空）
+    goods_en         英文货名
+    goods_cn         中文货名
+    direction        'import' / 'export'
+按箱号和提单号建立索引；行在保存 keyword_emails 的同一个事务中批量写入，
+keyword_emails 记录被删除时由触发器清理。表结构由 db_schema 的版本迁移调用 create_containers 创建。
+"""
+
+import db_access
+
+# 解析器在缺少提单号时填入的占位文字
+UNKNOWN_BL = '未知提单号'
+
+# IN 查询每批的数量
+LOOKUP_BATCH = 500
+
+def normalize_no(value):
+    """箱号/提单号统一为大写并去掉空白"""
+    return ''.join(str(value or '').split()).upper()
+
+
+def create_containers(db_file):
+    """创建 containers 表、索引和清理触发器"""
+    with db_access.transaction(db_file) as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails'").fetchone():
+            return False
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS containers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id INTEGER NOT NULL,
+                container_no TEXT NOT NULL,
+                bill_of_lading TEXT,
+                goods_en TEXT,
+                goods_cn TEXT,
+                direction TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_containers_container_no ON containers(container_no)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_containers_bill_of_lading ON containers(bill_of_lading)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_containers_email_id ON containers(email_id)')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_containers_cleanup
+            AFTER DELETE ON keyword_emails
+            BEGIN
+                DELETE FROM containers WHERE email_id = OLD.id;
+            END
+        ''')
+    return True
+
+
+def write_containers(conn, email_id, direction, container_data):
+    """在调用方的事务中写入一封邮件解析出的全部箱号（先清掉该邮件原有的行）"""
+    conn.execute('DELETE FROM containers WHERE email_id = ?', (email_id,))
+    rows = []
+    for item in container_data or []:
+        container_no = normalize_no(item.get('container_no'))
+        if not container_no:
+            continue
+        bill_of_lading = item.get('bill_of_lading')
+        bill_of_lading = None if not bill_of_lading or bill_of_lading == UNKNOWN_BL else normalize_no(bill_of_lading)
+        rows.append((email_id, container_no, bill_of_lading,
+                     item.get('english_goods_description', ''),
+                     item.get('chinese_goods_description', ''), direction))
+    if rows:
+        conn.executemany('''
+            INSERT INTO containers (email_id, container_no, bill_of_lading, goods_en, goods_cn, direction)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+
+def lookup(db_file, container_nos=(), bl_nos=()):
+    """
+    按箱号和/或提单号查询，返回字典列表（附带邮件主题、发件人、处理时间、匹配关键词）
+    同时给出两类号码时返回两者的并集
+    """
+    results = []
+    seen = set()
+    with db_access.connection(db_file) as conn:
+        for column, values in (('container_no', container_nos), ('bill_of_lading', bl_nos)):
+            values = sorted({normalize_no(v) for v in values if normalize_no(v)})
+            for start in range(0, len(values), LOOKUP_BATCH):
+                batch = values[start:start + LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(f'''
+                    SELECT c.id, c.container_no, c.bill_of_lading, c.goods_en, c.goods_cn, c.direction,
+                           e.email_uid, e.subject, e.sender, e.processed_date, e.matched_keywords
+                    FROM containers c
+                    JOIN keyword_emails e ON e.id = c.email_id
+                    WHERE c.{column} IN ({placeholders})
+                ''', batch).fetchall()
+                for row in rows:
+                    if row[0] in seen:
+                        continue
+                    seen.add(row[0])
+                    results.append({
+                        'container_no': row[1],
+                        'bill_of_lading': row[2] or '',
+                        'goods_en': row[3] or '',
+                        'goods_cn': row[4] or '',
+                        'direction': row[5],
+                        'email_uid': row[6],
+                        'subject': row[7],
+                        'sender': row[8],
+                        'processed_date': row[9],
+                        'matched_keywords': row[10]
+                    })
+    results.sort(key=lambda item: item['processed_date'] or '', reverse=True)
+    return results
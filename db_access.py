@@ -0,0 +1,215 @@
+"""
+SQLite 数据库访问层
+按数据库文件维护长连接池：连接只在第一次使用时打开，之后反复复用，
+统一启用 WAL（读写互不阻塞）、synchronous=NORMAL 和 busy_timeout，
+新建的数据库文件在建表和切换 WAL 之前设为 auto_vacuum=INCREMENTAL（之后再改需要一次完整 VACUUM，见 retention），
+并依靠 sqlite3 的语句缓存复用已编译的 SQL。
+
+原有代码只需把 sqlite3.connect(db_file) 换成 db_access.connect(db_file)，
+conn.close() 会把连接归还连接池而不是真正关闭。
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+# 等待其他连接释放写锁的最长时间（毫秒）
+BUSY_TIMEOUT_MS = 10000
+
+# 每个连接缓存的已编译语句数量
+STATEMENT_CACHE_SIZE = 256
+
+# 每个数据库最多保留的空闲连接数
+MAX_IDLE_CONNECTIONS = 4
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _ConnectionPool:
+    """单个数据库文件的连接池"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                # 与直接 close() 的语义一致：未提交的修改不保留
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < MAX_IDLE_CONNECTIONS:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _open(self):
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(self.db_file) or os.path.getsize(self.db_file) == 0
+        conn = sqlite3.connect(self.db_file,
+                               timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        try:
+            conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+            if is_new:
+                # 只能在第一张表创建之前、切换 WAL 之前设置
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+            if str(mode).lower() != 'wal':
+                logging.warning(f"⚠️ 数据库 {self.db_file} 无法启用WAL模式，当前为 {mode}")
+            conn.execute('PRAGMA synchronous = NORMAL')
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ 设置数据库参数失败 {self.db_file}: {e}")
+        with self._lock:
+            self.opened += 1
+        return conn
+
+
+class PooledConnection:
+    """借出的连接：用法与 sqlite3.Connection 相同，close() 时归还连接池"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = pool.acquire()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_pool', '_conn'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        # 与 sqlite3.Connection 一致：with 块只负责提交/回滚，不关闭连接
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # 出错路径上漏掉的 close() 也能把连接还回去
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _get_pool(db_file):
+    path = os.path.abspath(db_file)
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = _ConnectionPool(path)
+        return pool
+
+
+def connect(db_file):
+    """从连接池借出一个连接"""
+    return PooledConnection(_get_pool(db_file))
+
+
+@contextmanager
+def connection(db_file):
+    """借出连接，退出时自动归还"""
+    conn = connect(db_file)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction(db_file):
+    """在一个事务中执行，正常退出提交，异常回滚"""
+    conn = connect(db_file)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def query_all(db_file, sql, params=()):
+    """返回所有结果行（元组列表）"""
+    with connection(db_file) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def query_one(db_file, sql, params=()):
+    """返回第一行，没有结果时返回 None"""
+    with connection(db_file) as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def query_value(db_file, sql, params=(), default=None):
+    """返回第一行第一列的值"""
+    row = query_one(db_file, sql, params)
+    if row is None or row[0] is None:
+        return default
+    return row[0]
+
+
+def execute(db_file, sql, params=()):
+    """执行单条写语句并提交，返回影响的行数"""
+    with transaction(db_file) as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def executemany(db_file, sql, seq_of_params):
+    """批量执行写语句并提交，返回影响的行数"""
+    with transaction(db_file) as conn:
+        return conn.executemany(sql, seq_of_params).rowcount
+
+
+def close_all():
+    """关闭所有空闲连接（进程退出前调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def get_pool_stats():
+    """各数据库累计打开的连接数和当前空闲连接数"""
+    with _pools_lock:
+        return {path: {'opened': pool.opened, 'idle': len(pool._idle)}
+                for path, pool in _pools.items()}
@@ -0,0 +1,275 @@
+"""
+数据库表结构版本迁移
+原来两个处理程序的 init_database、UpdateDatabaseSchema.py、历史同步、网页端 ensure_database_exists
+和统计系统 init_database 各自 CREATE TABLE IF NOT EXISTS、用 PRAGMA table_info 检查缺列，
+网页端几乎每个请求都要重复一遍。这里把所有表结构变更按顺序编号，已执行到的版本记录在 PRAGMA user_version：
+    migrate(db_file)  读取一次 user_version，只执行比它新的迁移；同一进程对同一数据库只检查一次
+进口库和出口库使用同一套表结构。新的表结构变更在 MIGRATIONS 末尾追加一项，已发布的迁移不要再修改；
+每个迁移都必须可以重复执行（处理程序和网页端可能同时迁移同一个数据库）。
+
+keyword_emails 的规范化日期列：
+    processed_day  TEXT     'YYYY-MM-DD'，与 DATE(processed_date) 相同，由触发器在插入时写入
+    received_ts    INTEGER  邮件 Date 头对应的 Unix 时间戳（秒），由写入方计算；0 表示无法解析
+"""
+
+import os
+import logging
+from email.utils import parsedate_to_datetime
+
+import db_access
+import processing_log
+import keyword_index
+import email_store
+import container_store
+import keyset_pagination
+import email_search
+import keyword_rescan
+import goods_index
+import retention
+
+# 处理程序和网页端使用的数据库
+DB_FILES = ['processed_emails_import.db', 'processed_emails.db']
+
+# 回填时每批处理的行数
+BACKFILL_BATCH = 5000
+
+# 早期各入口建的 keyword_emails 表可能缺少的列
+KEYWORD_EMAILS_EXTRA_COLUMNS = [
+    ('english_goods_descriptions', 'TEXT'),
+    ('chinese_goods_descriptions', 'TEXT'),
+    ('sync_source', "TEXT DEFAULT ''"),
+]
+
+# 本进程已迁移过的数据库
+_migrated = set()
+
+
+def parse_received_ts(received_date):
+    """把邮件 Date 头解析为 Unix 时间戳，无法解析时返回 0"""
+    if not received_date:
+        return 0
+    try:
+        dt = parsedate_to_datetime(str(received_date))
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        return int(dt.timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return 0
+
+
+def _create_keyword_emails(db_file):
+    """keyword_emails 表；已存在的表补齐缺失的列"""
+    with db_access.transaction(db_file) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS keyword_emails (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_uid TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                sender_address TEXT,
+                subject TEXT NOT NULL,
+                received_date TEXT,
+                processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                matched_keywords TEXT NOT NULL,
+                excel_sent INTEGER DEFAULT 1,
+                txt_attachment TEXT,
+                container_count INTEGER DEFAULT 0,
+                attachment_names TEXT,
+                english_goods_descriptions TEXT,
+                chinese_goods_descriptions TEXT,
+                sync_source TEXT DEFAULT '',
+                UNIQUE(email_uid)
+            )
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(keyword_emails)").fetchall()]
+        for column, column_type in KEYWORD_EMAILS_EXTRA_COLUMNS:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE keyword_emails ADD COLUMN {column} {column_type}')
+                logging.info(f"🔄 {db_file} 已添加列: {column}")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_email_uid ON keyword_emails(email_uid)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_date ON keyword_emails(processed_date)')
+
+
+def _add_normalized_dates(db_file):
+    """processed_day / received_ts 列、触发器和索引，并回填旧数据"""
+    with db_access.transaction(db_file) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(keyword_emails)").fetchall()]
+        if 'processed_day' not in columns:
+            conn.execute('ALTER TABLE keyword_emails ADD COLUMN processed_day TEXT')
+            logging.info(f"🔄 {db_file} 已添加列: processed_day")
+        if 'received_ts' not in columns:
+            conn.execute('ALTER TABLE keyword_emails ADD COLUMN received_ts INTEGER')
+            logging.info(f"🔄 {db_file} 已添加列: received_ts")
+
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_keyword_emails_processed_day
+            AFTER INSERT ON keyword_emails
+            WHEN NEW.processed_day IS NULL
+            BEGIN
+                UPDATE keyword_emails SET processed_day = DATE(NEW.processed_date) WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_keyword_emails_processed_day_update
+            AFTER UPDATE OF processed_date ON keyword_emails
+            BEGIN
+                UPDATE keyword_emails SET processed_day = DATE(NEW.processed_date) WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_keyword_emails_day ON keyword_emails(processed_day, processed_date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_keyword_emails_received_ts ON keyword_emails(received_ts)')
+
+    _backfill(db_file)
+
+
+def _backfill(db_file):
+    """按ID区间分批回填旧记录，避免长时间占用写锁"""
+    max_id = db_access.query_value(db_file, 'SELECT MAX(id) FROM keyword_emails', default=0)
+    filled_days = 0
+    filled_ts = 0
+
+    for low in range(0, max_id + 1, BACKFILL_BATCH):
+        high = low + BACKFILL_BATCH
+        with db_access.transaction(db_file) as conn:
+            filled_days += conn.execute('''
+                UPDATE keyword_emails SET processed_day = DATE(processed_date)
+                WHERE id >= ? AND id < ? AND processed_day IS NULL AND processed_date IS NOT NULL
+            ''', (low, high)).rowcount
+
+            rows = conn.execute('''
+                SELECT id, received_date FROM keyword_emails
+                WHERE id >= ? AND id < ? AND received_ts IS NULL
+            ''', (low, high)).fetchall()
+            if rows:
+                conn.executemany('UPDATE keyword_emails SET received_ts = ? WHERE id = ?',
+                                 [(parse_received_ts(received_date), row_id) for row_id, received_date in rows])
+                filled_ts += len(rows)
+
+    if filled_days or filled_ts:
+        logging.info(f"🔄 {db_file} 已回填 processed_day {filled_days} 条，received_ts {filled_ts} 条")
+
+
+def _create_attachment_tables(db_file):
+    """统计系统的附件记录表（import_attachments / export_attachments）"""
+    with db_access.transaction(db_file) as conn:
+        for direction in ('import', 'export'):
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {direction}_attachments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    attachment_name TEXT NOT NULL,
+                    process_date DATE NOT NULL,
+                    has_dangerous INTEGER DEFAULT 0,
+                    matched_keywords TEXT,
+                    sender_email TEXT,
+                    subject TEXT,
+                    created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(attachment_name, process_date)
+                )
+            ''')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{direction}_att_date ON {direction}_attachments(process_date)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{direction}_att_dangerous ON {direction}_attachments(has_dangerous)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{direction}_att_keywords ON {direction}_attachments(matched_keywords)')
+
+
+def _create_keyword_index(db_file):
+    for table in keyword_index.JUNCTIONS:
+        keyword_index.create_index(db_file, table)
+
+
+def _create_version_tracking(db_file):
+    # 网页列表的总数缓存据此失效
+    keyset_pagination.create_version_tracking(db_file, 'keyword_emails', ('processed_date', 'matched_keywords'))
+
+
+def _create_attachment_version_tracking(db_file):
+    # 统计系统的查询缓存据此失效
+    for direction in ('import', 'export'):
+        keyset_pagination.create_version_tracking(db_file, f'{direction}_attachments',
+                                                  ('process_date', 'has_dangerous', 'matched_keywords'))
+
+
+def _add_manifest_references(db_file):
+    """舱单原文（见 manifest_store）的哈希引用列"""
+    with db_access.transaction(db_file) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(keyword_emails)").fetchall()]
+        if 'manifest_hash' not in columns:
+            conn.execute("ALTER TABLE keyword_emails ADD COLUMN manifest_hash TEXT DEFAULT ''")
+            logging.info(f"🔄 {db_file} 已添加列: manifest_hash")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_keyword_emails_manifest ON keyword_emails(manifest_hash)')
+    processing_log.add_manifest_column(db_file)
+
+
+def _create_search(db_file):
+    # 全文检索依赖 FTS5，不可用时只是检索不可用，不阻止升级
+    email_search.create_search(db_file)
+
+
+# (版本号, 说明, 迁移函数)，按版本号递增排列
+MIGRATIONS = [
+    (1, '创建 keyword_emails 表并补齐缺失列', _create_keyword_emails),
+    (2, '规范化日期列 processed_day / received_ts', _add_normalized_dates),
+    (3, '处理日志表', processing_log.create_tables),
+    (4, '附件统计表', _create_attachment_tables),
+    (5, '关键词关联索引', _create_keyword_index),
+    (6, '每日汇总表', email_store.create_rollup),
+    (7, '集装箱明细表', container_store.create_containers),
+    (8, '列表写入版本号', _create_version_tracking),
+    (9, '全文检索索引', _create_search),
+    (10, '附件统计表写入版本号', _create_attachment_version_tracking),
+    (11, '舱单原文哈希引用', _add_manifest_references),
+    (12, '关键词集合版本与重扫结果', keyword_rescan.create_tables),
+    (13, '货物描述倒排索引', goods_index.create_tables),
+    (14, '按小时汇总表', email_store.create_hourly_rollup),
+    (15, '增量回收模式检查（已有数据库需离线转换）', retention.check_vacuum_mode),
+    (16, '处理日志记录邮件日期', processing_log.add_received_date_column),
+    (17, '处理日志每日计数', processing_log.create_daily_totals),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db_file):
+    """数据库当前的表结构版本"""
+    return db_access.query_value(db_file, 'PRAGMA user_version', default=0)
+
+
+def _set_version(db_file, version):
+    """记录已执行到的版本；并发迁移时不回退其他进程已写入的更高版本"""
+    with db_access.connection(db_file) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < version:
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def migrate(db_file):
+    """把数据库升级到 SCHEMA_VERSION；已是最新版本时只读取一次 user_version"""
+    key = os.path.abspath(db_file)
+    if key in _migrated:
+        return True
+
+    version = schema_version(db_file)
+    if version > SCHEMA_VERSION:
+        logging.warning(f"⚠️ {db_file} 的表结构版本 {version} 高于程序支持的 {SCHEMA_VERSION}，请更新程序")
+    for target, description, step in MIGRATIONS:
+        if target <= version:
+            continue
+        step(db_file)
+        _set_version(db_file, target)
+        logging.info(f"🔄 {db_file} 表结构已升级到版本 {target}: {description}")
+
+    _migrated.add(key)
+    return True
+
+
+def migrate_all(db_files=DB_FILES):
+    """迁移已存在的数据库文件，返回 {数据库: 迁移后的版本}"""
+    versions = {}
+    for db_file in db_files:
+        if os.path.exists(db_file):
+            migrate(db_file)
+            versions[db_file] = schema_version(db_file)
+    return versions
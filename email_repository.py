@@ -0,0 +1,220 @@
+"""
+进口/出口合并查询
+系统状态、关键词统计、每日统计原来分别连接进口库和出口库、各查几次，再在 Python 里合并。
+这里用一个内存主库连接 ATTACH 两个数据库（import_db / export_db），合并统计用一条
+UNION ALL 语句完成；连接在本模块的小连接池中复用，ATTACH 只在打开连接时做一次。
+连接设置为 query_only，只用于读取。
+关键词统计和每日统计的日期范围覆盖到已归档的月份时，合并月度归档库（见 archive_store）的汇总。
+bucket_counts 在 SQL 里按小时/天/周/月分组，趋势图（见 trends）每个库只取回每个时间段一行。
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import db_access
+import db_schema
+import email_store
+import archive_store
+
+# 方向 -> 数据库文件
+DATABASES = {
+    'import': 'processed_emails_import.db',
+    'export': 'processed_emails.db',
+}
+
+# 每个仓库最多保留的空闲连接数
+MAX_IDLE_CONNECTIONS = 4
+
+# 时间段的分组表达式（作用于每日汇总表的 day 列）：周以周一的日期表示，月为 'YYYY-MM'
+BUCKET_EXPRESSIONS = {
+    'day': 'day',
+    'week': "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+    'month': 'substr(day, 1, 7)',
+}
+
+
+def schema_name(direction):
+    """方向对应的 ATTACH 名"""
+    return f'{direction}_db'
+
+
+class EmailRepository:
+    """进口库和出口库的合并只读查询"""
+
+    def __init__(self, databases=None):
+        self.databases = dict(databases or DATABASES)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def available(self):
+        """数据库文件存在的方向"""
+        return [d for d, db_file in self.databases.items() if os.path.exists(db_file)]
+
+    def _open(self):
+        conn = sqlite3.connect(':memory:', timeout=db_access.BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False,
+                               cached_statements=db_access.STATEMENT_CACHE_SIZE)
+        conn.execute(f'PRAGMA busy_timeout = {db_access.BUSY_TIMEOUT_MS}')
+        return [conn, set()]
+
+    def _attach(self, entry):
+        """把已存在的数据库文件挂到连接上（文件后来才创建的也会补挂）"""
+        conn, attached = entry
+        for direction, db_file in self.databases.items():
+            if direction in attached or not os.path.exists(db_file):
+                continue
+            db_schema.migrate(db_file)
+            conn.execute('PRAGMA query_only = 0')
+            conn.execute('ATTACH DATABASE ? AS ' + schema_name(direction), (os.path.abspath(db_file),))
+            attached.add(direction)
+        conn.execute('PRAGMA query_only = 1')
+
+    @contextmanager
+    def connection(self):
+        """借出一个已挂好数据库的连接，返回 (连接, 已挂载的方向集合)"""
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+        if entry is None:
+            entry = self._open()
+        try:
+            self._attach(entry)
+            yield entry[0], set(entry[1])
+        except Exception:
+            entry[0].close()
+            raise
+        else:
+            if entry[0].in_transaction:
+                entry[0].rollback()
+            with self._lock:
+                if len(self._idle) < MAX_IDLE_CONNECTIONS:
+                    self._idle.append(entry)
+                    return
+            entry[0].close()
+
+    def _union(self, select_sql, params=(), directions=None):
+        """
+        对每个库执行同一个查询并 UNION ALL，返回结果行（第一列为方向）
+        select_sql 中的 {db} 替换为各库的 ATTACH 名，params 每个库各用一份
+        """
+        with self.connection() as (conn, attached):
+            wanted = [d for d in self.databases if d in attached and (directions is None or d in directions)]
+            if not wanted:
+                return []
+            sql = ' UNION ALL '.join(f"SELECT '{d}', * FROM ({select_sql.format(db=schema_name(d))})"
+                                     for d in wanted)
+            return conn.execute(sql, list(params) * len(wanted)).fetchall()
+
+    def status_counts(self, today):
+        """各库的邮件总数和今日邮件数，返回 {方向: {'total': 总数, 'today': 今日}}"""
+        rows = self._union('''
+            SELECT (SELECT COUNT(*) FROM {db}.keyword_emails),
+                   (SELECT COUNT(*) FROM {db}.keyword_emails WHERE processed_day = ?)
+        ''', (today,))
+        return {direction: {'total': total, 'today': today_count} for direction, total, today_count in rows}
+
+    def keyword_counts(self, start_day=None, end_day=None):
+        """按关键词统计各库的邮件数（读每日汇总表），返回 {方向: ({关键词: 邮件数}, 邮件总数)}"""
+        where, params = _range_clause(start_day, end_day)
+        rows = self._union(f'''
+            SELECT keyword, SUM(email_count) FROM {{db}}.{email_store.ROLLUP_TABLE}
+            WHERE 1=1{where}
+            GROUP BY keyword
+        ''', params)
+
+        results = {direction: ({}, 0) for direction in self.available()}
+        for direction, keyword, count in rows:
+            counts, total = results.setdefault(direction, ({}, 0))
+            if keyword == email_store.TOTAL_KEYWORD:
+                results[direction] = (counts, count)
+            else:
+                counts[keyword] = count
+
+        for direction, (counts, total) in results.items():
+            archived, archived_total = archive_store.keyword_counts(self.databases[direction], start_day, end_day)
+            for keyword, count in archived.items():
+                counts[keyword] = counts.get(keyword, 0) + count
+            ordered = dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+            results[direction] = (ordered, total + archived_total)
+        return results
+
+    def daily_counts(self, start_day=None, end_day=None, directions=None):
+        """按天统计各库的邮件数（读每日汇总表），返回 {方向: {日期: 邮件数}}"""
+        where, params = _range_clause(start_day, end_day)
+        rows = self._union(f'''
+            SELECT day, SUM(email_count) FROM {{db}}.{email_store.ROLLUP_TABLE}
+            WHERE keyword = ?{where}
+            GROUP BY day
+        ''', [email_store.TOTAL_KEYWORD] + params, directions)
+
+        results = {direction: {} for direction in self.available()
+                   if directions is None or direction in directions}
+        for direction, day, count in rows:
+            results.setdefault(direction, {})[day] = count
+
+        for direction, counts in results.items():
+            for day, count in archive_store.daily_counts(self.databases[direction], start_day, end_day).items():
+                counts[day] = counts.get(day, 0) + count
+        return results
+
+    def bucket_counts(self, resolution, start, end, directions=None, keyword=email_store.TOTAL_KEYWORD):
+        """
+        按时间段统计各库的邮件数，返回 {方向: {时间段: 邮件数}}
+        resolution 为 'hour' 时 start/end 为 'YYYY-MM-DD HH'，读按小时汇总表（只有总数，keyword 不生效）；
+        否则 start/end 为日期，读每日汇总表并在 SQL 中分组，覆盖到已归档的月份时合并归档库的每日汇总
+        """
+        if resolution == 'hour':
+            rows = self._union(f'''
+                SELECT hour, SUM(email_count) FROM {{db}}.{email_store.HOURLY_TABLE}
+                WHERE hour >= ? AND hour <= ?
+                GROUP BY hour
+            ''', [start, end], directions)
+        else:
+            bucket = BUCKET_EXPRESSIONS[resolution]
+            rows = self._union(f'''
+                SELECT {bucket}, SUM(email_count) FROM {{db}}.{email_store.ROLLUP_TABLE}
+                WHERE keyword = ? AND day >= ? AND day <= ?
+                GROUP BY 1
+            ''', [keyword, start, end], directions)
+
+        results = {direction: {} for direction in self.available()
+                   if directions is None or direction in directions}
+        for direction, key, count in rows:
+            results.setdefault(direction, {})[key] = count
+
+        if resolution != 'hour':
+            for direction, counts in results.items():
+                for day, count in archive_store.daily_counts(self.databases[direction], start, end, keyword).items():
+                    key = day_bucket(day, resolution)
+                    counts[key] = counts.get(key, 0) + count
+        return results
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+def day_bucket(day, resolution):
+    """日期 'YYYY-MM-DD' 所在的时间段（与 BUCKET_EXPRESSIONS 一致）"""
+    if resolution == 'week':
+        date = datetime.strptime(day, '%Y-%m-%d')
+        return (date - timedelta(days=date.weekday())).strftime('%Y-%m-%d')
+    if resolution == 'month':
+        return day[:7]
+    return day
+
+
+def _range_clause(start_day, end_day):
+    conditions = []
+    params = []
+    if start_day:
+        conditions.append('day >= ?')
+        params.append(start_day)
+    if end_day:
+        conditions.append('day <= ?')
+        params.append(end_day)
+    return ''.join(f' AND {c}' for c in conditions), params
@@ -0,0 +1,140 @@
+"""
+keyword_emails 全文检索
+在每个数据库中建立外部内容 FTS5 表 keyword_emails_fts，索引主题、发件人和中英文货名，
+由触发器随 keyword_emails 的增删改同步；第一次创建时用 'rebuild' 从现有数据生成。
+查询语法：空格分隔的词都要出现（AND），以 * 结尾的词按前缀匹配，例如 "nitr* 上海"。
+结果按 bm25 相关度排序，主题和货名的权重高于发件人。
+索引由 db_schema 的版本迁移调用 create_search 创建；SQLite 未启用 FTS5 时检索不可用，写入不受影响。
+"""
+
+import os
+import sqlite3
+import logging
+
+import db_access
+
+FTS_TABLE = 'keyword_emails_fts'
+
+# 参与索引的列及其 bm25 权重
+FTS_COLUMNS = [
+    ('subject', 3.0),
+    ('sender', 1.0),
+    ('sender_address', 1.0),
+    ('english_goods_descriptions', 2.0),
+    ('chinese_goods_descriptions', 2.0),
+]
+
+# 本进程已确认建有全文索引的数据库
+_available = set()
+
+
+def create_search(db_file):
+    """创建 FTS5 表和同步触发器；SQLite 不支持 FTS5 时返回 False"""
+    columns = [name for name, _ in FTS_COLUMNS]
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{c}' for c in columns)
+    old_values = ', '.join(f'OLD.{c}' for c in columns)
+
+    try:
+        with db_access.transaction(db_file) as conn:
+            if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails'").fetchone():
+                return False
+            exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                                  (FTS_TABLE,)).fetchone()
+            conn.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                    {column_list},
+                    content='keyword_emails', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{FTS_TABLE}_insert AFTER INSERT ON keyword_emails
+                BEGIN
+                    INSERT INTO {FTS_TABLE} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{FTS_TABLE}_delete AFTER DELETE ON keyword_emails
+                BEGIN
+                    INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{FTS_TABLE}_update AFTER UPDATE OF {column_list} ON keyword_emails
+                BEGIN
+                    INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+                    INSERT INTO {FTS_TABLE} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+                END
+            ''')
+            if not exists:
+                conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+                logging.info(f"🔄 {db_file} 已建立全文检索索引")
+    except sqlite3.OperationalError as e:
+        logging.warning(f"⚠️ {db_file} 无法建立全文检索索引（SQLite 可能未启用 FTS5）: {e}")
+        return False
+    return True
+
+
+def available(db_file):
+    """数据库中是否建有全文索引"""
+    key = os.path.abspath(db_file)
+    if key in _available:
+        return True
+    if db_access.query_one(db_file, "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                           (FTS_TABLE,)) is None:
+        return False
+    _available.add(key)
+    return True
+
+
+def build_match_query(text):
+    """把用户输入转换为 FTS5 MATCH 表达式：每个词加引号转义，结尾的 * 保留为前缀匹配"""
+    terms = []
+    for word in (text or '').split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if not word:
+            continue
+        terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms)
+
+
+def search(db_file, text, start_day=None, end_day=None, limit=50, offset=0):
+    """
+    全文检索，返回 (匹配总数, 结果列表)
+    结果按相关度排序，每条包含 score（bm25，越小越相关）
+    """
+    match = build_match_query(text)
+    if not match or not available(db_file):
+        return 0, []
+
+    conditions = [f'{FTS_TABLE} MATCH ?']
+    params = [match]
+    if start_day:
+        conditions.append('e.processed_day >= ?')
+        params.append(start_day)
+    if end_day:
+        conditions.append('e.processed_day <= ?')
+        params.append(end_day)
+    where = ' AND '.join(conditions)
+    weights = ', '.join(str(weight) for _, weight in FTS_COLUMNS)
+
+    with db_access.connection(db_file) as conn:
+        total = conn.execute(f'''
+            SELECT COUNT(*) FROM {FTS_TABLE} JOIN keyword_emails e ON e.id = {FTS_TABLE}.rowid
+            WHERE {where}
+        ''', params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT e.id, e.email_uid, e.sender, e.subject, e.processed_date, e.matched_keywords,
+                   e.container_count, e.english_goods_descriptions, e.chinese_goods_descriptions,
+                   bm25({FTS_TABLE}, {weights}) AS score
+            FROM {FTS_TABLE} JOIN keyword_emails e ON e.id = {FTS_TABLE}.rowid
+            WHERE {where}
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        ''', params + [int(limit), int(offset)]).fetchall()
+
+    keys = ['id', 'email_uid', 'sender', 'subject', 'processed_date', 'matched_keywords',
+            'container_count', 'english_goods_descriptions', 'chinese_goods_descriptions', 'score']
+    return total, [dict(zip(keys, row)) for row in rows]
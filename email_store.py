@@ -0,0 +1,387 @@
+"""
+keyword_emails 写入入口与每日汇总表
+仪表盘和图表原来按天逐日 COUNT(*)，每天每个库各开一次连接。这里维护一张汇总表
+keyword_email_daily（日期 × 关键词 × 同步来源 → 邮件数、集装箱总数），
+所有写入 keyword_emails 的地方都经过本模块，在同一个事务里更新汇总；
+进口/出口分别在各自的数据库中，数据库本身就是方向维度。
+
+keyword 为空字符串的行是当天的邮件总数（一封邮件匹配多个关键词时只计一次）。
+按小时的汇总表 keyword_email_hourly（小时 → 邮件数、集装箱总数，只有总数）供趋势图的小时粒度使用，
+与每日汇总表一样由 apply_rollup 在同一个事务中更新，不用触发器：每日汇总要拆分关键词串，只能在 Python 中做，
+两张表走同一条路径，写入、删除、归档和重建时的处理才不会出现一边更新、另一边漏掉的情况。
+关键词关联表（见 keyword_index）、集装箱明细（见 container_store）和全文检索索引（见 email_search）
+也在同一个事务中维护。表结构由 db_schema 的版本迁移创建，写入前不再逐次检查。
+汇总与明细不一致时可以重建：
+    python email_store.py rebuild [数据库文件 ...]
+"""
+
+import os
+import sys
+import time
+import logging
+
+import db_access
+import keyword_index
+import container_store
+from keyword_index import split_keywords
+
+ROLLUP_TABLE = 'keyword_email_daily'
+
+HOURLY_TABLE = 'keyword_email_hourly'
+
+# processed_date 对应的小时（'YYYY-MM-DD HH'）
+HOUR_FORMAT = '%Y-%m-%d %H'
+
+# 汇总表中代表“全部邮件”的关键词
+TOTAL_KEYWORD = ''
+
+DEFAULT_DB_FILES = ['processed_emails_import.db', 'processed_emails.db']
+
+# 按保留期清理时每个事务删除的行数
+PURGE_CHUNK_SIZE = 500
+
+# 汇总用的列：日期、小时、关键词串、来源、集装箱数
+_ROW_COLUMNS = (f"processed_day, strftime('{HOUR_FORMAT}', processed_date), matched_keywords, "
+                "COALESCE(sync_source, ''), container_count")
+
+
+def create_rollup_table(conn):
+    """在给定连接上创建汇总表（归档库也使用同样的汇总表）"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            day TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            sync_source TEXT NOT NULL,
+            email_count INTEGER NOT NULL DEFAULT 0,
+            container_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, keyword, sync_source)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{ROLLUP_TABLE}_keyword ON {ROLLUP_TABLE}(keyword, day)')
+
+
+def create_rollup(db_file):
+    """创建汇总表；第一次创建时根据现有明细数据生成"""
+    with db_access.transaction(db_file) as conn:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                              (ROLLUP_TABLE,)).fetchone()
+        create_rollup_table(conn)
+
+    if not exists:
+        rebuild_rollup(db_file)
+    return True
+
+
+def create_hourly_rollup(db_file):
+    """创建按小时汇总表；第一次创建时根据现有明细数据生成"""
+    with db_access.transaction(db_file) as conn:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                              (HOURLY_TABLE,)).fetchone()
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {HOURLY_TABLE} (
+                hour TEXT PRIMARY KEY,
+                email_count INTEGER NOT NULL DEFAULT 0,
+                container_total INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+
+    if not exists:
+        rebuild_hourly(db_file)
+    return True
+
+
+def apply_rollup(conn, rows, sign, hourly=True):
+    """
+    把 (日期, 小时, 关键词串, 来源, 邮件数, 集装箱数) 分组结果累加到每日汇总表和按小时汇总表，sign 为 +1 或 -1
+    hourly=False 时只更新每日汇总表（归档库没有按小时汇总表）
+    """
+    rows = list(rows)
+    if hourly:
+        _apply_hourly(conn, rows, sign)
+    deltas = {}
+    for day, _, matched_keywords, sync_source, count, containers in rows:
+        if not day:
+            continue
+        for keyword in split_keywords(matched_keywords) | {TOTAL_KEYWORD}:
+            entry = deltas.setdefault((day, keyword, sync_source or ''), [0, 0])
+            entry[0] += sign * (count or 0)
+            entry[1] += sign * (containers or 0)
+
+    if not deltas:
+        return
+    conn.executemany(f'''
+        INSERT INTO {ROLLUP_TABLE} (day, keyword, sync_source, email_count, container_total)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(day, keyword, sync_source) DO UPDATE SET
+            email_count = email_count + excluded.email_count,
+            container_total = container_total + excluded.container_total
+    ''', [key + tuple(value) for key, value in deltas.items()])
+    if sign < 0:
+        conn.executemany(f'DELETE FROM {ROLLUP_TABLE} WHERE day = ? AND email_count <= 0',
+                         [(day,) for day in {key[0] for key in deltas}])
+
+
+def _apply_hourly(conn, rows, sign):
+    deltas = {}
+    for _, hour, _, _, count, containers in rows:
+        if not hour:
+            continue
+        entry = deltas.setdefault(hour, [0, 0])
+        entry[0] += sign * (count or 0)
+        entry[1] += sign * (containers or 0)
+
+    if not deltas:
+        return
+    conn.executemany(f'''
+        INSERT INTO {HOURLY_TABLE} (hour, email_count, container_total) VALUES (?, ?, ?)
+        ON CONFLICT(hour) DO UPDATE SET
+            email_count = email_count + excluded.email_count,
+            container_total = container_total + excluded.container_total
+    ''', [(hour,) + tuple(value) for hour, value in deltas.items()])
+    if sign < 0:
+        conn.executemany(f'DELETE FROM {HOURLY_TABLE} WHERE hour = ? AND email_count <= 0',
+                         [(hour,) for hour in deltas])
+
+
+def save_keyword_email(db_file, record, replace=True, containers=None, direction=''):
+    """
+    写入一条 keyword_emails 记录并同步更新汇总表
+    record 为 列名 -> 值 的字典；replace=False 时已存在的 email_uid 保持不变（INSERT OR IGNORE）
+    containers 为解析出的箱号列表（parse_*_manifest_content 的返回值），与记录一起批量写入
+    返回是否写入了记录
+    """
+    with db_access.transaction(db_file) as conn:
+        return _write_record(conn, record, replace, containers, direction)
+
+
+def _write_record(conn, record, replace, containers, direction):
+    columns = list(record)
+    placeholders = ', '.join('?' * len(columns))
+    verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+
+    old = conn.execute(f'SELECT {_ROW_COLUMNS}, id FROM keyword_emails WHERE email_uid = ?',
+                       (record['email_uid'],)).fetchone()
+    if old and not replace:
+        return False
+    if old:
+        # 先显式删除旧记录：INSERT OR REPLACE 的隐式删除不会触发删除触发器，
+        # 关键词关联、箱号和全文索引都依赖这些触发器清理
+        conn.execute('DELETE FROM keyword_emails WHERE id = ?', (old[5],))
+
+    cursor = conn.execute(f"{verb} INTO keyword_emails ({', '.join(columns)}) VALUES ({placeholders})",
+                          [record[column] for column in columns])
+    new = conn.execute(f'SELECT {_ROW_COLUMNS}, id FROM keyword_emails WHERE id = ?',
+                       (cursor.lastrowid,)).fetchone()
+
+    if old:
+        apply_rollup(conn, [old[:4] + (1, old[4])], -1)
+    if new:
+        apply_rollup(conn, [new[:4] + (1, new[4])], 1)
+        keyword_index.index_row(conn, 'keyword_emails', new[5], new[2])
+        if containers:
+            container_store.write_containers(conn, new[5], direction, containers)
+    return True
+
+
+def merge_keyword_email(db_file, record, containers=None, direction=''):
+    """
+    把一封邮件新匹配到的关键词和箱号并入已有记录（关键词重扫补发回复后使用），记录不存在时直接写入
+    关键词取并集，箱号按箱号去重后追加；原记录的处理时间和 record 中为空的列保持原值
+    """
+    containers = list(containers or [])
+    with db_access.transaction(db_file) as conn:
+        old = conn.execute('''
+            SELECT id, processed_date, matched_keywords, container_count,
+                   english_goods_descriptions, chinese_goods_descriptions
+            FROM keyword_emails WHERE email_uid = ?
+        ''', (record['email_uid'],)).fetchone()
+        if old:
+            email_id, processed_date, old_keywords, old_count, old_english, old_chinese = old
+            existing = [{'container_no': row[0], 'bill_of_lading': row[1],
+                         'english_goods_description': row[2], 'chinese_goods_description': row[3]}
+                        for row in conn.execute('SELECT container_no, bill_of_lading, goods_en, goods_cn '
+                                                'FROM containers WHERE email_id = ? ORDER BY id', (email_id,))]
+            seen = {container_store.normalize_no(c['container_no']) for c in existing}
+            added = []
+            for container in containers:
+                key = container_store.normalize_no(container.get('container_no'))
+                if key and key not in seen:
+                    seen.add(key)
+                    added.append(container)
+
+            keywords = [k.strip() for k in (old_keywords or '').split(',') if k.strip()]
+            keywords += [k for k in sorted(split_keywords(record.get('matched_keywords'))) if k not in keywords]
+            old_values = dict(zip(record, conn.execute(
+                f"SELECT {', '.join(record)} FROM keyword_emails WHERE id = ?", (email_id,)).fetchone()))
+            record = {column: value if value not in (None, '') else old_values[column]
+                      for column, value in record.items()}
+            record.update({
+                'processed_date': processed_date,
+                'matched_keywords': ','.join(keywords),
+                'container_count': (old_count or 0) + len(added),
+                'english_goods_descriptions': ','.join(filter(None, [old_english] + [
+                    c.get('english_goods_description', '') for c in added])),
+                'chinese_goods_descriptions': ','.join(filter(None, [old_chinese] + [
+                    c.get('chinese_goods_description', '') for c in added])),
+            })
+            containers = existing + added
+        return _write_record(conn, record, True, containers, direction)
+
+
+def save_keyword_emails(db_file, records, replace=False):
+    """
+    批量写入多条 keyword_emails 记录（executemany，一个事务），同步更新汇总表和关键词索引
+    records 中每条记录的列名必须相同；返回实际写入的条数
+    """
+    records = list(records)
+    if not records:
+        return 0
+    columns = list(records[0])
+    placeholders = ', '.join('?' * len(columns))
+    uids = [record['email_uid'] for record in records]
+    uid_placeholders = ','.join('?' * len(uids))
+
+    with db_access.transaction(db_file) as conn:
+        old_rows = conn.execute(f'SELECT {_ROW_COLUMNS}, id, email_uid FROM keyword_emails '
+                                f'WHERE email_uid IN ({uid_placeholders})', uids).fetchall()
+        existing = {row[6] for row in old_rows}
+        if replace and old_rows:
+            conn.executemany('DELETE FROM keyword_emails WHERE id = ?', [(row[5],) for row in old_rows])
+            apply_rollup(conn, [row[:4] + (1, row[4]) for row in old_rows], -1)
+        else:
+            records = [record for record in records if record['email_uid'] not in existing]
+            if not records:
+                return 0
+
+        conn.executemany(f"INSERT OR IGNORE INTO keyword_emails ({', '.join(columns)}) VALUES ({placeholders})",
+                         [[record[column] for column in columns] for record in records])
+
+        new_uids = [record['email_uid'] for record in records]
+        new_rows = conn.execute(f'SELECT {_ROW_COLUMNS}, id FROM keyword_emails '
+                                f"WHERE email_uid IN ({','.join('?' * len(new_uids))})", new_uids).fetchall()
+        apply_rollup(conn, [row[:4] + (1, row[4]) for row in new_rows], 1)
+        for row in new_rows:
+            keyword_index.index_row(conn, 'keyword_emails', row[5], row[2])
+    return len(new_rows)
+
+
+def delete_rows(conn, ids):
+    """在调用方的事务中删除指定ID的记录并扣减两张汇总表，返回删除条数；关联表和全文索引由触发器清理"""
+    if not ids:
+        return 0
+    placeholders = ','.join('?' * len(ids))
+    rows = conn.execute(f'''
+        SELECT processed_day, strftime('{HOUR_FORMAT}', processed_date), matched_keywords,
+               COALESCE(sync_source, ''), COUNT(*), SUM(container_count)
+        FROM keyword_emails WHERE id IN ({placeholders})
+        GROUP BY 1, 2, 3, 4
+    ''', ids).fetchall()
+    apply_rollup(conn, rows, -1)
+    return conn.execute(f'DELETE FROM keyword_emails WHERE id IN ({placeholders})', ids).rowcount
+
+
+def purge_before(db_file, cutoff_date, chunk_size=PURGE_CHUNK_SIZE, pause=0):
+    """
+    删除 processed_date 早于 cutoff_date 的记录并扣减汇总，返回删除条数
+    按ID分批、每批一个短事务，避免长时间占用写锁
+    """
+    deleted = 0
+    while True:
+        with db_access.transaction(db_file) as conn:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM keyword_emails WHERE processed_date < ? ORDER BY id LIMIT ?',
+                (cutoff_date, chunk_size)).fetchall()]
+            if not ids:
+                break
+            deleted += delete_rows(conn, ids)
+        if len(ids) < chunk_size:
+            break
+        if pause:
+            # 让出写锁，处理程序的写入可以插进来
+            time.sleep(pause)
+    return deleted
+
+
+def rebuild_rollup(db_file):
+    """根据 keyword_emails 明细重新生成汇总表，返回汇总行数"""
+    with db_access.transaction(db_file) as conn:
+        conn.execute(f'DELETE FROM {ROLLUP_TABLE}')
+        rows = conn.execute('''
+            SELECT processed_day, NULL, matched_keywords, COALESCE(sync_source, ''), COUNT(*), SUM(container_count)
+            FROM keyword_emails WHERE processed_day IS NOT NULL
+            GROUP BY processed_day, matched_keywords, sync_source
+        ''').fetchall()
+        apply_rollup(conn, rows, 1, hourly=False)
+        count = conn.execute(f'SELECT COUNT(*) FROM {ROLLUP_TABLE}').fetchone()[0]
+    logging.info(f"✅ {db_file} 每日汇总已重建，共 {count} 行")
+    return count
+
+
+def rebuild_hourly(db_file):
+    """根据 keyword_emails 明细重新生成按小时汇总表，返回汇总行数"""
+    with db_access.transaction(db_file) as conn:
+        conn.execute(f'DELETE FROM {HOURLY_TABLE}')
+        rows = conn.execute(f'''
+            SELECT NULL, strftime('{HOUR_FORMAT}', processed_date), NULL, NULL, COUNT(*), SUM(container_count)
+            FROM keyword_emails WHERE processed_date IS NOT NULL
+            GROUP BY 2
+        ''').fetchall()
+        _apply_hourly(conn, rows, 1)
+        count = conn.execute(f'SELECT COUNT(*) FROM {HOURLY_TABLE}').fetchone()[0]
+    logging.info(f"✅ {db_file} 按小时汇总已重建，共 {count} 行")
+    return count
+
+
+def _range_clause(start_day, end_day, params):
+    conditions = []
+    if start_day:
+        conditions.append('day >= ?')
+        params.append(start_day)
+    if end_day:
+        conditions.append('day <= ?')
+        params.append(end_day)
+    return ''.join(f' AND {c}' for c in conditions)
+
+
+def daily_counts(db_file, start_day=None, end_day=None):
+    """按天统计邮件数，返回 {日期: 邮件数}"""
+    params = [TOTAL_KEYWORD]
+    where = _range_clause(start_day, end_day, params)
+    rows = db_access.query_all(db_file, f'''
+        SELECT day, SUM(email_count) FROM {ROLLUP_TABLE}
+        WHERE keyword = ?{where}
+        GROUP BY day
+    ''', params)
+    return dict(rows)
+
+
+def keyword_counts(db_file, start_day=None, end_day=None):
+    """按关键词统计邮件数，返回 ({关键词: 邮件数}, 邮件总数)"""
+    params = []
+    where = _range_clause(start_day, end_day, params)
+    rows = db_access.query_all(db_file, f'''
+        SELECT keyword, SUM(email_count) FROM {ROLLUP_TABLE}
+        WHERE 1=1{where}
+        GROUP BY keyword
+        ORDER BY SUM(email_count) DESC, keyword
+    ''', params)
+    counts = dict(rows)
+    total = counts.pop(TOTAL_KEYWORD, 0)
+    return counts, total
+
+
+if __name__ == '__main__':
+    import db_schema
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("用法: python email_store.py rebuild [数据库文件 ...]")
+        sys.exit(1)
+
+    for db_file in sys.argv[2:] or DEFAULT_DB_FILES:
+        if not os.path.exists(db_file):
+            print(f"跳过不存在的数据库: {db_file}")
+            continue
+        db_schema.migrate(db_file)
+        rebuild_rollup(db_file)
+        rebuild_hourly(db_file)
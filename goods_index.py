@@ -0,0 +1,295 @@
+"""
+货物描述倒排索引
+要回答“最近 90 天哪些舱单里有 Ammonium Nitrate”，原来只能把保存的舱单逐份重新解析。
+这里在保存舱单时把每个箱子的货物描述拆成词（大写后的连续字母数字，见 manifest_goods.terms），
+写入倒排索引，查询只读索引、不解析舱单：
+    goods_records   每个箱子一行：舱单哈希、首次收到的日期、箱号、提单号、货物描述
+    goods_terms     词表（词 -> 编号）
+    goods_postings  词 -> 包含该词的 goods_records 编号列表
+编号列表按升序存为“与前一个编号的差值”的变长整数（每个数 1~3 字节），
+新舱单的编号总是更大，写入时只需接在该词最后一段的末尾；一段超过 SEGMENT_BYTES 后开新段。
+lookup 支持词查询（所有词都出现）和短语查询（词按顺序相邻出现），按舱单分组返回箱号。
+"""
+
+import logging
+from datetime import datetime
+
+import db_access
+import keyword_matcher
+import manifest_goods
+import manifest_store
+
+# 每段编号列表的大小上限（字节），超过后新开一段
+SEGMENT_BYTES = 4096
+
+# lookup 默认最多返回的箱子数
+LOOKUP_LIMIT = 1000
+
+# IN (...) 查询每批的编号数
+_ID_CHUNK = 500
+
+
+def create_tables(db_file):
+    """已索引舱单表、记录表、词表和编号列表表"""
+    with db_access.transaction(db_file) as conn:
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS indexed_manifests (
+                manifest_hash TEXT PRIMARY KEY,
+                goods_count INTEGER NOT NULL,
+                indexed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS goods_records (
+                id INTEGER PRIMARY KEY,
+                manifest_hash TEXT NOT NULL,
+                seen_day TEXT NOT NULL,
+                container_no TEXT,
+                bill_of_lading TEXT,
+                goods_description TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_goods_records_manifest ON goods_records(manifest_hash);
+            CREATE INDEX IF NOT EXISTS idx_goods_records_day ON goods_records(seen_day);
+            CREATE TABLE IF NOT EXISTS goods_terms (
+                id INTEGER PRIMARY KEY,
+                term TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS goods_postings (
+                term_id INTEGER NOT NULL,
+                segment INTEGER NOT NULL,
+                last_record INTEGER NOT NULL,
+                record_count INTEGER NOT NULL,
+                postings BLOB NOT NULL,
+                PRIMARY KEY (term_id, segment)
+            ) WITHOUT ROWID;
+        ''')
+    return True
+
+
+def encode_postings(record_ids, previous=0):
+    """把升序的编号编码为差值变长整数；previous 为追加位置之前的最后一个编号"""
+    out = bytearray()
+    for record_id in record_ids:
+        delta = record_id - previous
+        previous = record_id
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(blob, previous=0):
+    """encode_postings 的逆过程，返回编号列表"""
+    record_ids = []
+    value = 0
+    shift = 0
+    for byte in blob:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        record_ids.append(previous)
+        value = 0
+        shift = 0
+    return record_ids
+
+
+def index_manifest(db_file, manifest_hash, txt_content, direction, seen_day=None):
+    """把舱单中每个箱子的货物描述写入倒排索引（已索引过的舱单跳过），返回写入的箱子数"""
+    if not manifest_hash:
+        return 0
+    if db_access.query_one(db_file, 'SELECT 1 FROM indexed_manifests WHERE manifest_hash = ?', (manifest_hash,)):
+        return 0
+    records = list(manifest_goods.iter_goods(txt_content, direction))
+    seen_day = seen_day or datetime.now().strftime('%Y-%m-%d')
+
+    with db_access.transaction(db_file) as conn:
+        # 先写 indexed_manifests 取得写锁，并发索引同一份舱单时只有一方继续
+        if not conn.execute('''
+            INSERT OR IGNORE INTO indexed_manifests (manifest_hash, goods_count, indexed_at) VALUES (?, ?, ?)
+        ''', (manifest_hash, len(records), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).rowcount:
+            return 0
+
+        postings = {}
+        for container_no, bill_of_lading, goods in records:
+            record_id = conn.execute('''
+                INSERT INTO goods_records (manifest_hash, seen_day, container_no, bill_of_lading, goods_description)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (manifest_hash, seen_day, container_no, bill_of_lading, goods)).lastrowid
+            for term in manifest_goods.terms(goods):
+                postings.setdefault(term, []).append(record_id)
+
+        for term, record_ids in postings.items():
+            _append_postings(conn, _term_id(conn, term), record_ids)
+    return len(records)
+
+
+def _term_id(conn, term):
+    row = conn.execute('SELECT id FROM goods_terms WHERE term = ?', (term,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute('INSERT INTO goods_terms (term) VALUES (?)', (term,)).lastrowid
+
+
+def _append_postings(conn, term_id, record_ids):
+    """追加到该词最后一段，段已满时新开一段"""
+    row = conn.execute('''
+        SELECT segment, last_record, postings FROM goods_postings
+        WHERE term_id = ? ORDER BY segment DESC LIMIT 1
+    ''', (term_id,)).fetchone()
+    if row and len(row[2]) < SEGMENT_BYTES:
+        segment, last_record, postings = row
+        conn.execute('''
+            UPDATE goods_postings SET postings = ?, last_record = ?, record_count = record_count + ?
+            WHERE term_id = ? AND segment = ?
+        ''', (postings + encode_postings(record_ids, last_record), record_ids[-1], len(record_ids),
+              term_id, segment))
+    else:
+        conn.execute('''
+            INSERT INTO goods_postings (term_id, segment, last_record, record_count, postings)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (term_id, row[0] + 1 if row else 0, record_ids[-1], len(record_ids), encode_postings(record_ids)))
+
+
+def term_records(conn, term_ids):
+    """一组词的编号列表的并集（升序）"""
+    record_ids = set()
+    for term_id in term_ids:
+        for (blob,) in conn.execute('SELECT postings FROM goods_postings WHERE term_id = ? ORDER BY segment',
+                                    (term_id,)):
+            record_ids.update(decode_postings(blob))
+    return sorted(record_ids)
+
+
+def _records_with_all(conn, words):
+    """包含全部词（精确匹配）的编号；先取出现次数最少的词，其余词依次求交集"""
+    counted = []
+    for word in words:
+        row = conn.execute('''
+            SELECT t.id, COALESCE(SUM(p.record_count), 0) FROM goods_terms t
+            LEFT JOIN goods_postings p ON p.term_id = t.id
+            WHERE t.term = ? GROUP BY t.id
+        ''', (word,)).fetchone()
+        if not row or not row[1]:
+            return []
+        counted.append(row)
+
+    result = None
+    for term_id, _ in sorted(counted, key=lambda item: item[1]):
+        records = term_records(conn, [term_id])
+        result = set(records) if result is None else result.intersection(records)
+        if not result:
+            return []
+    return sorted(result)
+
+
+def _fetch_records(conn, record_ids, start_day=None, end_day=None):
+    conditions = ''
+    params = []
+    if start_day:
+        conditions += ' AND seen_day >= ?'
+        params.append(start_day)
+    if end_day:
+        conditions += ' AND seen_day <= ?'
+        params.append(end_day)
+    for i in range(0, len(record_ids), _ID_CHUNK):
+        chunk = record_ids[i:i + _ID_CHUNK]
+        yield from conn.execute(f'''
+            SELECT id, manifest_hash, seen_day, container_no, bill_of_lading, goods_description
+            FROM goods_records WHERE id IN ({','.join('?' * len(chunk))}){conditions}
+            ORDER BY id
+        ''', chunk + params)
+
+
+def _contains_phrase(description, words):
+    tokens = manifest_goods.term_list(description)
+    n = len(words)
+    return any(tokens[i:i + n] == words for i in range(len(tokens) - n + 1))
+
+
+def lookup(db_file, query, phrase=False, start_day=None, end_day=None, limit=LOOKUP_LIMIT):
+    """
+    查询货物描述包含 query 的箱子，按舱单分组（最近收到的在前）
+    phrase=False 时 query 的每个词都要出现；phrase=True 时还要按顺序相邻出现
+    返回 {'manifests': [{manifest_hash, seen_day, containers: [...]}], 'container_count', 'truncated'}
+    """
+    words = manifest_goods.term_list(query)
+    result = {'manifests': [], 'container_count': 0, 'truncated': False}
+    if not words:
+        return result
+
+    manifests = {}
+    with db_access.connection(db_file) as conn:
+        record_ids = _records_with_all(conn, set(words))
+        # 编号越大越晚写入，从最新的开始取
+        record_ids.reverse()
+        for i in range(0, len(record_ids), _ID_CHUNK):
+            rows = list(_fetch_records(conn, record_ids[i:i + _ID_CHUNK], start_day, end_day))
+            for _, manifest_hash, seen_day, container_no, bill_of_lading, goods in reversed(rows):
+                if phrase and not _contains_phrase(goods, words):
+                    continue
+                if result['container_count'] >= limit:
+                    result['truncated'] = True
+                    break
+                manifest = manifests.setdefault(manifest_hash, {'manifest_hash': manifest_hash,
+                                                                'seen_day': seen_day, 'containers': []})
+                manifest['containers'].append({'container_no': container_no, 'bill_of_lading': bill_of_lading,
+                                               'goods_description': goods})
+                result['container_count'] += 1
+            if result['truncated']:
+                break
+
+    result['manifests'] = list(manifests.values())
+    return result
+
+
+def candidate_manifests(conn, keyword, mode=keyword_matcher.MODE_EXACT):
+    """
+    可能包含关键词的舱单哈希集合（关键词重扫使用）
+    关键词的每个词都要是舱单中某个词的子串（与“去空格后子串匹配”的规则对应，只会多选、由解析确认）；
+    normalized 方式下关键词和索引中的词都先按 keyword_matcher.normalize_term 统一 OCR 混淆字符和缩写
+    """
+    if mode == keyword_matcher.MODE_NORMALIZED:
+        conn.create_function('normalize_term', 1, keyword_matcher.normalize_term, deterministic=True)
+        words = {keyword_matcher.normalize_term(word) for word in manifest_goods.terms(keyword)}
+        sql = 'SELECT id FROM goods_terms WHERE instr(normalize_term(term), ?) > 0'
+    else:
+        words = manifest_goods.terms(keyword)
+        sql = 'SELECT id FROM goods_terms WHERE instr(term, ?) > 0'
+    result = None
+    for word in words:
+        term_ids = [row[0] for row in conn.execute(sql, (word,))]
+        record_ids = term_records(conn, term_ids)
+        hashes = set()
+        for i in range(0, len(record_ids), _ID_CHUNK):
+            chunk = record_ids[i:i + _ID_CHUNK]
+            hashes.update(row[0] for row in conn.execute(f'''
+                SELECT DISTINCT manifest_hash FROM goods_records WHERE id IN ({','.join('?' * len(chunk))})
+            ''', chunk))
+        result = hashes if result is None else result & hashes
+        if not result:
+            break
+    return result or set()
+
+
+def rebuild(db_file, direction, store=None):
+    """为处理日志引用、但尚未建立索引的已保存舱单补建索引，返回补建的舱单数"""
+    store = store or manifest_store.default_store()
+    indexed = 0
+    for log_day, hashes in db_access.query_all(db_file, '''
+        SELECT MIN(log_day), manifest_hashes FROM processing_log
+        WHERE manifest_hashes != '' GROUP BY manifest_hashes
+    '''):
+        for manifest_hash in (h for h in hashes.split(',') if h):
+            if db_access.query_one(db_file, 'SELECT 1 FROM indexed_manifests WHERE manifest_hash = ?',
+                                   (manifest_hash,)):
+                continue
+            text = store.open_text(manifest_hash)
+            if text is None:
+                continue
+            with text:
+                index_manifest(db_file, manifest_hash, text, direction, seen_day=log_day)
+            indexed += 1
+    if indexed:
+        logging.info(f"✅ {db_file} 已为 {indexed} 份舱单补建货物描述索引")
+    return indexed
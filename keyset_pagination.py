@@ -0,0 +1,101 @@
+"""
+列表分页辅助：游标（keyset）分页与总数缓存
+LIMIT/OFFSET 分页越往后越慢（SQLite 要先数过前面所有行），每次翻页还要重新 COUNT(*)。
+游标分页按排序键记住上一页最后一行，下一页用 (排序键) < (游标) 直接从索引定位，
+任何一页的代价都和第一页相同。
+
+总数缓存以表的写入版本号为失效条件：版本号存放在 table_versions 表中，
+由触发器在明细表插入/删除/修改时递增，处理程序和网页端在不同进程写入也能感知。
+版本号表和触发器由 db_schema 的版本迁移调用 create_version_tracking 创建。
+"""
+
+import os
+import json
+import base64
+import threading
+from collections import OrderedDict
+
+import db_access
+
+VERSION_TABLE = 'table_versions'
+
+# 总数缓存最多保留的查询条件组合
+COUNT_CACHE_SIZE = 256
+
+
+def create_version_tracking(db_file, table, watched_columns=()):
+    """为表创建写入版本号及递增触发器；watched_columns 为修改时也要递增版本的列"""
+    bump = f"UPDATE {VERSION_TABLE} SET version = version + 1 WHERE table_name = '{table}';"
+    with db_access.transaction(db_file) as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+            return False
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute(f'INSERT OR IGNORE INTO {VERSION_TABLE} (table_name, version) VALUES (?, 0)', (table,))
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table} BEGIN {bump} END')
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table} BEGIN {bump} END')
+        if watched_columns:
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update
+                AFTER UPDATE OF {', '.join(watched_columns)} ON {table}
+                BEGIN {bump} END
+            ''')
+    return True
+
+
+def table_version(conn, table):
+    """读取表的写入版本号"""
+    row = conn.execute(f'SELECT version FROM {VERSION_TABLE} WHERE table_name = ?', (table,)).fetchone()
+    return row[0] if row else None
+
+
+def encode_cursor(values):
+    """把上一页最后一行的排序键编码为不透明的游标字符串"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """解析游标，格式不对时返回 None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+class CountCache:
+    """按 (数据库, SQL, 参数) 缓存 COUNT 结果，表写入版本号变化后自动失效"""
+
+    def __init__(self, max_size=COUNT_CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+
+    def count(self, conn, db_file, table, sql, params=()):
+        version = table_version(conn, table)
+        key = (os.path.abspath(db_file), sql, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and version is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        total = conn.execute(sql, params).fetchone()[0]
+        with self._lock:
+            self._entries[key] = (version, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
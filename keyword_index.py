@@ -0,0 +1,138 @@
+"""
+关键词规范化索引
+matched_keywords 是逗号拼接的字符串，按关键词过滤只能用 LIKE '%关键词%'：每次全表扫描，
+而且会把 "Calcium Nitrate" 误匹配到 "Calcium Nitrate Tetrahydrate"。
+这里在每个数据库中建立：
+    keywords                    关键词维度表 (id, keyword)，不区分大小写
+    email_keywords              keyword_emails.id  <-> keywords.id
+    import_attachment_keywords  import_attachments.id <-> keywords.id
+    export_attachment_keywords  export_attachments.id <-> keywords.id
+写入明细时同步维护关联行，旧数据在第一次建表时分批回填；
+明细被 DELETE 时由触发器清理对应的关联行。关键词过滤和统计都变成按索引连接。
+表结构由 db_schema 的版本迁移调用 create_index 创建。
+"""
+
+import logging
+
+import db_access
+
+# 明细表 -> (关联表, 关联表中的明细ID列)
+JUNCTIONS = {
+    'keyword_emails': ('email_keywords', 'email_id'),
+    'import_attachments': ('import_attachment_keywords', 'attachment_id'),
+    'export_attachments': ('export_attachment_keywords', 'attachment_id'),
+}
+
+# 回填时每批处理的行数
+BACKFILL_BATCH = 5000
+
+def split_keywords(matched_keywords):
+    """把逗号分隔的关键词字符串拆成去重后的集合"""
+    return {k.strip() for k in (matched_keywords or '').split(',') if k.strip()}
+
+
+def create_index(db_file, table):
+    """为明细表创建关键词维度表、关联表和清理触发器；关联表第一次创建时回填旧数据"""
+    junction, column = JUNCTIONS[table]
+
+    with db_access.transaction(db_file) as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+            return False
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                              (junction,)).fetchone()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS keywords (
+                id INTEGER PRIMARY KEY,
+                keyword TEXT NOT NULL UNIQUE COLLATE NOCASE
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {junction} (
+                keyword_id INTEGER NOT NULL,
+                {column} INTEGER NOT NULL,
+                PRIMARY KEY (keyword_id, {column})
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{junction}_{column} ON {junction}({column})')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{junction}_cleanup
+            AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM {junction} WHERE {column} = OLD.id;
+            END
+        ''')
+
+    if not exists:
+        _backfill(db_file, table)
+    return True
+
+
+def _keyword_ids(conn, keywords):
+    conn.executemany('INSERT OR IGNORE INTO keywords (keyword) VALUES (?)', [(k,) for k in keywords])
+    placeholders = ','.join('?' * len(keywords))
+    return [row[0] for row in conn.execute(f'SELECT id FROM keywords WHERE keyword IN ({placeholders})',
+                                           list(keywords)).fetchall()]
+
+
+def index_row(conn, table, row_id, matched_keywords):
+    """在调用方的事务中写入（或重写）一条明细的关键词关联"""
+    junction, column = JUNCTIONS[table]
+    conn.execute(f'DELETE FROM {junction} WHERE {column} = ?', (row_id,))
+    keywords = split_keywords(matched_keywords)
+    if keywords:
+        conn.executemany(f'INSERT OR IGNORE INTO {junction} (keyword_id, {column}) VALUES (?, ?)',
+                         [(keyword_id, row_id) for keyword_id in _keyword_ids(conn, keywords)])
+
+
+def _backfill(db_file, table):
+    """按ID区间分批为旧数据建立关联"""
+    max_id = db_access.query_value(db_file, f'SELECT MAX(id) FROM {table}', default=0)
+    indexed = 0
+    for low in range(0, max_id + 1, BACKFILL_BATCH):
+        with db_access.transaction(db_file) as conn:
+            rows = conn.execute(f'SELECT id, matched_keywords FROM {table} WHERE id >= ? AND id < ?',
+                                (low, low + BACKFILL_BATCH)).fetchall()
+            for row_id, matched_keywords in rows:
+                index_row(conn, table, row_id, matched_keywords)
+            indexed += len(rows)
+    if indexed:
+        logging.info(f"🔄 {db_file} 已为 {table} 的 {indexed} 条记录建立关键词索引")
+
+
+def filter_clause(table, keywords, id_column='id'):
+    """
+    生成“匹配任一关键词”的过滤条件，返回 (SQL片段, 参数列表)
+    关键词按完整值匹配（不区分大小写），不再做子串匹配
+    """
+    keywords = [k.strip() for k in keywords if k and k.strip()]
+    if not keywords:
+        return '1=1', []
+    junction, column = JUNCTIONS[table]
+    placeholders = ','.join('?' * len(keywords))
+    return (f'{id_column} IN (SELECT j.{column} FROM {junction} j '
+            f'JOIN keywords k ON k.id = j.keyword_id WHERE k.keyword IN ({placeholders}))', keywords)
+
+
+def keyword_counts(db_file, table, where_clause='1=1', params=()):
+    """按关键词统计明细条数（一条明细匹配多个关键词时每个关键词各计一次），返回 {关键词: 条数}"""
+    junction, column = JUNCTIONS[table]
+    rows = db_access.query_all(db_file, f'''
+        SELECT k.keyword, COUNT(*) FROM {junction} j
+        JOIN keywords k ON k.id = j.keyword_id
+        JOIN {table} t ON t.id = j.{column}
+        WHERE {where_clause}
+        GROUP BY k.keyword
+        ORDER BY COUNT(*) DESC, k.keyword
+    ''', list(params))
+    return dict(rows)
+
+
+def all_keywords(db_file, table):
+    """明细表中出现过的全部关键词"""
+    junction, _ = JUNCTIONS[table]
+    rows = db_access.query_all(db_file, f'''
+        SELECT keyword FROM keywords
+        WHERE id IN (SELECT DISTINCT keyword_id FROM {junction})
+        ORDER BY keyword
+    ''')
+    return [row[0] for row in rows]
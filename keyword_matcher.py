@@ -0,0 +1,149 @@
+"""
+关键词匹配
+处理程序原来逐个关键词做子串比较：进口只忽略大小写，出口再去掉空格（normalize_keyword），
+“CALCIUM  NITRATE”“CALCIUM-NITRATE”、换行拆开的货名或 OCR 把 O 识别成 0 的货名都匹配不上。
+这里对每段货物描述只做一次标准化，关键词在创建 KeywordMatcher 时预先标准化，匹配时只在标准化文本上查找：
+    exact       大写并去掉空格后做子串比较（原出口规则）
+    normalized  大写；只保留字母数字（空白、换行、标点都去掉）；常见 OCR 混淆字符统一（0->O、1->I、5->S）；
+                常见缩写按整词展开（AMM -> AMMONIUM 等）
+标准化时记下每个字符在原文中的位置，命中结果给出原文中的起止位置。
+每个关键词可以单独配置匹配方式（config.ini 的 [keyword_match] 节），未配置的使用默认方式。
+"""
+
+import re
+from collections import namedtuple
+
+MODE_EXACT = 'exact'
+MODE_NORMALIZED = 'normalized'
+MODES = (MODE_EXACT, MODE_NORMALIZED)
+
+DEFAULT_MODE = MODE_NORMALIZED
+
+# OCR 常见的数字/字母混淆，统一成字母
+OCR_VARIANTS = {'0': 'O', '1': 'I', '5': 'S'}
+
+# 舱单货名中常见的缩写（整词匹配，可带缩写点），展开后再比较
+ABBREVIATIONS = {
+    'AMM': 'AMMONIUM',
+    'AMMON': 'AMMONIUM',
+    'CALC': 'CALCIUM',
+    'MAGN': 'MAGNESIUM',
+    'NITR': 'NITRATE',
+    'SOD': 'SODIUM',
+    'POT': 'POTASSIUM',
+    'HEXAHYD': 'HEXAHYDRATE',
+    'TETRAHYD': 'TETRAHYDRATE',
+    'ANHYD': 'ANHYDROUS',
+    'SOLN': 'SOLUTION',
+}
+
+_WORD_PATTERN = re.compile(r'[^\W_]+')
+
+KeywordHit = namedtuple('KeywordHit', ['keyword', 'start', 'end', 'text'])
+
+
+def normalize_term(word):
+    """单个词（只含字母数字）的 normalized 形式"""
+    word = word.upper()
+    expansion = ABBREVIATIONS.get(word)
+    if expansion:
+        return expansion
+    return ''.join(OCR_VARIANTS.get(ch, ch) for ch in word)
+
+
+def normalize(text, mode=DEFAULT_MODE):
+    """
+    返回 (标准化文本, 起始位置列表, 结束位置列表)
+    标准化文本的第 i 个字符来自原文 text[starts[i]:ends[i]]，整个过程对原文只扫描一遍
+    """
+    chars = []
+    starts = []
+    ends = []
+    if not text:
+        return '', starts, ends
+
+    if mode == MODE_EXACT:
+        for i, ch in enumerate(text):
+            if ch == ' ':
+                continue
+            upper = ch.upper()
+            chars.append(upper)
+            starts.extend([i] * len(upper))
+            ends.extend([i + 1] * len(upper))
+        return ''.join(chars), starts, ends
+
+    for match in _WORD_PATTERN.finditer(text):
+        word = match.group()
+        start, end = match.span()
+        normalized = normalize_term(word)
+        if len(normalized) == len(word) and word.upper() not in ABBREVIATIONS:
+            # 逐字符对应
+            chars.append(normalized)
+            starts.extend(range(start, end))
+            ends.extend(range(start + 1, end + 1))
+        else:
+            # 缩写展开或大写后长度变化：整个词对应原文的整个词
+            chars.append(normalized)
+            starts.extend([start] * len(normalized))
+            ends.extend([end] * len(normalized))
+    return ''.join(chars), starts, ends
+
+
+def normalize_keyword(keyword, mode=DEFAULT_MODE):
+    """关键词的标准化形式（与 normalize 对文本的处理一致）"""
+    return normalize(keyword.strip(), mode)[0]
+
+
+class KeywordMatcher:
+    """
+    预先标准化的一组关键词
+    modes 为 {关键词: 匹配方式}，未列出的关键词使用 default_mode
+    """
+
+    def __init__(self, keywords, modes=None, default_mode=DEFAULT_MODE):
+        modes = modes or {}
+        if default_mode not in MODES:
+            default_mode = DEFAULT_MODE
+        self.keywords = [k for k in keywords if k and k.strip()]
+        self._patterns = {mode: [] for mode in MODES}
+        for keyword in self.keywords:
+            mode = modes.get(keyword, default_mode)
+            if mode not in MODES:
+                mode = default_mode
+            pattern = normalize_keyword(keyword, mode)
+            if pattern:
+                self._patterns[mode].append((keyword, pattern))
+
+    def find(self, text):
+        """
+        所有关键词在 text 中的命中（每个关键词可能多处），按原文位置排序
+        每种匹配方式对 text 只标准化一次
+        """
+        hits = []
+        if not text:
+            return hits
+        for mode, patterns in self._patterns.items():
+            if not patterns:
+                continue
+            normalized, starts, ends = normalize(text, mode)
+            for keyword, pattern in patterns:
+                position = normalized.find(pattern)
+                while position != -1:
+                    start = starts[position]
+                    end = ends[position + len(pattern) - 1]
+                    hits.append(KeywordHit(keyword, start, end, text[start:end]))
+                    position = normalized.find(pattern, position + 1)
+        hits.sort(key=lambda hit: (hit.start, hit.end))
+        return hits
+
+    def match(self, text):
+        """text 中出现的关键词（按配置顺序，不重复）"""
+        if not text:
+            return []
+        found = set()
+        for mode, patterns in self._patterns.items():
+            if not patterns:
+                continue
+            normalized = normalize(text, mode)[0]
+            found.update(keyword for keyword, pattern in patterns if pattern in normalized)
+        return [keyword for keyword in self.keywords if keyword in found]
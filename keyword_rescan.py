@@ -0,0 +1,292 @@
+"""
+关键词变更后的增量重扫
+通过 /api/config/keywords 新增关键词后，原来只对以后收到的邮件生效。这里用保存的舱单原文（见 manifest_store）
+对已经处理过的邮件补做检查，只检查新增的关键词，也不会把所有舱单重新解析一遍：
+    keyword_sets                每个数据库用过的关键词集合，按版本号编号
+    processing_log.keyword_set_version  处理该邮件时使用的关键词集合版本
+    goods_index                 舱单货物描述的倒排索引（保存舱单时写入）
+重扫时对每个旧版本算出新增的关键词，先用词索引找出可能包含这些词的舱单，
+只重新解析这些舱单、按处理程序相同的规则（各关键词配置的匹配方式，见 keyword_matcher）确认；
+确认匹配的邮件和箱号写入 rescan_matches，可选择标记为待回复，由处理程序在主循环中发送。
+处理过的记录随后更新为当前版本，下次重扫不会重复检查。
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime
+
+import db_access
+import goods_index
+import keyword_matcher
+import manifest_goods
+import manifest_store
+
+# 报告中每个数据库最多列出的匹配邮件数
+REPORT_LIMIT = 200
+
+# 回复状态
+REPLY_QUEUED = 'queued'
+REPLY_SENT = 'sent'
+REPLY_FAILED = 'failed'
+
+
+def create_tables(db_file):
+    """关键词集合版本和重扫结果表，processing_log 增加 keyword_set_version 列（货名索引见 goods_index）"""
+    with db_access.transaction(db_file) as conn:
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS keyword_sets (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                keywords TEXT NOT NULL UNIQUE,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rescan_matches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_uid TEXT NOT NULL,
+                manifest_hash TEXT NOT NULL,
+                sender TEXT,
+                subject TEXT,
+                keywords TEXT NOT NULL,
+                containers TEXT NOT NULL,
+                found_at TEXT NOT NULL,
+                reply_status TEXT NOT NULL DEFAULT '',
+                UNIQUE (email_uid, manifest_hash, keywords)
+            );
+            CREATE INDEX IF NOT EXISTS idx_rescan_matches_reply ON rescan_matches(reply_status);
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(processing_log)").fetchall()]
+        if 'keyword_set_version' not in columns:
+            conn.execute('ALTER TABLE processing_log ADD COLUMN keyword_set_version INTEGER DEFAULT 0')
+            logging.info(f"🔄 {db_file} 已添加列: processing_log.keyword_set_version")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_processing_log_keyword_set ON processing_log(keyword_set_version)')
+    return True
+
+
+def _keyword_key(keywords):
+    return json.dumps(sorted({k.strip() for k in keywords if k and k.strip()}), ensure_ascii=False)
+
+
+def register_keyword_set(db_file, keywords):
+    """登记关键词集合（集合相同则复用），返回版本号"""
+    key = _keyword_key(keywords)
+    with db_access.transaction(db_file) as conn:
+        row = conn.execute('SELECT version FROM keyword_sets WHERE keywords = ?', (key,)).fetchone()
+        if row:
+            return row[0]
+        return conn.execute('INSERT INTO keyword_sets (keywords, created_at) VALUES (?, ?)',
+                            (key, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+
+
+def keyword_set(db_file, version):
+    """版本号对应的关键词列表；版本 0（登记之前处理的记录）视为空集合"""
+    row = db_access.query_one(db_file, 'SELECT keywords FROM keyword_sets WHERE version = ?', (version,))
+    return json.loads(row[0]) if row else []
+
+
+def _split_hashes(value):
+    return [h for h in (value or '').split(',') if h]
+
+
+class RescanJob(threading.Thread):
+    """
+    后台重扫任务
+    targets 为 [(方向, 数据库文件, 当前关键词列表)]；progress 随时可读，用于网页显示进度
+    match_config 为关键词匹配方式（ConfigManager.get_keyword_match_config 的返回值），默认全部使用默认方式
+    """
+
+    def __init__(self, targets, queue_replies=False, store=None, match_config=None):
+        super().__init__(name='keyword-rescan')
+        self.daemon = True
+        self.targets = targets
+        self.queue_replies = queue_replies
+        self.match_config = match_config or {'default': keyword_matcher.DEFAULT_MODE, 'modes': {}}
+        self.store = store or manifest_store.default_store()
+        self._lock = threading.Lock()
+        self.progress = {
+            'state': 'pending', 'phase': '', 'total': 0, 'done': 0,
+            'matched_emails': 0, 'matched_containers': 0,
+            'new_keywords': {}, 'matches': {}, 'error': '',
+            'started_at': '', 'finished_at': '',
+        }
+
+    def _update(self, **values):
+        with self._lock:
+            self.progress.update(values)
+
+    def _add(self, key, amount):
+        with self._lock:
+            self.progress[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.progress, ensure_ascii=False))
+
+    def run(self):
+        self._update(state='running', started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            plans = [self._plan(direction, db_file, keywords) for direction, db_file, keywords in self.targets]
+            self._update(phase='scan', total=sum(len(plan[3]) for plan in plans))
+            for plan in plans:
+                self._scan(*plan)
+            self._update(state='finished', phase='')
+            progress = self.snapshot()
+            logging.info(f"✅ 关键词重扫完成: 新匹配邮件 {progress['matched_emails']} 封, "
+                         f"箱号 {progress['matched_containers']} 个")
+        except Exception as e:
+            logging.error(f"❌ 关键词重扫失败: {e}")
+            self._update(state='failed', error=str(e))
+        finally:
+            self._update(finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def _plan(self, direction, db_file, keywords):
+        """找出需要重扫的旧版本、各自新增的关键词和候选舱单"""
+        self._update(phase=f'plan:{direction}')
+        current = register_keyword_set(db_file, keywords)
+        current_keywords = keyword_set(db_file, current)
+        versions = [row[0] for row in db_access.query_all(db_file, '''
+            SELECT DISTINCT keyword_set_version FROM processing_log
+            WHERE keyword_set_version != ? AND manifest_hashes != ''
+        ''', (current,))]
+
+        added_by_version = {}
+        for version in versions:
+            old = set(keyword_set(db_file, version))
+            added = [k for k in current_keywords if k not in old]
+            if added:
+                added_by_version[version] = added
+        self._update_new_keywords(direction, sorted({k for added in added_by_version.values() for k in added}))
+
+        # 补建旧舱单的词索引（只有尚未索引的才解析）
+        records = {}
+        first_seen = {}
+        for version in versions:
+            for email_uid, sender, subject, hashes, log_day in db_access.query_all(db_file, '''
+                SELECT email_uid, sender, subject, manifest_hashes, log_day FROM processing_log
+                WHERE keyword_set_version = ? AND manifest_hashes != ''
+            ''', (version,)):
+                for manifest_hash in _split_hashes(hashes):
+                    records.setdefault(manifest_hash, []).append((version, email_uid, sender, subject))
+                    first_seen[manifest_hash] = min(log_day, first_seen.get(manifest_hash, log_day))
+        for manifest_hash in records:
+            if db_access.query_one(db_file, 'SELECT 1 FROM indexed_manifests WHERE manifest_hash = ?', (manifest_hash,)):
+                continue
+            text = self.store.open_text(manifest_hash)
+            if text is not None:
+                with text:
+                    goods_index.index_manifest(db_file, manifest_hash, text, direction, seen_day=first_seen[manifest_hash])
+
+        # 新增关键词 -> 候选舱单，只保留对应旧版本记录引用的
+        work = {}
+        with db_access.connection(db_file) as conn:
+            for version, added in added_by_version.items():
+                for keyword in added:
+                    for manifest_hash in goods_index.candidate_manifests(conn, keyword, self._mode(keyword)):
+                        for record in records.get(manifest_hash, []):
+                            if record[0] == version:
+                                work.setdefault(manifest_hash, {}).setdefault(record[1:], set()).add(keyword)
+        return direction, db_file, current, work, versions
+
+    def _mode(self, keyword):
+        return self.match_config['modes'].get(keyword, self.match_config['default'])
+
+    def _matcher(self, keywords):
+        return keyword_matcher.KeywordMatcher(sorted(keywords), self.match_config['modes'],
+                                              self.match_config['default'])
+
+    def _update_new_keywords(self, direction, keywords):
+        with self._lock:
+            self.progress['new_keywords'][direction] = keywords
+
+    def _scan(self, direction, db_file, current, work, versions):
+        """重新解析候选舱单并确认匹配，最后把旧版本记录更新为当前版本"""
+        found_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        reply_status = REPLY_QUEUED if self.queue_replies else ''
+        for manifest_hash, emails in work.items():
+            text = self.store.open_text(manifest_hash)
+            if text is None:
+                logging.warning(f"⚠️ 舱单原文已不在存储中，无法重扫: {manifest_hash[:12]}")
+                self._add('done', 1)
+                continue
+            with text:
+                goods = list(manifest_goods.iter_goods(text, direction))
+
+            for (email_uid, sender, subject), keywords in emails.items():
+                matcher = self._matcher(keywords)
+                containers = []
+                for container_no, bill_of_lading, description in goods:
+                    hits = matcher.match(description)
+                    if hits:
+                        containers.append({'container_no': container_no, 'bill_of_lading': bill_of_lading,
+                                           'goods_description': description, 'keywords': hits})
+                if not containers:
+                    continue
+                matched = sorted({k for c in containers for k in c['keywords']})
+                with db_access.transaction(db_file) as conn:
+                    conn.execute('''
+                        INSERT OR IGNORE INTO rescan_matches
+                        (email_uid, manifest_hash, sender, subject, keywords, containers, found_at, reply_status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (email_uid, manifest_hash, sender, subject, ','.join(matched),
+                          json.dumps(containers, ensure_ascii=False), found_at, reply_status))
+                self._record_match(direction, {'email_uid': email_uid, 'subject': subject, 'sender': sender,
+                                               'keywords': matched, 'containers': len(containers)})
+                self._add('matched_emails', 1)
+                self._add('matched_containers', len(containers))
+            self._add('done', 1)
+
+        if versions:
+            with db_access.transaction(db_file) as conn:
+                conn.execute(f'''
+                    UPDATE processing_log SET keyword_set_version = ?
+                    WHERE keyword_set_version IN ({','.join('?' * len(versions))})
+                ''', [current] + versions)
+
+    def _record_match(self, direction, match):
+        with self._lock:
+            matches = self.progress['matches'].setdefault(direction, [])
+            if len(matches) < REPORT_LIMIT:
+                matches.append(match)
+
+
+_current_job = None
+_job_lock = threading.Lock()
+
+
+def start_rescan(targets, queue_replies=False, match_config=None):
+    """启动后台重扫；已有任务在运行时返回 None"""
+    global _current_job
+    with _job_lock:
+        if _current_job is not None and _current_job.is_alive():
+            return None
+        _current_job = RescanJob(targets, queue_replies, match_config=match_config)
+        _current_job.start()
+    logging.info(f"🔁 已启动关键词重扫任务（{'匹配后排队回复' if queue_replies else '只报告'}）")
+    return _current_job
+
+
+def current_job():
+    return _current_job
+
+
+def queued_replies(db_file, limit=20):
+    """待发送回复的重扫匹配；received_date 取原邮件的日期（keyword_emails 中没有时取处理日志）"""
+    rows = db_access.query_all(db_file, '''
+        SELECT m.id, m.email_uid, m.manifest_hash, m.sender, m.subject, m.keywords, m.containers,
+               COALESCE(
+                   (SELECT received_date FROM keyword_emails
+                    WHERE email_uid = m.email_uid AND received_date != '' LIMIT 1),
+                   (SELECT received_date FROM processing_log
+                    WHERE email_uid = m.email_uid AND received_date != '' ORDER BY id DESC LIMIT 1),
+                   '')
+        FROM rescan_matches m WHERE m.reply_status = ? ORDER BY m.id LIMIT ?
+    ''', (REPLY_QUEUED, int(limit)))
+    keys = ['id', 'email_uid', 'manifest_hash', 'sender', 'subject', 'keywords', 'containers', 'received_date']
+    matches = [dict(zip(keys, row)) for row in rows]
+    for match in matches:
+        match['containers'] = json.loads(match['containers'])
+    return matches
+
+
+def mark_reply(db_file, match_id, status):
+    with db_access.transaction(db_file) as conn:
+        conn.execute('UPDATE rescan_matches SET reply_status = ? WHERE id = ?', (status, match_id))
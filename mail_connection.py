@@ -0,0 +1,199 @@
+"""
+邮件连接工厂
+POP3/SMTP 共用一个长期存在的 ssl.SSLContext，并在重连时复用TLS会话（session resumption），
+避免每次轮询、每次回复都做一次完整的TLS握手和证书校验。
+同时记录每次握手耗时，便于排查连接慢的问题。
+"""
+
+import poplib
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import logging
+
+
+class _ResumableTLSMixin:
+    """在建立TLS连接时使用工厂的共享上下文并尝试复用上一次的会话"""
+
+    _protocol = ''
+
+    def _wrap_with_factory(self, sock, host, port):
+        return self._factory.wrap_socket(sock, self._protocol, host, port)
+
+    def _remember_session(self):
+        try:
+            self._factory.remember_session(self._protocol, self._tls_host, self._tls_port, self.sock)
+        except Exception:
+            pass
+
+
+class ResumablePOP3_SSL(_ResumableTLSMixin, poplib.POP3_SSL):
+    """支持TLS会话复用的 POP3_SSL"""
+
+    _protocol = 'pop3'
+
+    def __init__(self, host, port, timeout, factory):
+        self._factory = factory
+        self._tls_host = host
+        self._tls_port = port
+        poplib.POP3_SSL.__init__(self, host, port, timeout=timeout, context=factory.context)
+        # POP3 在构造时已读取欢迎语，TLS 1.3 的会话票据此时通常已到达
+        self._remember_session()
+
+    def _create_socket(self, timeout):
+        started = time.perf_counter()
+        sock = poplib.POP3._create_socket(self, timeout)
+        self._factory.record_tcp_connect(self._protocol, time.perf_counter() - started)
+        return self._wrap_with_factory(sock, self.host, self.port)
+
+    def quit(self):
+        self._remember_session()
+        return poplib.POP3_SSL.quit(self)
+
+
+class ResumableSMTP_SSL(_ResumableTLSMixin, smtplib.SMTP_SSL):
+    """支持TLS会话复用的 SMTP_SSL"""
+
+    _protocol = 'smtp'
+
+    def __init__(self, host, port, timeout, factory):
+        self._factory = factory
+        self._tls_host = host
+        self._tls_port = port
+        smtplib.SMTP_SSL.__init__(self, host, port, timeout=timeout, context=factory.context)
+        self._remember_session()
+
+    def _get_socket(self, host, port, timeout):
+        if self.debuglevel > 0:
+            self._print_debug('connect:', (host, port))
+        started = time.perf_counter()
+        sock = smtplib.SMTP._get_socket(self, host, port, timeout)
+        self._factory.record_tcp_connect(self._protocol, time.perf_counter() - started)
+        return self._wrap_with_factory(sock, self._host, port)
+
+    def quit(self):
+        self._remember_session()
+        return smtplib.SMTP_SSL.quit(self)
+
+
+class MailConnectionFactory:
+    """邮件连接工厂 - 持有共享的SSL上下文和按服务器缓存的TLS会话"""
+
+    def __init__(self, verify_certificates=True):
+        self.verify_certificates = verify_certificates
+        self.context = self._create_context(verify_certificates)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @staticmethod
+    def _create_context(verify_certificates):
+        context = ssl.create_default_context()
+        if not verify_certificates:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _stats_for(self, protocol):
+        return self._stats.setdefault(protocol, {
+            'connections': 0,
+            'resumed': 0,
+            'tcp_connect_ms_total': 0.0,
+            'handshake_ms_total': 0.0,
+            'last_tcp_connect_ms': 0.0,
+            'last_handshake_ms': 0.0,
+            'last_resumed': False
+        })
+
+    def record_tcp_connect(self, protocol, seconds):
+        with self._lock:
+            stats = self._stats_for(protocol)
+            stats['last_tcp_connect_ms'] = seconds * 1000
+            stats['tcp_connect_ms_total'] += seconds * 1000
+
+    def wrap_socket(self, sock, protocol, host, port):
+        """使用共享上下文完成TLS握手，如有缓存的会话则尝试复用"""
+        with self._lock:
+            session = self._sessions.get((protocol, host, port))
+
+        started = time.perf_counter()
+        try:
+            tls_sock = self.context.wrap_socket(sock, server_hostname=host, session=session)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # 缓存的会话已失效，丢弃后做一次完整握手
+            with self._lock:
+                self._sessions.pop((protocol, host, port), None)
+            timeout = sock.gettimeout()
+            sock.close()
+            sock = socket.create_connection((host, port), timeout)
+            tls_sock = self.context.wrap_socket(sock, server_hostname=host)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        resumed = bool(getattr(tls_sock, 'session_reused', False))
+        with self._lock:
+            stats = self._stats_for(protocol)
+            stats['connections'] += 1
+            stats['handshake_ms_total'] += elapsed_ms
+            stats['last_handshake_ms'] = elapsed_ms
+            stats['last_resumed'] = resumed
+            if resumed:
+                stats['resumed'] += 1
+
+        logging.info(f"🔐 {protocol.upper()} TLS握手 {host}:{port} 耗时 {elapsed_ms:.1f}ms"
+                     f"（会话复用: {'是' if resumed else '否'}）")
+        return tls_sock
+
+    def remember_session(self, protocol, host, port, sock):
+        """保存连接的TLS会话，供下一次连接同一服务器时复用"""
+        session = getattr(sock, 'session', None)
+        if session is None:
+            return
+        with self._lock:
+            self._sessions[(protocol, host, port)] = session
+
+    def pop3(self, host, port=995, timeout=30):
+        """创建POP3_SSL连接"""
+        return ResumablePOP3_SSL(host, port, timeout, self)
+
+    def smtp(self, host, port=465, timeout=30):
+        """创建SMTP_SSL连接"""
+        return ResumableSMTP_SSL(host, port, timeout, self)
+
+    def get_handshake_stats(self):
+        """获取握手耗时统计（毫秒）"""
+        with self._lock:
+            report = {}
+            for protocol, stats in self._stats.items():
+                connections = stats['connections'] or 1
+                report[protocol] = {
+                    'connections': stats['connections'],
+                    'resumed': stats['resumed'],
+                    'avg_tcp_connect_ms': round(stats['tcp_connect_ms_total'] / connections, 1),
+                    'avg_handshake_ms': round(stats['handshake_ms_total'] / connections, 1),
+                    'last_tcp_connect_ms': round(stats['last_tcp_connect_ms'], 1),
+                    'last_handshake_ms': round(stats['last_handshake_ms'], 1),
+                    'last_resumed': stats['last_resumed']
+                }
+            return report
+
+    def log_handshake_stats(self):
+        """把握手统计输出到日志"""
+        for protocol, stats in self.get_handshake_stats().items():
+            logging.info(f"📈 {protocol.upper()} 连接 {stats['connections']} 次，会话复用 {stats['resumed']} 次，"
+                         f"平均TCP连接 {stats['avg_tcp_connect_ms']}ms，平均TLS握手 {stats['avg_handshake_ms']}ms")
+
+
+_factory = None
+_factory_lock = threading.Lock()
+
+def get_connection_factory(verify_certificates=True):
+    """获取进程内共享的连接工厂（第一次调用时创建）"""
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            _factory = MailConnectionFactory(verify_certificates)
+        return _factory
@@ -0,0 +1,88 @@
+"""
+舱单货物记录提取（与关键词无关）
+进口/出口处理程序的解析函数原来边读记录边按关键词过滤，不匹配的箱子直接丢弃。
+这里把“读出每个箱子的 箱号、提单号、货物描述”单独提出来，处理程序在此基础上做关键词匹配（见 keyword_matcher），
+关键词重扫（keyword_rescan）也用它给保存的舱单原文建立货名索引。
+"""
+
+import re
+
+from attachment_spool import iter_text_lines
+
+_TERM_PATTERN = re.compile(r'[A-Z0-9]+')
+
+
+def iter_export_goods(txt_content):
+    """
+    出口舱单（51/53 定长记录）：产出 (箱号, 提单号, 英文货名)
+    51 行：箱号在 [2:13]，提单号在 [28:44]；货名取其后第一条 53 行的 [13:43]，找不到时为“未知货名”
+    """
+    records = [line for line in iter_text_lines(txt_content) if line.startswith('51') or line.startswith('53')]
+
+    # 从后往前记下每个位置之后的第一条 53 行，避免每个 51 行都向后扫描
+    next_goods = [None] * len(records)
+    goods = None
+    for i in range(len(records) - 1, -1, -1):
+        next_goods[i] = goods
+        if records[i].startswith('53') and len(records[i]) >= 43:
+            goods = records[i][13:43].strip()
+
+    for i, record in enumerate(records):
+        if record.startswith('51') and len(record) >= 44:
+            container_no = record[2:13].strip()
+            bill_of_lading = record[28:44].replace('\x00', '').strip()
+            english_goods = next_goods[i] if next_goods[i] is not None else "未知货名"
+            yield container_no, bill_of_lading, english_goods
+
+
+def iter_import_goods(txt_content):
+    """
+    进口舱单（冒号分隔的 IFCSUM 记录）：产出 (箱号, 提单号, 货物描述)
+    12 行开始一个提单，44 行唛头和 47 行货物描述拼成该提单的货物描述，51 行为箱号
+    """
+    current_bl_no = None
+    goods_desc_parts = []
+    bl_goods_desc = {}
+
+    for line in iter_text_lines(txt_content):
+        line = line.strip().rstrip("'")
+        if not line:
+            continue
+        parts = line.split(':')
+        record_id = parts[0]
+
+        if record_id == '12' and len(parts) > 1:
+            if current_bl_no and goods_desc_parts:
+                bl_goods_desc[current_bl_no] = ' '.join(goods_desc_parts)
+                goods_desc_parts = []
+            current_bl_no = parts[1]
+        elif record_id in ('44', '47'):
+            if len(parts) > 1:
+                text = ':'.join(parts[1:])
+                if text and text.strip() and text.strip().upper() != 'N/M':
+                    goods_desc_parts.append(text)
+        elif record_id == '51' and len(parts) >= 2:
+            container_no = parts[1]
+            if container_no and container_no.strip():
+                if current_bl_no in bl_goods_desc:
+                    goods_desc = bl_goods_desc[current_bl_no]
+                else:
+                    goods_desc = ' '.join(goods_desc_parts)
+                yield container_no, current_bl_no or '', goods_desc
+
+
+def iter_goods(txt_content, direction):
+    """按方向（'import' / 'export'）产出舱单中的全部 (箱号, 提单号, 货物描述)"""
+    if direction == 'import':
+        return iter_import_goods(txt_content)
+    return iter_export_goods(txt_content)
+
+
+def term_list(text):
+    """货名索引使用的词（按出现顺序）：大写后的连续字母数字"""
+    return _TERM_PATTERN.findall((text or '').upper())
+
+
+def terms(text):
+    """货名索引使用的词集合"""
+    return set(term_list(text))
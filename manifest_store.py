@@ -0,0 +1,183 @@
+"""
+舱单原文存储（按内容寻址）
+处理程序原来只记录附件名，TXT 原文解析完就丢弃，之后要用新关键词重新检查旧邮件只能再从服务器下载，
+而服务器上的邮件可能已经删除。这里把每份解析过的舱单按 SHA-256 存为 gzip 文件：
+    manifests/<哈希前两位>/<哈希>.gz
+同一份舱单重复发送只存一份；索引库 manifests/index.db 记录大小和最近使用时间，
+总大小超过 SIZE_BUDGET 时按最近最少使用淘汰。keyword_emails.manifest_hash 和
+processing_log.manifest_hashes 记录引用的哈希，已淘汰的舱单 get 返回 None。
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import logging
+import tempfile
+
+import db_access
+from attachment_spool import ManifestText
+
+STORE_DIR = 'manifests'
+
+# 存储总大小上限（压缩后的字节数）
+SIZE_BUDGET = 1024 * 1024 * 1024
+
+COMPRESS_LEVEL = 6
+
+_READ_CHUNK = 256 * 1024
+
+
+class ManifestStore:
+    """舱单原文的内容寻址存储；多个进程可以同时使用同一个目录"""
+
+    def __init__(self, store_dir=STORE_DIR, size_budget=SIZE_BUDGET):
+        self.store_dir = store_dir
+        self.size_budget = size_budget
+        self.index_file = os.path.join(store_dir, 'index.db')
+        self._ready = False
+
+    def _ensure_index(self):
+        if self._ready:
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        with db_access.transaction(self.index_file) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS manifest_blobs (
+                    hash TEXT PRIMARY KEY,
+                    filename TEXT,
+                    size INTEGER NOT NULL,
+                    stored_size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_manifest_blobs_access ON manifest_blobs(last_access)')
+        self._ready = True
+
+    def path(self, digest):
+        return os.path.join(self.store_dir, digest[:2], f'{digest}.gz')
+
+    def put(self, content, filename=''):
+        """
+        保存一份舱单（ManifestText、bytes 或 str），返回其 SHA-256
+        边读边计算哈希并压缩写入临时文件，已存在相同内容时只更新使用时间
+        """
+        self._ensure_index()
+        if isinstance(content, ManifestText):
+            filename = filename or content.filename
+            source = content.open_raw()
+        elif isinstance(content, str):
+            source = ManifestText.from_bytes(filename, content.encode('utf-8')).open_raw()
+        else:
+            source = ManifestText.from_bytes(filename, content).open_raw()
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix='.manifest_', dir=self.store_dir)
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb',
+                                                           compresslevel=COMPRESS_LEVEL, mtime=0) as gz:
+                while True:
+                    chunk = source.read(_READ_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    gz.write(chunk)
+                    size += len(chunk)
+            key = digest.hexdigest()
+            now = time.time()
+
+            with db_access.transaction(self.index_file) as conn:
+                if conn.execute('UPDATE manifest_blobs SET last_access = ? WHERE hash = ?',
+                                (now, key)).rowcount and os.path.exists(self.path(key)):
+                    logging.info(f"📦 舱单 {filename} 与已保存的内容相同，不重复存储 ({key[:12]})")
+                    return key
+                target = self.path(key)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+                tmp_path = None
+                conn.execute('''
+                    INSERT OR REPLACE INTO manifest_blobs (hash, filename, size, stored_size, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, filename, size, os.path.getsize(target), now, now))
+            logging.info(f"📦 已保存舱单原文 {filename} ({key[:12]}, {size / 1024:.1f} KB)")
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict(keep=key)
+        return key
+
+    def get(self, digest):
+        """读取舱单原文（bytes），不存在或已淘汰时返回 None"""
+        self._ensure_index()
+        try:
+            with gzip.open(self.path(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with db_access.transaction(self.index_file) as conn:
+            conn.execute('UPDATE manifest_blobs SET last_access = ? WHERE hash = ?', (time.time(), digest))
+        return data
+
+    def open_text(self, digest, filename=None):
+        """以 ManifestText 形式读取舱单，可直接交给解析函数；不存在时返回 None"""
+        data = self.get(digest)
+        if data is None:
+            return None
+        if filename is None:
+            filename = db_access.query_value(self.index_file, 'SELECT filename FROM manifest_blobs WHERE hash = ?',
+                                             (digest,), default='') or f'{digest}.txt'
+        return ManifestText.from_bytes(filename, data)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def total_size(self):
+        self._ensure_index()
+        return db_access.query_value(self.index_file, 'SELECT COALESCE(SUM(stored_size), 0) FROM manifest_blobs',
+                                     default=0)
+
+    def evict(self, size_budget=None, keep=None):
+        """按最近最少使用淘汰，直到总大小不超过预算，返回淘汰的份数；keep 为刚保存、不淘汰的哈希"""
+        budget = self.size_budget if size_budget is None else size_budget
+        total = self.total_size()
+        if total <= budget:
+            return 0
+
+        evicted = 0
+        with db_access.transaction(self.index_file) as conn:
+            for digest, stored_size in conn.execute(
+                    'SELECT hash, stored_size FROM manifest_blobs ORDER BY last_access').fetchall():
+                if total <= budget:
+                    break
+                if digest == keep:
+                    continue
+                conn.execute('DELETE FROM manifest_blobs WHERE hash = ?', (digest,))
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+                total -= stored_size
+                evicted += 1
+        logging.info(f"🗑️ 舱单存储超过 {budget / 1024 / 1024:.1f} MB，已淘汰最久未使用的 {evicted} 份")
+        return evicted
+
+    def stats(self):
+        """份数、原始大小和压缩后大小"""
+        self._ensure_index()
+        count, size, stored = db_access.query_one(
+            self.index_file, 'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM manifest_blobs')
+        return {'count': count, 'size': size, 'stored_size': stored}
+
+
+_default_store = None
+
+
+def default_store():
+    """处理程序共用的存储实例"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ManifestStore()
+    return _default_store
@@ -0,0 +1,189 @@
+"""
+POP3 命令流水线（RFC 2449 PIPELINING）
+服务器在 CAPA 中声明 PIPELINING 时，把一批 TOP/RETR/DELE 命令一次性写出，再按顺序读取各自的响应，
+每封邮件不再单独等待一个往返；服务器不支持时自动退回逐条发送。
+
+直接运行本文件会在本机启动一个注入延迟的 POP3 模拟服务器，对比两种方式的耗时：
+    python pop3_pipelining.py [邮件数量] [单程延迟毫秒]
+"""
+
+import poplib
+import logging
+
+# 每批最多同时在途的命令数，避免一次缓存过多邮件内容
+DEFAULT_WINDOW = 10
+
+
+class POP3Pipeline:
+    """在已登录的 poplib.POP3/POP3_SSL 连接上批量执行 TOP/RETR/DELE"""
+
+    def __init__(self, server, window=DEFAULT_WINDOW):
+        self.server = server
+        self.window = max(1, int(window))
+        self._supported = None
+
+    @property
+    def supports_pipelining(self):
+        """通过 CAPA 检测服务器是否支持 PIPELINING（结果按连接缓存）"""
+        if self._supported is None:
+            try:
+                self._supported = 'PIPELINING' in self.server.capa()
+            except poplib.error_proto:
+                self._supported = False
+            except Exception as e:
+                logging.warning(f"⚠️ 检测POP3 PIPELINING能力失败，使用逐条模式: {e}")
+                self._supported = False
+            if self._supported:
+                logging.info("🚀 POP3服务器支持PIPELINING，启用批量命令")
+        return self._supported
+
+    def top_many(self, msg_nums, lines=0):
+        """批量获取邮件头部，依次产出 (序号, 响应或异常)"""
+        return self._run(msg_nums, lambda n: f'TOP {n} {int(lines)}', True,
+                         lambda n: self.server.top(n, lines))
+
+    def retr_many(self, msg_nums):
+        """批量获取完整邮件，依次产出 (序号, 响应或异常)"""
+        return self._run(msg_nums, lambda n: f'RETR {n}', True,
+                         lambda n: self.server.retr(n))
+
+    def dele_many(self, msg_nums):
+        """批量标记删除，依次产出 (序号, 响应或异常)"""
+        return self._run(msg_nums, lambda n: f'DELE {n}', False,
+                         lambda n: self.server.dele(n))
+
+    def _run(self, msg_nums, build_command, multiline, single):
+        """
+        按窗口执行命令。单条命令的 -ERR 以 poplib.error_proto 实例的形式产出，
+        不影响同批其他命令；连接级错误直接抛出。
+        """
+        msg_nums = list(msg_nums)
+        if not self.supports_pipelining:
+            for n in msg_nums:
+                try:
+                    yield n, single(n)
+                except poplib.error_proto as e:
+                    yield n, e
+            return
+
+        for start in range(0, len(msg_nums), self.window):
+            batch = msg_nums[start:start + self.window]
+            # 先读完整批响应再逐个产出，调用方中途 break 也不会让连接上残留未读的响应
+            yield from zip(batch, self._send_batch([build_command(n) for n in batch], multiline))
+
+    def _send_batch(self, commands, multiline):
+        """一次写出整批命令，再按发送顺序读取响应"""
+        server = self.server
+        payload = b''.join(cmd.encode(server.encoding) + poplib.CRLF for cmd in commands)
+        if server._debugging > 1:
+            print('*pipeline*', repr(payload))
+        server.sock.sendall(payload)
+
+        results = []
+        for _ in commands:
+            try:
+                results.append(server._getlongresp() if multiline else server._getresp())
+            except poplib.error_proto as e:
+                results.append(e)
+        return results
+
+
+def _start_standin(message_count, latency_ms=0, pipelining=True):
+    """
+    在本机启动注入延迟的 POP3 模拟服务器（基准测试和单元测试使用），返回 (监听套接字, 统计)
+    每收到一个数据包等待 latency_ms 模拟一次网络往返，统计中的 packets 为收到的数据包数
+    """
+    import socket
+    import threading
+    import time
+
+    latency = latency_ms / 1000
+    stats = {'packets': 0}
+    body = b'\r\n'.join([b'Date: Mon, 1 Jan 2024 08:00:00 +0800', b'Subject: test', b''] +
+                        [b'x' * 70] * 40)
+
+    def handle(conn):
+        conn.sendall(b'+OK ready\r\n')
+        buffer = b''
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                return
+            # 每收到一个数据包模拟一次网络往返
+            stats['packets'] += 1
+            time.sleep(latency)
+            buffer += chunk
+            out = []
+            while b'\r\n' in buffer:
+                line, buffer = buffer.split(b'\r\n', 1)
+                parts = line.decode().split()
+                cmd = parts[0].upper() if parts else ''
+                if cmd == 'CAPA':
+                    caps = [b'TOP', b'UIDL'] + ([b'PIPELINING'] if pipelining else [])
+                    out.append(b'+OK\r\n' + b'\r\n'.join(caps) + b'\r\n.\r\n')
+                elif cmd in ('USER', 'PASS', 'DELE', 'NOOP'):
+                    out.append(b'+OK\r\n')
+                elif cmd in ('TOP', 'RETR'):
+                    n = int(parts[1])
+                    if n > message_count:
+                        out.append(b'-ERR no such message\r\n')
+                    else:
+                        data = body.split(b'\r\n\r\n')[0] if cmd == 'TOP' else body
+                        out.append(b'+OK\r\n' + data + b'\r\n.\r\n')
+                elif cmd == 'QUIT':
+                    conn.sendall(b''.join(out) + b'+OK bye\r\n')
+                    return
+                else:
+                    out.append(b'-ERR unknown\r\n')
+            if out:
+                conn.sendall(b''.join(out))
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    threading.Thread(target=serve, daemon=True).start()
+    return listener, stats
+
+
+def _run_benchmark(message_count=50, latency_ms=20):
+    """在本机模拟服务器上对比逐条模式和流水线模式"""
+    import time
+
+    results = {}
+    for pipelining in (False, True):
+        listener, _ = _start_standin(message_count, latency_ms, pipelining)
+        server = poplib.POP3('127.0.0.1', listener.getsockname()[1], timeout=30)
+        server.user('bench')
+        server.pass_('bench')
+        pipeline = POP3Pipeline(server)
+        nums = range(message_count, 0, -1)
+
+        started = time.perf_counter()
+        headers = sum(1 for _, r in pipeline.top_many(nums, 0) if not isinstance(r, Exception))
+        messages = sum(1 for _, r in pipeline.retr_many(nums) if not isinstance(r, Exception))
+        elapsed = time.perf_counter() - started
+
+        server.quit()
+        listener.close()
+        mode = '流水线' if pipelining else '逐条'
+        results[mode] = elapsed
+        print(f"{mode}模式: TOP {headers} 封 + RETR {messages} 封，耗时 {elapsed:.2f}s")
+
+    if results.get('流水线'):
+        print(f"加速比: {results['逐条'] / results['流水线']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    _run_benchmark(count, delay)
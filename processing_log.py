@@ -0,0 +1,338 @@
+"""
+邮件处理日志（去重索引 + 审计记录）
+原来的 email_processing_log*.csv 改为存放在处理程序数据库中的 processing_log 表：
+按 email_uid / sender / 日期建立索引，关键词单独建表索引；
+查询最新记录按自增ID倒序取，不需要读全表；保留期清理按日期索引删除过期记录。
+processing_log_daily 按日期保存处理数、关键词邮件数、已发送Excel数，写入和清理时同步增减，
+summary 只读这张小表，不扫描日志表。
+旧的CSV日志在初始化时按UID导入（表中已有的UID跳过），仍可导出为原CSV格式。
+表结构由 db_schema 的版本迁移调用 create_tables 创建；init_processing_log 会先执行迁移，
+tail / summary / write_csv 读取前都会初始化，调用方不需要先请求其他接口。
+"""
+
+import csv
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+
+import db_access
+
+CSV_HEADER = ['timestamp', 'email_uid', 'sender', 'subject',
+              'has_keyword', 'excel_sent', 'matched_keywords', 'container_count']
+
+_SELECT_COLUMNS = ('logged_at, email_uid, sender, subject, has_keyword, excel_sent, '
+                   'matched_keywords, container_count, manifest_hashes')
+
+# IN 查询每批的UID数量
+_UID_BATCH = 500
+
+# 本进程已初始化过的数据库
+_initialized = set()
+
+# 每日计数表
+DAILY_TABLE = 'processing_log_daily'
+
+
+def create_tables(db_file):
+    """创建日志表和关键词表"""
+    with db_access.transaction(db_file) as conn:
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS processing_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                logged_at TEXT NOT NULL,
+                log_day TEXT NOT NULL,
+                email_uid TEXT NOT NULL,
+                sender TEXT,
+                subject TEXT,
+                has_keyword INTEGER DEFAULT 0,
+                excel_sent INTEGER DEFAULT 0,
+                matched_keywords TEXT,
+                container_count INTEGER DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_processing_log_uid ON processing_log(email_uid);
+            CREATE INDEX IF NOT EXISTS idx_processing_log_day ON processing_log(log_day);
+            CREATE INDEX IF NOT EXISTS idx_processing_log_sender ON processing_log(sender);
+            CREATE TABLE IF NOT EXISTS processing_log_keywords (
+                keyword TEXT NOT NULL,
+                log_id INTEGER NOT NULL,
+                PRIMARY KEY (keyword, log_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_processing_log_keywords_log ON processing_log_keywords(log_id);
+        ''')
+    return True
+
+
+def add_manifest_column(db_file):
+    """processing_log.manifest_hashes：本封邮件保存的舱单原文哈希（逗号分隔，见 manifest_store）"""
+    with db_access.transaction(db_file) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(processing_log)").fetchall()]
+        if 'manifest_hashes' not in columns:
+            conn.execute("ALTER TABLE processing_log ADD COLUMN manifest_hashes TEXT DEFAULT ''")
+            logging.info(f"🔄 {db_file} 已添加列: processing_log.manifest_hashes")
+    return True
+
+
+def add_received_date_column(db_file):
+    """processing_log.received_date：邮件的日期头（关键词重扫后补发回复时沿用原邮件的日期）"""
+    with db_access.transaction(db_file) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(processing_log)").fetchall()]
+        if 'received_date' not in columns:
+            conn.execute("ALTER TABLE processing_log ADD COLUMN received_date TEXT DEFAULT ''")
+            logging.info(f"🔄 {db_file} 已添加列: processing_log.received_date")
+    return True
+
+
+def create_daily_totals(db_file):
+    """创建每日计数表；第一次创建时根据现有日志生成"""
+    with db_access.transaction(db_file) as conn:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                              (DAILY_TABLE,)).fetchone()
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+                log_day TEXT PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                keyword INTEGER NOT NULL DEFAULT 0,
+                excel_sent INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+
+    if not exists:
+        rebuild_daily_totals(db_file)
+    return True
+
+
+def rebuild_daily_totals(db_file):
+    """根据日志表重新生成每日计数"""
+    with db_access.transaction(db_file) as conn:
+        conn.execute(f'DELETE FROM {DAILY_TABLE}')
+        conn.execute(f'''
+            INSERT INTO {DAILY_TABLE} (log_day, total, keyword, excel_sent)
+            SELECT log_day, COUNT(*), COALESCE(SUM(has_keyword), 0), COALESCE(SUM(excel_sent), 0)
+            FROM processing_log GROUP BY log_day
+        ''')
+    return True
+
+
+def _apply_daily(conn, rows, sign):
+    """把 (日期, 处理数, 关键词邮件数, 已发送Excel数) 累加到每日计数表，sign 为 +1 或 -1"""
+    rows = [(day, sign * total, sign * (keyword or 0), sign * (excel_sent or 0))
+            for day, total, keyword, excel_sent in rows]
+    if not rows:
+        return
+    conn.executemany(f'''
+        INSERT INTO {DAILY_TABLE} (log_day, total, keyword, excel_sent) VALUES (?, ?, ?, ?)
+        ON CONFLICT(log_day) DO UPDATE SET
+            total = total + excluded.total,
+            keyword = keyword + excluded.keyword,
+            excel_sent = excel_sent + excluded.excel_sent
+    ''', rows)
+    if sign < 0:
+        conn.executemany(f'DELETE FROM {DAILY_TABLE} WHERE log_day = ? AND total <= 0',
+                         [(row[0],) for row in rows])
+
+
+def init_processing_log(db_file, legacy_csv=None):
+    """
+    迁移数据库表结构，如存在旧CSV日志则导入表中还没有的UID
+    未给出 legacy_csv 时只做迁移，之后带 legacy_csv 的调用仍会导入
+    """
+    key = os.path.abspath(db_file)
+    if key in _initialized:
+        return True
+
+    # db_schema 的迁移列表引用本模块，这里在函数内导入
+    import db_schema
+    db_schema.migrate(db_file)
+    if not legacy_csv:
+        return True
+    if os.path.exists(legacy_csv):
+        _import_legacy_csv(db_file, legacy_csv)
+    _initialized.add(key)
+    return True
+
+
+def _split_keywords(matched_keywords):
+    return {k.strip() for k in (matched_keywords or '').split(',') if k.strip()}
+
+
+def _insert(conn, logged_at, email_uid, sender, subject, has_keyword, excel_sent,
+            matched_keywords, container_count, manifest_hashes='', keyword_set_version=0, received_date=''):
+    cursor = conn.execute('''
+        INSERT INTO processing_log (logged_at, log_day, email_uid, sender, subject, has_keyword,
+                                    excel_sent, matched_keywords, container_count, manifest_hashes,
+                                    keyword_set_version, received_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (logged_at, logged_at[:10], email_uid, sender, subject, int(has_keyword),
+          int(excel_sent), matched_keywords, int(container_count or 0), manifest_hashes or '',
+          int(keyword_set_version or 0), received_date or ''))
+    _apply_daily(conn, [(logged_at[:10], 1, int(has_keyword), int(excel_sent))], 1)
+    keywords = _split_keywords(matched_keywords)
+    if keywords:
+        conn.executemany('INSERT OR IGNORE INTO processing_log_keywords (keyword, log_id) VALUES (?, ?)',
+                         [(keyword, cursor.lastrowid) for keyword in keywords])
+
+
+def _import_legacy_csv(db_file, legacy_csv):
+    """
+    把旧CSV日志导入数据库，导入后将原文件改名保留
+    按UID导入：表中已有记录的UID跳过（例如CSV导入前新版本已经处理过的邮件），其余UID照常导入
+    """
+    with open(legacy_csv, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # 跳过标题行
+        rows = [row for row in reader if len(row) >= 2 and row[1]]
+
+    count = 0
+    with db_access.transaction(db_file) as conn:
+        existing = _existing_uids(conn, {row[1] for row in rows})
+        for row in rows:
+            if row[1] in existing:
+                continue
+            row = row + [''] * (8 - len(row))
+            logged_at = row[0] if len(row[0]) >= 10 else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                container_count = int(row[7] or 0)
+            except ValueError:
+                container_count = 0
+            _insert(conn, logged_at, row[1], row[2], row[3], row[4] == '1', row[5] == '1',
+                    row[6], container_count)
+            count += 1
+
+    migrated = legacy_csv + '.migrated'
+    try:
+        os.replace(legacy_csv, migrated)
+    except OSError as e:
+        logging.warning(f"⚠️ 旧日志文件改名失败: {e}")
+    logging.info(f"✅ 已从 {legacy_csv} 导入 {count} 条处理日志（跳过已有UID {len(existing)} 个），"
+                 f"原文件保留为 {migrated}")
+
+
+def log_processed(db_file, email_uid, sender, subject, has_keyword=False, excel_sent=0,
+                  matched_keywords="", container_count=0, manifest_hashes="", keyword_set_version=0,
+                  received_date=""):
+    """
+    追加一条处理记录；manifest_hashes 为保存的舱单原文哈希（逗号分隔），
+    keyword_set_version 为处理时使用的关键词集合版本（见 keyword_rescan），received_date 为邮件的日期头
+    """
+    logged_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db_access.transaction(db_file) as conn:
+        _insert(conn, logged_at, email_uid, sender, subject, has_keyword, excel_sent,
+                matched_keywords, container_count, manifest_hashes, keyword_set_version, received_date)
+    return True
+
+
+def is_processed(db_file, email_uid):
+    """邮件是否已处理过"""
+    return db_access.query_one(db_file, 'SELECT 1 FROM processing_log WHERE email_uid = ? LIMIT 1',
+                               (email_uid,)) is not None
+
+
+def _existing_uids(conn, uids):
+    """uids 中在日志表里已有记录的UID集合，按批 IN 查询走 email_uid 索引"""
+    uids = list(uids)
+    found = set()
+    for start in range(0, len(uids), _UID_BATCH):
+        batch = uids[start:start + _UID_BATCH]
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(f'SELECT DISTINCT email_uid FROM processing_log WHERE email_uid IN ({placeholders})',
+                            batch).fetchall()
+        found.update(row[0] for row in rows)
+    return found
+
+
+def processed_uids(db_file, uids):
+    """批量检查，返回其中已处理过的UID集合"""
+    with db_access.connection(db_file) as conn:
+        return _existing_uids(conn, uids)
+
+
+def purge_older_than(db_file, days, chunk_size=500, pause=0):
+    """删除超过保留天数的记录，按ID分批、每批一个短事务，返回删除条数"""
+    cutoff_day = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    deleted = 0
+    while True:
+        with db_access.transaction(db_file) as conn:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM processing_log WHERE log_day < ? ORDER BY id LIMIT ?',
+                (cutoff_day, chunk_size)).fetchall()]
+            if not ids:
+                break
+            placeholders = ','.join('?' * len(ids))
+            _apply_daily(conn, conn.execute(f'''
+                SELECT log_day, COUNT(*), SUM(has_keyword), SUM(excel_sent) FROM processing_log
+                WHERE id IN ({placeholders}) GROUP BY log_day
+            ''', ids).fetchall(), -1)
+            conn.execute(f'DELETE FROM processing_log_keywords WHERE log_id IN ({placeholders})', ids)
+            deleted += conn.execute(f'DELETE FROM processing_log WHERE id IN ({placeholders})', ids).rowcount
+        if len(ids) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def _row_to_dict(row):
+    return {
+        'timestamp': row[0],
+        'email_uid': row[1],
+        'sender': row[2],
+        'subject': row[3],
+        'has_keyword': bool(row[4]),
+        'excel_sent': bool(row[5]),
+        'matched_keywords': row[6] or '',
+        'container_count': row[7],
+        'manifest_hashes': row[8] or ''
+    }
+
+
+def tail(db_file, limit=100, email_uid=None, sender=None, keyword=None, legacy_csv=None):
+    """最新的 limit 条记录（按时间正序返回），可按UID、发件人、关键词过滤"""
+    init_processing_log(db_file, legacy_csv)
+    conditions = []
+    params = []
+    if email_uid:
+        conditions.append('email_uid = ?')
+        params.append(email_uid)
+    if sender:
+        conditions.append('sender = ?')
+        params.append(sender)
+    if keyword:
+        conditions.append('id IN (SELECT log_id FROM processing_log_keywords WHERE keyword = ?)')
+        params.append(keyword)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    rows = db_access.query_all(db_file, f'''
+        SELECT {_SELECT_COLUMNS} FROM processing_log {where}
+        ORDER BY id DESC LIMIT ?
+    ''', params + [int(limit)])
+    return [_row_to_dict(row) for row in reversed(rows)]
+
+
+def summary(db_file, legacy_csv=None):
+    """总数、关键词邮件数、已发送Excel数、今日处理数（读每日计数表，每天一行）"""
+    init_processing_log(db_file, legacy_csv)
+    today = datetime.now().strftime('%Y-%m-%d')
+    row = db_access.query_one(db_file, f'''
+        SELECT COALESCE(SUM(total), 0), COALESCE(SUM(keyword), 0), COALESCE(SUM(excel_sent), 0),
+               COALESCE((SELECT total FROM {DAILY_TABLE} WHERE log_day = ?), 0)
+        FROM {DAILY_TABLE}
+    ''', (today,))
+    return {'total': row[0], 'keyword': row[1], 'excel_sent': row[2], 'today': row[3]}
+
+
+def write_csv(db_file, f, legacy_csv=None):
+    """按原CSV日志格式写出全部记录（兼容导出）"""
+    init_processing_log(db_file, legacy_csv)
+    writer = csv.writer(f)
+    writer.writerow(CSV_HEADER)
+    with db_access.connection(db_file) as conn:
+        for row in conn.execute(f'SELECT {_SELECT_COLUMNS} FROM processing_log ORDER BY id'):
+            writer.writerow(list(row[:4]) + [int(row[4]), int(row[5]), row[6] or '', row[7]])
+
+
+def export_csv(db_file, csv_path, legacy_csv=None):
+    """导出为CSV文件"""
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        write_csv(db_file, f, legacy_csv)
+    return csv_path
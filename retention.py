@@ -0,0 +1,202 @@
+"""
+数据保留期清理（后台任务）
+原来在程序启动时一次性 DELETE 过期记录：数据多时会长时间锁库，删掉的页也不会还给文件系统。
+这里改为后台线程按周期执行：
+    1. keyword_emails 过期记录按ID分批移入月度归档库（见 archive_store；ARCHIVE_EXPIRED=False 时直接删除），
+       主库中每批一个短事务删除、批间让出写锁，每日汇总同步扣减，关键词关联、箱号、全文索引由触发器级联清理
+    2. processing_log 过期记录同样分批删除
+    3. PRAGMA incremental_vacuum 把空闲页还给文件系统
+每次执行后记录删除行数和回收的字节数。也可以手动执行一次：
+    python retention.py [数据库文件 ...]
+
+新建的数据库创建时就是 auto_vacuum=INCREMENTAL（见 db_access）。之前创建的数据库要切换需要一次完整 VACUUM，
+大库会长时间独占数据库，因此不在后台任务中执行，需要在停止处理程序和网页端后手动转换：
+    python retention.py convert [数据库文件 ...]
+转换之前后台任务只做删除，不回收空间。
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import db_access
+import email_store
+import archive_store
+import processing_log
+
+# 默认保留天数
+EMAIL_RETENTION_DAYS = 90
+
+# 过期邮件移入归档库而不是删除
+ARCHIVE_EXPIRED = True
+
+# 每个事务删除的行数，以及批与批之间的间隔（秒）
+CHUNK_SIZE = 500
+CHUNK_PAUSE = 0.05
+
+# 后台任务执行间隔（秒）与启动后的首次延迟
+RUN_INTERVAL = 6 * 60 * 60
+FIRST_RUN_DELAY = 60
+
+# 每次 incremental_vacuum 最多回收的页数（0 表示全部）
+VACUUM_PAGES = 0
+
+
+# auto_vacuum = INCREMENTAL
+INCREMENTAL_MODE = 2
+
+# 已提示过需要离线转换的数据库（每个进程只提示一次）
+_conversion_warned = set()
+
+
+def is_incremental(db_file):
+    """数据库是否为 auto_vacuum=INCREMENTAL"""
+    return db_access.query_value(db_file, 'PRAGMA auto_vacuum', default=0) == INCREMENTAL_MODE
+
+
+def check_vacuum_mode(db_file):
+    """不是增量回收模式时提示离线转换命令（迁移和后台任务调用，不做转换）"""
+    if is_incremental(db_file):
+        return True
+    if db_file not in _conversion_warned:
+        _conversion_warned.add(db_file)
+        logging.warning(f"⚠️ {db_file} 不是增量回收模式，清理后的空间不会还给文件系统；"
+                        f"请停止处理程序和网页端后执行: python retention.py convert {db_file}")
+    return False
+
+
+def convert_to_incremental(db_file):
+    """
+    把已有数据库切换为 auto_vacuum=INCREMENTAL（完整 VACUUM，执行期间独占数据库）
+    只供离线命令调用，后台任务不执行
+    """
+    if is_incremental(db_file):
+        logging.info(f"✅ {db_file} 已是增量回收模式")
+        return True
+    logging.info(f"🔄 {db_file} 切换为增量回收模式（完整 VACUUM）...")
+    with db_access.connection(db_file) as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    if not is_incremental(db_file):
+        logging.error(f"❌ {db_file} 无法切换为增量回收模式")
+        return False
+    logging.info(f"✅ {db_file} 已切换为增量回收模式")
+    return True
+
+
+def database_size(db_file):
+    """数据库文件大小和其中空闲页占用的字节数"""
+    with db_access.connection(db_file) as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_count * page_size, freelist * page_size
+
+
+def incremental_vacuum(db_file, pages=VACUUM_PAGES):
+    """把空闲页还给文件系统"""
+    with db_access.connection(db_file) as conn:
+        # execute() 只单步执行一次（只回收一页），executescript 才会执行到底
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        # WAL 模式下页数变化要在检查点后才反映到主文件
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+
+def _has_table(db_file, table):
+    return db_access.query_value(db_file, "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?",
+                                 (table,), default=0) > 0
+
+
+def run_retention(db_file, email_days=EMAIL_RETENTION_DAYS, log_days=None,
+                  chunk_size=CHUNK_SIZE, pause=CHUNK_PAUSE, archive=ARCHIVE_EXPIRED):
+    """
+    执行一次清理，返回 {'emails': 移出主库的邮件数, 'archived': 是否归档, 'logs': 删除日志数,
+    'bytes_reclaimed': 回收字节数, 'seconds': 耗时}
+    """
+    started = time.time()
+    report = {'emails': 0, 'archived': archive, 'logs': 0, 'bytes_reclaimed': 0, 'seconds': 0}
+    if not os.path.exists(db_file):
+        return report
+    size_before, _ = database_size(db_file)
+
+    if email_days:
+        cutoff = (datetime.now() - timedelta(days=email_days)).strftime('%Y-%m-%d')
+        if archive:
+            report['emails'] = archive_store.archive_before(db_file, cutoff, chunk_size=chunk_size, pause=pause)
+        else:
+            report['emails'] = email_store.purge_before(db_file, cutoff, chunk_size=chunk_size, pause=pause)
+    if log_days and _has_table(db_file, 'processing_log'):
+        report['logs'] = processing_log.purge_older_than(db_file, log_days, chunk_size=chunk_size, pause=pause)
+
+    if check_vacuum_mode(db_file):
+        incremental_vacuum(db_file)
+    size_after, _ = database_size(db_file)
+    report['bytes_reclaimed'] = max(size_before - size_after, 0)
+    report['seconds'] = round(time.time() - started, 2)
+    return report
+
+
+class RetentionJob(threading.Thread):
+    """按周期在后台执行保留期清理"""
+
+    def __init__(self, db_file, email_days=EMAIL_RETENTION_DAYS, log_days=None,
+                 interval=RUN_INTERVAL, first_delay=FIRST_RUN_DELAY):
+        super().__init__(name=f'retention-{os.path.basename(db_file)}')
+        self.daemon = True
+        self.db_file = db_file
+        self.email_days = email_days
+        self.log_days = log_days
+        self.interval = interval
+        self.first_delay = first_delay
+        self.last_report = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if self._stop_event.wait(self.first_delay):
+            return
+        while True:
+            self.run_once()
+            if self._stop_event.wait(self.interval):
+                return
+
+    def run_once(self):
+        try:
+            report = run_retention(self.db_file, self.email_days, self.log_days)
+            self.last_report = report
+            action = '归档' if report['archived'] else '删除'
+            logging.info(f"🗑️ 保留期清理完成 {self.db_file}: {action}邮件 {report['emails']} 条, "
+                         f"日志 {report['logs']} 条, 回收 {report['bytes_reclaimed'] / 1024:.1f} KB, "
+                         f"耗时 {report['seconds']} 秒")
+            return report
+        except Exception as e:
+            logging.error(f"❌ 保留期清理失败 {self.db_file}: {e}")
+            return None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_retention_job(db_file, email_days=EMAIL_RETENTION_DAYS, log_days=None, interval=RUN_INTERVAL):
+    """启动后台清理线程并返回它"""
+    job = RetentionJob(db_file, email_days, log_days, interval)
+    job.start()
+    logging.info(f"✅ 已启动保留期清理任务: {db_file}（邮件保留 {email_days} 天，"
+                 f"日志保留 {log_days or '不限'} 天，每 {interval // 3600} 小时执行一次）")
+    return job
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    convert = len(sys.argv) > 1 and sys.argv[1] == 'convert'
+    args = sys.argv[2:] if convert else sys.argv[1:]
+    for db_file in args or email_store.DEFAULT_DB_FILES:
+        if not os.path.exists(db_file):
+            print(f"跳过不存在的数据库: {db_file}")
+            continue
+        if convert:
+            convert_to_incremental(db_file)
+        else:
+            RetentionJob(db_file).run_once()
@@ -1,9 +1,244 @@
-import sqlite3
+import db_access
+import db_schema
+import keyword_index
+import keyset_pagination
 import os
+import sys
 import csv
+import copy
 import json
+import atexit
+import logging
+import functools
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+# 方向 -> (数据库文件, 附件统计表)
+ATTACHMENT_TABLES = {
+    'import': ('processed_emails_import.db', 'import_attachments'),
+    'export': ('processed_emails.db', 'export_attachments'),
+}
+
+# 附件统计记录攒够这么多条，或距上次写入超过这么多秒，就批量写入
+RECORDER_BATCH_SIZE = 20
+RECORDER_FLUSH_INTERVAL = 60
+# 写入持续失败时缓冲区最多保留的记录数，超出时丢弃最早的记录
+RECORDER_MAX_PENDING = 5000
+
+# 查询结果缓存的上限：条目数和估算占用的内存字节数
+QUERY_CACHE_ENTRIES = 128
+QUERY_CACHE_BYTES = 32 * 1024 * 1024
+
+def attachment_row(attachment_info):
+    """把附件信息字典转换为写入附件统计表的一行"""
+    return (
+        attachment_info.get('attachment_name', ''),
+        attachment_info.get('process_date', datetime.now().strftime('%Y-%m-%d')),
+        attachment_info.get('has_dangerous', 0),
+        attachment_info.get('matched_keywords', ''),
+        attachment_info.get('sender_email', ''),
+        attachment_info.get('subject', '')
+    )
+
+def insert_attachment_rows(conn, table_name, rows):
+    """在调用方的事务中写入附件统计记录（已存在的忽略）并建立关键词关联，返回新增条数"""
+    inserted = 0
+    for row in rows:
+        cursor = conn.execute(f'''
+        INSERT OR IGNORE INTO {table_name}
+        (attachment_name, process_date, has_dangerous, matched_keywords, sender_email, subject)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', row)
+        if cursor.rowcount > 0:
+            keyword_index.index_row(conn, table_name, cursor.lastrowid, row[3])
+            inserted += 1
+    return inserted
+
+def _estimate_size(value):
+    """粗略估算查询结果占用的内存字节数"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_estimate_size(item) for item in value)
+    return size
+
+def _freeze(value):
+    """把参数转换为可以作为字典键的值（列表等转为元组）"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(item) for item in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+class QueryCache:
+    """
+    统计查询结果的 LRU 缓存
+    每个条目记录计算时附件表的写入版本号（table_versions，由触发器在写入时递增，
+    处理程序在其他进程写入也能感知），版本号变化后条目失效；按条目数和估算内存大小淘汰
+    """
+    
+    def __init__(self, max_entries=QUERY_CACHE_ENTRIES, max_bytes=QUERY_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, versions):
+        """返回 (是否命中, 结果)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return False, None
+    
+    def put(self, key, versions, value):
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (versions, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+    
+    def clear(self, db_type=None):
+        """清空缓存；指定 db_type 时只清除依赖该库的条目"""
+        with self._lock:
+            for key in list(self._entries):
+                if db_type is None or key[1] in (db_type, None):
+                    self._remove(key)
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+# 进程内所有 StatisticsSystem 实例共用的查询缓存
+query_cache = QueryCache()
+
+def cached_query(per_db_type=False):
+    """
+    查询方法的缓存装饰器，以 (方法名, 参数) 为键；调用时传 use_cache=False 跳过缓存
+    per_db_type=True 表示方法的第一个参数是 db_type，只依赖该库的写入版本号
+    返回 None（查询失败）时不缓存。缓存中保存一份副本，每次返回新的副本，调用方可以修改；
+    命中时结果中的 query_time 改为本次查询的时间
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, use_cache=True, **kwargs):
+            if not use_cache:
+                return method(self, *args, **kwargs)
+            db_type = None
+            if per_db_type:
+                db_type = args[0] if args else kwargs.get('db_type')
+            versions = self.data_versions(db_type)
+            key = (method.__name__, db_type, self.import_db_file, self.export_db_file,
+                   _freeze(args), _freeze(kwargs))
+            hit, value = query_cache.get(key, versions)
+            if hit:
+                value = copy.deepcopy(value)
+                if isinstance(value, dict) and 'query_time' in value:
+                    value['query_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                return value
+            value = method(self, *args, **kwargs)
+            if value is not None:
+                query_cache.put(key, versions, copy.deepcopy(value))
+            return value
+        return wrapper
+    return decorator
+
+class AttachmentRecorder:
+    """
+    处理程序持有的附件统计写入器
+    记录先放入缓冲区，攒够 batch_size 条或每隔 flush_interval 秒在一个事务中批量写入，
+    进程退出时（atexit）写完剩余记录
+    """
+    
+    def __init__(self, db_type, db_file=None, batch_size=RECORDER_BATCH_SIZE, flush_interval=RECORDER_FLUSH_INTERVAL,
+                 max_pending=RECORDER_MAX_PENDING):
+        default_db_file, self.table_name = ATTACHMENT_TABLES[db_type]
+        self.db_file = db_file or default_db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'AttachmentRecorder-{db_type}')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def add(self, attachment_info):
+        """缓存一条附件统计记录，返回是否已接收"""
+        row = attachment_row(attachment_info)
+        if not row[0]:
+            logging.error("❌ 附件名称为空，无法添加统计记录")
+            return False
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        return True
+    
+    def flush(self):
+        """
+        把缓存的记录在一个事务中写入，返回新增条数；写入失败的记录留待下次重试，
+        缓冲区超过 max_pending 条时丢弃最早的记录
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                db_schema.migrate(self.db_file)
+                with db_access.transaction(self.db_file) as conn:
+                    inserted = insert_attachment_rows(conn, self.table_name, rows)
+            except Exception as e:
+                logging.error(f"❌ 批量写入附件统计记录失败: {e}")
+                with self._lock:
+                    self._pending = rows + self._pending
+                    self._trim_pending()
+                return 0
+            logging.info(f"✅ 已写入附件统计记录 {inserted} 条（本批 {len(rows)} 条，重复的已忽略）")
+            return inserted
+    
+    def _trim_pending(self):
+        """缓冲区超出上限时丢弃最早的记录（调用方持有 _lock）"""
+        dropped = len(self._pending) - self.max_pending
+        if dropped > 0:
+            del self._pending[:dropped]
+            logging.warning(f"⚠️ 附件统计记录写入失败积压超过 {self.max_pending} 条，已丢弃最早的 {dropped} 条")
+    
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def close(self):
+        """停止定时写入并写完剩余记录"""
+        self._stop_event.set()
+        return self.flush()
+
 class StatisticsSystem:
     def __init__(self):
         self.import_db_file = 'processed_emails_import.db'
@@ -11,57 +246,29 @@ class StatisticsSystem:
         
     def init_database(self):
         try:
-            # 初始化进口统计数据库
-            if os.path.exists(self.import_db_file):
-                conn = sqlite3.connect(self.import_db_file)
-                cursor = conn.cursor()
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS import_attachments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    attachment_name TEXT NOT NULL,
-                    process_date DATE NOT NULL,
-                    has_dangerous INTEGER DEFAULT 0,
-                    matched_keywords TEXT,
-                    sender_email TEXT,
-                    subject TEXT,
-                    created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(attachment_name, process_date)
-                )
-                ''')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_import_att_date ON import_attachments(process_date)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_import_att_dangerous ON import_attachments(has_dangerous)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_import_att_keywords ON import_attachments(matched_keywords)')
-                conn.commit()
-                conn.close()
-            
-            # 初始化出口统计数据库
-            if os.path.exists(self.export_db_file):
-                conn = sqlite3.connect(self.export_db_file)
-                cursor = conn.cursor()
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS export_attachments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    attachment_name TEXT NOT NULL,
-                    process_date DATE NOT NULL,
-                    has_dangerous INTEGER DEFAULT 0,
-                    matched_keywords TEXT,
-                    sender_email TEXT,
-                    subject TEXT,
-                    created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(attachment_name, process_date)
-                )
-                ''')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_att_date ON export_attachments(process_date)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_att_dangerous ON export_attachments(has_dangerous)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_att_keywords ON export_attachments(matched_keywords)')
-                conn.commit()
-                conn.close()
-            
+            # 附件统计表和关键词索引由表结构版本迁移创建
+            for db_file in (self.import_db_file, self.export_db_file):
+                if os.path.exists(db_file):
+                    db_schema.migrate(db_file)
             return True
         except Exception as e:
             print(f"初始化失败: {e}")
             return False
         
+    def data_versions(self, db_type=None):
+        """附件表的写入版本号；db_type 为空时返回进口、出口两个库的"""
+        versions = []
+        for direction in ([db_type] if db_type else ['import', 'export']):
+            db_file = self.import_db_file if direction == 'import' else self.export_db_file
+            if not os.path.exists(db_file):
+                versions.append(None)
+                continue
+            db_schema.migrate(db_file)
+            with db_access.connection(db_file) as conn:
+                versions.append(keyset_pagination.table_version(conn, f'{direction}_attachments'))
+        return tuple(versions)
+    
+    @cached_query(per_db_type=True)
     def get_date_range(self, db_type):
         try:
             if db_type == 'import':
@@ -74,7 +281,7 @@ class StatisticsSystem:
             if not os.path.exists(db_file):
                 return None
             
-            conn = sqlite3.connect(db_file)
+            conn = db_access.connect(db_file)
             cursor = conn.cursor()
             cursor.execute(f'''
             SELECT MIN(process_date), MAX(process_date), COUNT(DISTINCT process_date)
@@ -89,6 +296,7 @@ class StatisticsSystem:
         except:
             return None
     
+    @cached_query()
     def get_keywords_summary(self, start_date=None, end_date=None):
         """获取关键词统计摘要（进口和出口分开）"""
         try:
@@ -100,34 +308,19 @@ class StatisticsSystem:
                 'all_keywords': set()
             }
             
-            # 统计进口关键词
+            # 统计进口关键词（按关键词关联表计数，每个附件计一次）
             if os.path.exists(self.import_db_file):
-                conn = sqlite3.connect(self.import_db_file)
-                cursor = conn.cursor()
-                
                 if start_date and end_date:
-                    cursor.execute('''
-                    SELECT matched_keywords, COUNT(*) as count
-                    FROM import_attachments
-                    WHERE process_date >= ? AND process_date <= ?
-                    GROUP BY matched_keywords
-                    ORDER BY count DESC
-                    ''', (start_date, end_date))
+                    counts = keyword_index.keyword_counts(self.import_db_file, 'import_attachments',
+                                                          't.process_date >= ? AND t.process_date <= ?',
+                                                          (start_date, end_date))
                 else:
-                    cursor.execute('''
-                    SELECT matched_keywords, COUNT(*) as count
-                    FROM import_attachments
-                    GROUP BY matched_keywords
-                    ORDER BY count DESC
-                    ''')
+                    counts = keyword_index.keyword_counts(self.import_db_file, 'import_attachments')
+                results['import'] = counts
+                results['all_keywords'].update(counts)
                 
-                for keyword_str, count in cursor.fetchall():
-                    if keyword_str:
-                        # 关键词可能是逗号分隔的多个
-                        keywords = [k.strip() for k in keyword_str.split(',') if k.strip()]
-                        for keyword in keywords:
-                            results['import'][keyword] = results['import'].get(keyword, 0) + 1
-                            results['all_keywords'].add(keyword)
+                conn = db_access.connect(self.import_db_file)
+                cursor = conn.cursor()
                 
                 # 获取进口总数
                 if start_date and end_date:
@@ -139,34 +332,19 @@ class StatisticsSystem:
                 
                 conn.close()
             
-            # 统计出口关键词
+            # 统计出口关键词（按关键词关联表计数，每个附件计一次）
             if os.path.exists(self.export_db_file):
-                conn = sqlite3.connect(self.export_db_file)
-                cursor = conn.cursor()
-                
                 if start_date and end_date:
-                    cursor.execute('''
-                    SELECT matched_keywords, COUNT(*) as count
-                    FROM export_attachments
-                    WHERE process_date >= ? AND process_date <= ?
-                    GROUP BY matched_keywords
-                    ORDER BY count DESC
-                    ''', (start_date, end_date))
+                    counts = keyword_index.keyword_counts(self.export_db_file, 'export_attachments',
+                                                          't.process_date >= ? AND t.process_date <= ?',
+                                                          (start_date, end_date))
                 else:
-                    cursor.execute('''
-                    SELECT matched_keywords, COUNT(*) as count
-                    FROM export_attachments
-                    GROUP BY matched_keywords
-                    ORDER BY count DESC
-                    ''')
+                    counts = keyword_index.keyword_counts(self.export_db_file, 'export_attachments')
+                results['export'] = counts
+                results['all_keywords'].update(counts)
                 
-                for keyword_str, count in cursor.fetchall():
-                    if keyword_str:
-                        # 关键词可能是逗号分隔的多个
-                        keywords = [k.strip() for k in keyword_str.split(',') if k.strip()]
-                        for keyword in keywords:
-                            results['export'][keyword] = results['export'].get(keyword, 0) + 1
-                            results['all_keywords'].add(keyword)
+                conn = db_access.connect(self.export_db_file)
+                cursor = conn.cursor()
                 
                 # 获取出口总数
                 if start_date and end_date:
@@ -186,6 +364,7 @@ class StatisticsSystem:
             print(f"获取关键词摘要失败: {e}")
             return None
             
+    @cached_query(per_db_type=True)
     def query_statistics_with_keywords(self, db_type, start_date, end_date, selected_keywords=None):
         """根据关键词筛选查询统计"""
         try:
@@ -199,7 +378,7 @@ class StatisticsSystem:
             if not os.path.exists(db_file):
                 return None
             
-            conn = sqlite3.connect(db_file)
+            conn = db_access.connect(db_file)
             cursor = conn.cursor()
             
             # 基础查询
@@ -214,14 +393,12 @@ class StatisticsSystem:
             
             query_params = [start_date, end_date]
             
-            # 如果有选中的关键词，添加关键词筛选
+            # 如果有选中的关键词，按关键词关联表精确筛选
+            keyword_sql, keyword_params = '1=1', []
             if selected_keywords:
-                keyword_conditions = []
-                for keyword in selected_keywords:
-                    keyword_conditions.append(f"matched_keywords LIKE ?")
-                    query_params.append(f'%{keyword}%')
-                
-                query_base += f" AND ({' OR '.join(keyword_conditions)})"
+                keyword_sql, keyword_params = keyword_index.filter_clause(table_name, selected_keywords)
+                query_base += f" AND {keyword_sql}"
+                query_params.extend(keyword_params)
             
             query_base += " ORDER BY process_date DESC, created_time DESC"
             
@@ -239,12 +416,8 @@ class StatisticsSystem:
             count_params = [start_date, end_date]
             
             if selected_keywords:
-                keyword_conditions = []
-                for keyword in selected_keywords:
-                    keyword_conditions.append(f"matched_keywords LIKE ?")
-                    count_params.append(f'%{keyword}%')
-                
-                count_query += f" AND ({' OR '.join(keyword_conditions)})"
+                count_query += f" AND {keyword_sql}"
+                count_params.extend(keyword_params)
             
             cursor.execute(count_query, count_params)
             total, dangerous, non_dangerous = cursor.fetchone()
@@ -267,7 +440,7 @@ class StatisticsSystem:
             
     def query_statistics(self, db_type, start_date, end_date, use_cache=False):
         """原始查询方法（保持兼容性）"""
-        return self.query_statistics_with_keywords(db_type, start_date, end_date, None)
+        return self.query_statistics_with_keywords(db_type, start_date, end_date, None, use_cache=use_cache)
             
     def delete_attachments(self, db_type, attachment_ids):
         try:
@@ -281,7 +454,7 @@ class StatisticsSystem:
             if not os.path.exists(db_file) or not attachment_ids:
                 return 0
             
-            conn = sqlite3.connect(db_file)
+            conn = db_access.connect(db_file)
             cursor = conn.cursor()
             placeholders = ','.join(['?'] * len(attachment_ids))
             
@@ -329,10 +502,12 @@ class StatisticsSystem:
             return None
             
     def clear_cache(self, db_type=None):
+        """清空查询缓存（写入后缓存会按版本号自动失效，一般不需要手动调用）"""
+        query_cache.clear(db_type)
         return True
     
     def add_attachment_record(self, db_type, attachment_info):
-        """添加附件统计记录"""
+        """添加附件统计记录（立即写入；处理程序使用 AttachmentRecorder 批量写入）"""
         try:
             if db_type == 'import':
                 db_file = self.import_db_file
@@ -341,64 +516,20 @@ class StatisticsSystem:
                 db_file = self.export_db_file
                 table_name = 'export_attachments'
             
-            # 确保数据库文件存在，如果不存在则创建
-            if not os.path.exists(db_file):
-                print(f"⚠️ 数据库文件 {db_file} 不存在，正在创建...")
-                self.init_database()
-                if not os.path.exists(db_file):
-                    print(f"❌ 无法创建数据库文件: {db_file}")
-                    return False
-            
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            
-            # 确保表存在
-            cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                attachment_name TEXT NOT NULL,
-                process_date DATE NOT NULL,
-                has_dangerous INTEGER DEFAULT 0,
-                matched_keywords TEXT,
-                sender_email TEXT,
-                subject TEXT,
-                created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(attachment_name, process_date)
-            )
-            ''')
-            
-            # 准备数据
-            attachment_name = attachment_info.get('attachment_name', '')
-            process_date = attachment_info.get('process_date', datetime.now().strftime('%Y-%m-%d'))
-            has_dangerous = attachment_info.get('has_dangerous', 0)
-            matched_keywords = attachment_info.get('matched_keywords', '')
-            sender_email = attachment_info.get('sender_email', '')
-            subject = attachment_info.get('subject', '')
-            
+            row = attachment_row(attachment_info)
+            attachment_name = row[0]
             if not attachment_name:
                 print("❌ 附件名称为空，无法添加统计记录")
-                conn.close()
                 return False
             
-            # 插入记录，如果已经存在则忽略
-            cursor.execute(f'''
-            INSERT OR IGNORE INTO {table_name} 
-            (attachment_name, process_date, has_dangerous, matched_keywords, sender_email, subject)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                attachment_name,
-                process_date,
-                has_dangerous,
-                matched_keywords,
-                sender_email,
-                subject
-            ))
+            # 表结构按版本迁移，数据库文件不存在时一并创建
+            db_schema.migrate(db_file)
             
-            conn.commit()
-            rowcount = cursor.rowcount
-            conn.close()
+            # 插入记录，如果已经存在则忽略；同一事务中写入关键词关联
+            with db_access.transaction(db_file) as conn:
+                inserted = insert_attachment_rows(conn, table_name, [row])
             
-            if rowcount > 0:
+            if inserted > 0:
                 print(f"✅ 成功添加统计记录: {attachment_name}")
                 return True
             else:
@@ -411,6 +542,7 @@ class StatisticsSystem:
             traceback.print_exc()
             return False
     
+    @cached_query()
     def get_all_keywords(self):
         """获取所有出现过的关键词"""
         try:
@@ -418,25 +550,11 @@ class StatisticsSystem:
             
             # 从进口数据库获取
             if os.path.exists(self.import_db_file):
-                conn = sqlite3.connect(self.import_db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT DISTINCT matched_keywords FROM import_attachments WHERE matched_keywords IS NOT NULL AND matched_keywords != ""')
-                for row in cursor.fetchall():
-                    if row[0]:
-                        keywords = [k.strip() for k in row[0].split(',') if k.strip()]
-                        all_keywords.update(keywords)
-                conn.close()
+                all_keywords.update(keyword_index.all_keywords(self.import_db_file, 'import_attachments'))
             
             # 从出口数据库获取
             if os.path.exists(self.export_db_file):
-                conn = sqlite3.connect(self.export_db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT DISTINCT matched_keywords FROM export_attachments WHERE matched_keywords IS NOT NULL AND matched_keywords != ""')
-                for row in cursor.fetchall():
-                    if row[0]:
-                        keywords = [k.strip() for k in row[0].split(',') if k.strip()]
-                        all_keywords.update(keywords)
-                conn.close()
+                all_keywords.update(keyword_index.all_keywords(self.export_db_file, 'export_attachments'))
             
             return sorted(list(all_keywords))
         except Exception as e:
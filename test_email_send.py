@@ -9,12 +9,11 @@ import datetime  # 添加这行
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config_manager import ConfigManager
+from mail_connection import get_connection_factory
 
 def test_smtp_connection():
     """测试SMTP连接"""
     try:
-        import smtplib
-        import ssl
         from email.mime.text import MIMEText
         from email.mime.multipart import MIMEMultipart
         
@@ -28,11 +27,9 @@ def test_smtp_connection():
         # 测试进口邮箱SMTP
         print(f"\n1. 测试进口邮箱SMTP连接 ({email_config['smtp_server']}:{email_config['smtp_port']})")
         try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(
+            with get_connection_factory().smtp(
                 email_config['smtp_server'], 
-                email_config['smtp_port'],
-                context=context
+                email_config['smtp_port']
             ) as server:
                 server.login(email_config['import_email'], email_config['import_password'])
                 print("✅ 进口邮箱SMTP连接成功")
@@ -55,11 +52,9 @@ def test_smtp_connection():
         # 测试出口邮箱SMTP
         print(f"\n2. 测试出口邮箱SMTP连接 ({email_config['smtp_server']}:{email_config['smtp_port']})")
         try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(
+            with get_connection_factory().smtp(
                 email_config['smtp_server'], 
-                email_config['smtp_port'],
-                context=context
+                email_config['smtp_port']
             ) as server:
                 server.login(email_config['export_email'], email_config['export_password'])
                 print("✅ 出口邮箱SMTP连接成功")
@@ -85,8 +80,6 @@ def test_smtp_connection():
 def test_pop3_connection():
     """测试POP3连接"""
     try:
-        import poplib
-        
         cm = ConfigManager()
         email_config = cm.get_email_config()
         
@@ -97,7 +90,7 @@ def test_pop3_connection():
         # 测试进口邮箱POP3
         print(f"\n1. 测试进口邮箱POP3连接 ({email_config['pop3_server']}:{email_config['pop3_port']})")
         try:
-            server = poplib.POP3_SSL(email_config['pop3_server'], email_config['pop3_port'])
+            server = get_connection_factory().pop3(email_config['pop3_server'], email_config['pop3_port'])
             server.user(email_config['import_email'])
             server.pass_(email_config['import_password'])
             
@@ -136,6 +129,11 @@ def main():
     test_smtp_connection()
     test_pop3_connection()
     
+    print("\n2. TLS握手耗时:")
+    for protocol, stats in get_connection_factory().get_handshake_stats().items():
+        print(f"  {protocol.upper()}: 连接 {stats['connections']} 次，会话复用 {stats['resumed']} 次，"
+              f"平均TCP连接 {stats['avg_tcp_connect_ms']}ms，平均TLS握手 {stats['avg_handshake_ms']}ms")
+    
     print("\n" + "="*60)
     print("测试完成")
     print("="*60)
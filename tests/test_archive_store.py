@@ -0,0 +1,66 @@
+"""按月归档：移出主库、归档库汇总与封存"""
+
+import os
+import stat
+
+import pytest
+
+import archive_store
+import db_access
+import db_schema
+import email_store
+
+
+def record(uid, processed_date, keywords='Calcium Nitrate', containers=1):
+    return {'email_uid': uid, 'sender': 'shipper@example.com', 'subject': f'manifest {uid}',
+            'matched_keywords': keywords, 'container_count': containers, 'processed_date': processed_date,
+            'english_goods_descriptions': 'CALCIUM NITRATE TETRAHYDRATE'}
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / 'processed_emails.db')
+    db_schema.migrate(path)
+    email_store.save_keyword_emails(path, [
+        record('jan-1', '2024-01-10 10:00:00'),
+        record('jan-2', '2024-01-20 11:00:00', 'Magnesium Nitrate', 2),
+        record('feb-1', '2024-02-03 12:00:00'),
+        record('mar-1', '2024-03-15 13:00:00'),
+    ])
+    return path
+
+
+def test_archive_moves_rows_and_rollups(db_file):
+    assert archive_store.archive_before(db_file, '2024-03-01') == 3
+    assert db_access.query_value(db_file, 'SELECT COUNT(*) FROM keyword_emails') == 1
+    assert email_store.daily_counts(db_file) == {'2024-03-15': 1}
+    # 归档库没有按小时汇总，移出的记录从主库的按小时汇总中扣除
+    assert db_access.query_all(db_file, f'SELECT hour FROM {email_store.HOURLY_TABLE}') == [('2024-03-15 13',)]
+
+    assert archive_store.daily_counts(db_file) == {'2024-01-10': 1, '2024-01-20': 1, '2024-02-03': 1}
+    assert archive_store.daily_counts(db_file, keyword='Magnesium Nitrate') == {'2024-01-20': 1}
+    assert archive_store.keyword_counts(db_file, '2024-01-01', '2024-01-31') == (
+        {'Calcium Nitrate': 1, 'Magnesium Nitrate': 1}, 2)
+
+    # 重复归档不会产生重复记录
+    assert archive_store.archive_before(db_file, '2024-03-01') == 0
+
+
+def test_expired_months_are_sealed(db_file):
+    archive_store.archive_before(db_file, '2024-03-01')
+    assert [month for month, _ in archive_store.archive_files(db_file)] == ['2024-01', '2024-02']
+    assert [month for month, _ in archive_store.archive_files(db_file, '2024-02-01')] == ['2024-02']
+    for _, path in archive_store.archive_files(db_file):
+        assert archive_store.is_sealed(path)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o444
+
+
+def test_compressed_columns_round_trip(db_file):
+    archive_store.archive_before(db_file, '2024-03-01')
+    conn = archive_store.open_archive(archive_store.archive_path(db_file, '2024-02'))
+    try:
+        value = conn.execute('SELECT english_goods_descriptions FROM keyword_emails').fetchone()[0]
+    finally:
+        conn.close()
+    assert isinstance(value, bytes)
+    assert archive_store._decompress(value) == 'CALCIUM NITRATE TETRAHYDRATE'
@@ -0,0 +1,75 @@
+"""压缩附件的解压限制（防止压缩炸弹）"""
+
+import gzip
+import io
+import zipfile
+from email.message import EmailMessage
+
+import pytest
+
+import attachment_spool
+
+
+def attachment(filename, data):
+    msg = EmailMessage()
+    msg.add_attachment(data, maintype='application', subtype='octet-stream', filename=filename)
+    return next(msg.iter_attachments())
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def texts(filename, data):
+    result = []
+    for name, text in attachment_spool.iter_manifest_texts(attachment(filename, data), filename):
+        with text:
+            result.append((name, text.read_text()))
+    return result
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(attachment_spool, 'MAX_ARCHIVE_MEMBERS', 3)
+    monkeypatch.setattr(attachment_spool, 'MAX_MEMBER_SIZE', 1000)
+    monkeypatch.setattr(attachment_spool, 'MAX_ARCHIVE_TOTAL_SIZE', 1500)
+
+
+def test_zip_extracts_only_txt_members(small_limits):
+    data = make_zip({'a.txt': b'manifest a', 'b.TXT': b'manifest b', 'c.exe': b'MZ'})
+    assert texts('m.zip', data) == [('a.txt', 'manifest a'), ('b.TXT', 'manifest b')]
+
+
+def test_zip_with_too_many_members_is_skipped(small_limits):
+    data = make_zip({f'{i}.txt': b'x' for i in range(4)})
+    assert texts('m.zip', data) == []
+
+
+def test_zip_member_over_size_limit_is_skipped(small_limits):
+    data = make_zip({'big.txt': b'0' * 5000, 'ok.txt': b'fine'})
+    assert texts('m.zip', data) == [('ok.txt', 'fine')]
+
+
+def test_zip_total_size_limit_stops_extraction(small_limits):
+    data = make_zip({'1.txt': b'1' * 900, '2.txt': b'2' * 900})
+    assert [name for name, _ in texts('m.zip', data)] == ['1.txt']
+
+
+def test_gzip_bomb_is_skipped(small_limits):
+    # 压缩后很小、解压后远超上限；gzip 头里没有可信的大小，只能边解压边数
+    assert texts('m.txt.gz', gzip.compress(b'0' * 100000)) == []
+
+
+def test_gzip_requires_txt_name(small_limits):
+    data = gzip.compress(b'manifest')
+    assert texts('m.txt.gz', data) == [('m.txt', 'manifest')]
+    assert texts('m.csv.gz', data) == []
+
+
+def test_corrupt_archives_are_ignored(small_limits):
+    assert texts('m.zip', b'not a zip') == []
+    assert texts('m.txt.gz', b'not gzip') == []
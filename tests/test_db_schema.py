@@ -0,0 +1,55 @@
+"""版本迁移"""
+
+import db_access
+import db_schema
+import email_store
+
+
+def test_migrate_fresh_database(tmp_path):
+    db_file = str(tmp_path / 'processed_emails.db')
+    db_schema.migrate(db_file)
+    assert db_schema.schema_version(db_file) == db_schema.SCHEMA_VERSION
+    # 新库在启用 WAL 之前设置了增量回收
+    assert db_access.query_value(db_file, 'PRAGMA auto_vacuum') == 2
+
+    # 已是最新版本时再次迁移不做任何改动
+    tables = db_access.query_all(db_file, "SELECT name FROM sqlite_master ORDER BY name")
+    db_schema.migrate(db_file)
+    assert db_access.query_all(db_file, "SELECT name FROM sqlite_master ORDER BY name") == tables
+
+
+def test_migrations_are_ordered():
+    versions = [version for version, _, _ in db_schema.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert db_schema.SCHEMA_VERSION == versions[-1]
+
+
+def test_migrate_legacy_table(tmp_path):
+    # 早期版本没有货名和同步来源列，迁移补齐缺失列并回填规范化日期
+    db_file = str(tmp_path / 'legacy.db')
+    with db_access.transaction(db_file) as conn:
+        conn.execute('''
+            CREATE TABLE keyword_emails (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_uid TEXT UNIQUE NOT NULL,
+                sender TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                received_date TEXT,
+                processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                matched_keywords TEXT NOT NULL,
+                excel_sent INTEGER DEFAULT 1,
+                txt_attachment TEXT,
+                container_count INTEGER DEFAULT 0,
+                attachment_names TEXT
+            )
+        ''')
+        conn.execute("INSERT INTO keyword_emails (email_uid, sender, subject, received_date, processed_date, "
+                     "matched_keywords) VALUES ('u1', 's', 't', 'Mon, 1 Jan 2024 08:00:00 +0000', "
+                     "'2024-01-01 08:00:05', 'K')")
+    db_schema.migrate(db_file)
+    assert db_schema.schema_version(db_file) == db_schema.SCHEMA_VERSION
+    columns = [row[1] for row in db_access.query_all(db_file, 'PRAGMA table_info(keyword_emails)')]
+    assert {'sync_source', 'english_goods_descriptions', 'processed_day', 'received_ts'} <= set(columns)
+    assert email_store.daily_counts(db_file) == {'2024-01-01': 1}
+    day, ts = db_access.query_one(db_file, 'SELECT processed_day, received_ts FROM keyword_emails')
+    assert day == '2024-01-01' and ts == 1704096000
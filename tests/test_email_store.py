@@ -0,0 +1,95 @@
+"""写入、删除时的每日汇总表和按小时汇总表维护"""
+
+import pytest
+
+import db_access
+import db_schema
+import email_store
+
+
+def record(uid, processed_date, keywords='Calcium Nitrate', containers=1):
+    return {'email_uid': uid, 'sender': 'shipper@example.com', 'subject': f'manifest {uid}',
+            'matched_keywords': keywords, 'container_count': containers, 'processed_date': processed_date}
+
+
+def daily_rollup(db_file):
+    return db_access.query_all(db_file, f'SELECT * FROM {email_store.ROLLUP_TABLE} ORDER BY 1, 2, 3')
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / 'processed_emails.db')
+    db_schema.migrate(path)
+    email_store.save_keyword_email(path, record('a', '2024-01-05 08:10:00', containers=2))
+    email_store.save_keyword_emails(path, [
+        record('b', '2024-01-05 08:40:00', 'Calcium Nitrate,Magnesium Nitrate', 3),
+        record('c', '2024-01-06 23:00:00', 'Magnesium Nitrate'),
+    ])
+    # 替换已有记录时先扣减旧记录的汇总
+    email_store.save_keyword_email(path, record('a', '2024-01-05 09:00:00', containers=4))
+    return path
+
+
+def test_rollup_follows_writes(db_file):
+    assert email_store.daily_counts(db_file) == {'2024-01-05': 2, '2024-01-06': 1}
+    assert email_store.daily_counts(db_file, '2024-01-06') == {'2024-01-06': 1}
+    counts, total = email_store.keyword_counts(db_file)
+    assert counts == {'Calcium Nitrate': 2, 'Magnesium Nitrate': 2} and total == 3
+    assert ('2024-01-05', email_store.TOTAL_KEYWORD, '', 2, 7) in daily_rollup(db_file)
+
+
+def test_existing_uid_is_kept_without_replace(db_file):
+    assert not email_store.save_keyword_email(db_file, record('a', '2024-02-01 00:00:00'), replace=False)
+    assert email_store.save_keyword_emails(db_file, [record('a', '2024-02-01 00:00:00')]) == 0
+    assert email_store.daily_counts(db_file) == {'2024-01-05': 2, '2024-01-06': 1}
+
+
+def test_delete_matches_rebuild(db_file):
+    with db_access.transaction(db_file) as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM keyword_emails WHERE email_uid = 'b'")]
+        assert email_store.delete_rows(conn, ids) == 1
+    before = daily_rollup(db_file)
+    email_store.rebuild_rollup(db_file)
+    assert daily_rollup(db_file) == before
+    assert email_store.keyword_counts(db_file) == ({'Calcium Nitrate': 1, 'Magnesium Nitrate': 1}, 2)
+
+
+def test_purge_before(db_file):
+    assert email_store.purge_before(db_file, '2024-01-06', chunk_size=1) == 2
+    assert email_store.daily_counts(db_file) == {'2024-01-06': 1}
+
+
+def hourly_rollup(db_file):
+    return db_access.query_all(db_file, f'SELECT * FROM {email_store.HOURLY_TABLE} ORDER BY 1')
+
+
+def test_hourly_rollup_follows_writes_and_deletes(db_file):
+    assert hourly_rollup(db_file) == [('2024-01-05 08', 1, 3), ('2024-01-05 09', 1, 4), ('2024-01-06 23', 1, 1)]
+    with db_access.transaction(db_file) as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM keyword_emails WHERE email_uid = 'b'")]
+        email_store.delete_rows(conn, ids)
+    before = hourly_rollup(db_file)
+    assert ('2024-01-05 08', 1, 3) not in before
+    email_store.rebuild_hourly(db_file)
+    assert hourly_rollup(db_file) == before
+
+
+def test_merge_unions_keywords_and_containers(db_file):
+    existing = dict(record('c', '2024-01-06 23:00:00', 'Magnesium Nitrate'),
+                    english_goods_descriptions='MAGNESIUM NITRATE')
+    email_store.save_keyword_email(db_file, existing, containers=[
+        {'container_no': 'MSKU1234565', 'english_goods_description': 'MAGNESIUM NITRATE'}])
+    merged = record('c', '2024-03-01 00:00:00', 'Calcium Nitrate', 2)
+    assert email_store.merge_keyword_email(db_file, merged, containers=[
+        {'container_no': 'msku 1234565', 'english_goods_description': 'MAGNESIUM NITRATE'},
+        {'container_no': 'TGHU7654321', 'english_goods_description': 'CALCIUM NITRATE'}])
+    row = db_access.query_one(db_file, 'SELECT processed_date, matched_keywords, container_count, '
+                              "english_goods_descriptions FROM keyword_emails WHERE email_uid = 'c'")
+    assert row == ('2024-01-06 23:00:00', 'Magnesium Nitrate,Calcium Nitrate', 2,
+                   'MAGNESIUM NITRATE,CALCIUM NITRATE')
+    assert db_access.query_value(db_file, "SELECT COUNT(*) FROM containers") == 2
+    assert email_store.daily_counts(db_file) == {'2024-01-05': 2, '2024-01-06': 1}
+    assert email_store.keyword_counts(db_file) == ({'Calcium Nitrate': 3, 'Magnesium Nitrate': 2}, 3)
+    before = daily_rollup(db_file)
+    email_store.rebuild_rollup(db_file)
+    assert daily_rollup(db_file) == before
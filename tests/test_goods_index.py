@@ -0,0 +1,68 @@
+"""编号列表的变长整数编码与货名查询"""
+
+import pytest
+
+import db_schema
+import goods_index
+
+MANIFEST = '\n'.join([
+    '12:BL001',
+    '47:CALCIUM NITRATE TETRAHYDRATE',
+    '51:TGHU1234567',
+    '12:BL002',
+    '47:NITRATE OF CALCIUM',
+    '51:MSCU7654321',
+    '12:BL003',
+    '47:AMMONIUM NITRATE',
+    '51:CAIU1111111',
+    '51:CAIU2222222',
+])
+
+
+@pytest.mark.parametrize('record_ids', [[], [1], [1, 2, 3], [5, 127, 128, 300, 16384, 2 ** 21 + 7]])
+def test_postings_round_trip(record_ids):
+    assert goods_index.decode_postings(goods_index.encode_postings(record_ids)) == record_ids
+
+
+def test_postings_store_deltas():
+    # 相邻编号的差值为 1，每个编号占 1 字节
+    assert goods_index.encode_postings([1000, 1001, 1002], previous=999) == b'\x01\x01\x01'
+
+
+def test_appended_segment_decodes_with_previous():
+    head = goods_index.encode_postings([3, 10])
+    tail = goods_index.encode_postings([200, 201], previous=10)
+    assert goods_index.decode_postings(head + tail) == [3, 10, 200, 201]
+
+
+@pytest.fixture
+def indexed_db(tmp_path):
+    db_file = str(tmp_path / 'goods.db')
+    db_schema.migrate(db_file)
+    assert goods_index.index_manifest(db_file, 'hash-1', MANIFEST, 'import', seen_day='2024-03-01') == 4
+    return db_file
+
+
+def test_index_manifest_once(indexed_db):
+    assert goods_index.index_manifest(indexed_db, 'hash-1', MANIFEST, 'import') == 0
+
+
+def containers(result):
+    return sorted(c['container_no'] for m in result['manifests'] for c in m['containers'])
+
+
+def test_word_lookup_requires_all_words(indexed_db):
+    result = goods_index.lookup(indexed_db, 'calcium nitrate')
+    assert containers(result) == ['MSCU7654321', 'TGHU1234567']
+
+
+def test_phrase_lookup_requires_adjacent_words(indexed_db):
+    result = goods_index.lookup(indexed_db, 'calcium nitrate', phrase=True)
+    assert containers(result) == ['TGHU1234567']
+    assert result['manifests'][0]['seen_day'] == '2024-03-01'
+
+
+def test_lookup_limit_and_day_range(indexed_db):
+    result = goods_index.lookup(indexed_db, 'nitrate', limit=2)
+    assert result['container_count'] == 2 and result['truncated']
+    assert goods_index.lookup(indexed_db, 'nitrate', start_day='2024-04-01')['container_count'] == 0
@@ -0,0 +1,66 @@
+"""游标编码/解析与按游标翻页"""
+
+import db_access
+import db_schema
+import email_store
+import keyset_pagination
+
+
+def test_cursor_round_trip():
+    values = ['2024-01-02', '2024-01-02 10:00:00', 42]
+    token = keyset_pagination.encode_cursor(values)
+    assert '=' not in token
+    assert keyset_pagination.decode_cursor(token, 3) == values
+
+
+def test_cursor_keeps_unicode_and_null():
+    values = [None, '硝酸钙', 7]
+    assert keyset_pagination.decode_cursor(keyset_pagination.encode_cursor(values), 3) == values
+
+
+def test_bad_cursor_is_rejected():
+    assert keyset_pagination.decode_cursor('not a cursor!', 3) is None
+    assert keyset_pagination.decode_cursor(keyset_pagination.encode_cursor([1, 2]), 3) is None
+    # 不是列表的 JSON
+    assert keyset_pagination.decode_cursor('eyJhIjoxfQ', 1) is None
+
+
+def test_seek_pages_match_offset_pages(tmp_path):
+    db_file = str(tmp_path / 'emails.db')
+    db_schema.migrate(db_file)
+    email_store.save_keyword_emails(db_file, [
+        {'email_uid': f'uid-{i}', 'sender': 's', 'subject': f'subject {i}', 'matched_keywords': 'K',
+         'processed_date': f'2024-01-{1 + i % 5:02d} {i % 24:02d}:00:00'}
+        for i in range(23)
+    ])
+    order = 'ORDER BY processed_day DESC, processed_date DESC, id DESC'
+    expected = [row[0] for row in db_access.query_all(db_file, f'SELECT id FROM keyword_emails {order}')]
+
+    seen = []
+    last = None
+    while True:
+        seek, params = 'processed_day IS NOT NULL', []
+        if last is not None:
+            seek, params = '(processed_day, processed_date, id) < (?, ?, ?)', last
+        rows = db_access.query_all(db_file, f'''
+            SELECT id, processed_day, processed_date FROM keyword_emails WHERE {seek} {order} LIMIT 5
+        ''', params)
+        if not rows:
+            break
+        seen.extend(row[0] for row in rows)
+        end = rows[-1]
+        last = keyset_pagination.decode_cursor(keyset_pagination.encode_cursor([end[1], end[2], end[0]]), 3)
+    assert seen == expected
+
+
+def test_count_cache_invalidated_by_writes(tmp_path):
+    db_file = str(tmp_path / 'emails.db')
+    db_schema.migrate(db_file)
+    cache = keyset_pagination.CountCache()
+    sql = 'SELECT COUNT(*) FROM keyword_emails'
+    record = {'email_uid': 'a', 'sender': 's', 'subject': 't', 'matched_keywords': 'K'}
+    with db_access.connection(db_file) as conn:
+        assert cache.count(conn, db_file, 'keyword_emails', sql) == 0
+    email_store.save_keyword_email(db_file, record)
+    with db_access.connection(db_file) as conn:
+        assert cache.count(conn, db_file, 'keyword_emails', sql) == 1
@@ -0,0 +1,57 @@
+"""关键词标准化与命中位置"""
+
+import keyword_matcher
+from keyword_matcher import KeywordMatcher, MODE_EXACT, MODE_NORMALIZED
+
+
+def test_exact_mode_ignores_case_and_spaces_only():
+    assert keyword_matcher.normalize_keyword('Calcium Nitrate', MODE_EXACT) == 'CALCIUMNITRATE'
+    assert keyword_matcher.normalize('a-b c', MODE_EXACT)[0] == 'A-BC'
+
+
+def test_normalized_mode_unifies_ocr_and_abbreviations():
+    assert keyword_matcher.normalize_keyword('Calcium Nitrate') == 'CALCIUMNITRATE'
+    assert keyword_matcher.normalize('CALC. NITR.')[0] == 'CALCIUMNITRATE'
+    assert keyword_matcher.normalize('CALCIUM-NITRATE\nTETRAHYDRATE')[0] == 'CALCIUMNITRATETETRAHYDRATE'
+    assert keyword_matcher.normalize('AMM0NIUM')[0] == 'AMMONIUM'
+    assert keyword_matcher.normalize_term('s0d') == 'SOD'
+    assert keyword_matcher.normalize_term('sod') == 'SODIUM'
+
+
+def test_positions_map_back_to_original_text():
+    text = 'xx Calcium  Nitrate yy'
+    normalized, starts, ends = keyword_matcher.normalize(text)
+    assert normalized == 'XXCALCIUMNITRATEYY'
+    assert len(starts) == len(ends) == len(normalized)
+    position = normalized.find('CALCIUMNITRATE')
+    assert text[starts[position]:ends[position + len('CALCIUMNITRATE') - 1]] == 'Calcium  Nitrate'
+
+
+def test_find_returns_original_spans():
+    text = 'GOODS: CALCIUM-NITRATE, and later calcium  nitrate'
+    hits = KeywordMatcher(['Calcium Nitrate']).find(text)
+    assert [(hit.start, hit.end) for hit in hits] == [(7, 22), (34, 50)]
+    assert [hit.text for hit in hits] == ['CALCIUM-NITRATE', 'calcium  nitrate']
+
+
+def test_find_abbreviation_spans_whole_word():
+    text = 'AMM. NITRATE'
+    hit, = KeywordMatcher(['Ammonium Nitrate']).find(text)
+    assert (hit.start, hit.end, hit.text) == (0, 12, text)
+
+
+def test_per_keyword_modes():
+    matcher = KeywordMatcher(['Calcium Nitrate', 'Sodium'], modes={'Calcium Nitrate': MODE_EXACT})
+    assert matcher.match('CALCIUM-NITRATE, SOD.') == ['Sodium']
+    assert matcher.match('calcium nitrate') == ['Calcium Nitrate']
+
+
+def test_unknown_mode_falls_back_to_default():
+    matcher = KeywordMatcher(['Nitrate'], modes={'Nitrate': 'fuzzy'}, default_mode='bogus')
+    assert matcher.match('N1TRATE') == ['Nitrate']
+    assert keyword_matcher.DEFAULT_MODE == MODE_NORMALIZED
+
+
+def test_empty_input():
+    assert KeywordMatcher(['', '  ']).keywords == []
+    assert KeywordMatcher(['X']).find('') == []
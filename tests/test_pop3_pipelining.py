@@ -0,0 +1,55 @@
+"""POP3 流水线与逐条模式（本机模拟服务器）"""
+
+import poplib
+
+import pytest
+
+from pop3_pipelining import POP3Pipeline, _start_standin
+
+MESSAGE_COUNT = 12
+
+
+@pytest.fixture(params=[True, False], ids=['pipelining', 'one-at-a-time'])
+def session(request):
+    listener, stats = _start_standin(MESSAGE_COUNT, pipelining=request.param)
+    server = poplib.POP3('127.0.0.1', listener.getsockname()[1], timeout=10)
+    server.user('test')
+    server.pass_('test')
+    yield POP3Pipeline(server, window=5), stats, request.param
+    server.quit()
+    listener.close()
+
+
+def test_capability_detection(session):
+    pipeline, _, pipelining = session
+    assert pipeline.supports_pipelining is pipelining
+
+
+def test_responses_in_request_order(session):
+    pipeline, _, _ = session
+    nums = list(range(MESSAGE_COUNT + 2, 0, -1))
+    results = list(pipeline.retr_many(nums))
+    assert [n for n, _ in results] == nums
+    # 不存在的邮件只让自己的结果变成异常，同批其他命令不受影响
+    assert [n for n, r in results if isinstance(r, poplib.error_proto)] == [MESSAGE_COUNT + 2, MESSAGE_COUNT + 1]
+    response, lines, _ = results[-1][1]
+    assert response.startswith(b'+OK') and b'Subject: test' in lines
+
+
+def test_top_and_dele(session):
+    pipeline, _, _ = session
+    headers = dict(pipeline.top_many([1, 2], 0))
+    assert all(b'Subject: test' in headers[n][1] for n in (1, 2))
+    assert all(r.startswith(b'+OK') for _, r in pipeline.dele_many([1, 2]))
+
+
+def test_pipelining_batches_round_trips(session):
+    pipeline, stats, pipelining = session
+    before = stats['packets']
+    list(pipeline.top_many(range(1, MESSAGE_COUNT + 1), 0))
+    packets = stats['packets'] - before
+    if pipelining:
+        # 每个窗口一次写出（CAPA 之后）
+        assert packets <= 1 + -(-MESSAGE_COUNT // 5)
+    else:
+        assert packets >= MESSAGE_COUNT
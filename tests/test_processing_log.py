@@ -0,0 +1,54 @@
+"""处理日志：旧CSV导入和汇总计数"""
+
+import csv
+
+import pytest
+
+import db_access
+import processing_log
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / 'processed_emails.db')
+    processing_log.init_processing_log(path)
+    return path
+
+
+def write_legacy(path, uids):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(processing_log.CSV_HEADER)
+        for uid in uids:
+            writer.writerow(['2024-01-05 08:00:00', uid, 'shipper@example.com', f'manifest {uid}', 1, 0, '', 0])
+
+
+def test_legacy_csv_imports_missing_uids(db_file, tmp_path):
+    processing_log.log_processed(db_file, 'b', 'shipper@example.com', 'already processed', excel_sent=1)
+    legacy = str(tmp_path / 'email_processing_log.csv')
+    write_legacy(legacy, ['a', 'b', 'c'])
+    processing_log.init_processing_log(db_file, legacy)
+    assert [row['email_uid'] for row in processing_log.tail(db_file)] == ['b', 'a', 'c']
+    assert processing_log.tail(db_file, email_uid='b')[0]['subject'] == 'already processed'
+    assert not (tmp_path / 'email_processing_log.csv').exists()
+    assert (tmp_path / 'email_processing_log.csv.migrated').exists()
+
+
+def daily_totals(db_file):
+    return db_access.query_all(db_file, f'SELECT * FROM {processing_log.DAILY_TABLE} ORDER BY log_day')
+
+
+def test_summary_follows_writes_and_purge(db_file):
+    with db_access.transaction(db_file) as conn:
+        processing_log._insert(conn, '2000-01-01 08:00:00', 'old', 'a@example.com', 'old', True, 1, 'Urea', 1)
+    processing_log.log_processed(db_file, 'x', 'a@example.com', 'today', has_keyword=True, excel_sent=1)
+    processing_log.log_processed(db_file, 'y', 'a@example.com', 'today')
+    assert processing_log.summary(db_file) == {'total': 3, 'keyword': 2, 'excel_sent': 2, 'today': 2}
+
+    before = daily_totals(db_file)
+    processing_log.rebuild_daily_totals(db_file)
+    assert daily_totals(db_file) == before
+
+    assert processing_log.purge_older_than(db_file, 30) == 1
+    assert processing_log.summary(db_file) == {'total': 2, 'keyword': 1, 'excel_sent': 1, 'today': 2}
+    assert len(daily_totals(db_file)) == 1
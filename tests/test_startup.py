@@ -0,0 +1,16 @@
+"""冷启动导入耗时预算（见 check_system.IMPORT_TIME_BUDGETS）"""
+
+import pytest
+
+import check_system
+
+
+@pytest.mark.parametrize('module_name, label, budget', check_system.IMPORT_TIME_BUDGETS,
+                         ids=[item[0] for item in check_system.IMPORT_TIME_BUDGETS])
+def test_import_time_budget(module_name, label, budget):
+    result = check_system.measure_import_time(module_name)
+    if 'error' in result:
+        pytest.skip(f"{label} 无法导入: {result['error']}")
+    assert not result['heavy'], f"{label} 导入时加载了重量级依赖 {result['heavy']}"
+    assert not result['configured'], f"{label} 导入时读取了配置"
+    assert result['elapsed'] <= budget, f"{label} 导入耗时 {result['elapsed']:.3f}s，超出预算 {budget:.2f}s"
@@ -0,0 +1,46 @@
+"""附件统计写入器和查询缓存"""
+
+import atexit
+import logging
+
+import db_access
+import db_schema
+import statistics_system
+
+
+def test_recorder_caps_pending_after_failed_flush(tmp_path, caplog):
+    # 数据库路径指向目录，写入必然失败
+    recorder = statistics_system.AttachmentRecorder('import', db_file=str(tmp_path), batch_size=100,
+                                                    flush_interval=3600, max_pending=3)
+    try:
+        for i in range(5):
+            assert recorder.add({'attachment_name': f'manifest{i}.txt'})
+        with caplog.at_level(logging.WARNING):
+            assert recorder.flush() == 0
+        assert [row[0] for row in recorder._pending] == ['manifest2.txt', 'manifest3.txt', 'manifest4.txt']
+        assert '丢弃最早的 2 条' in caplog.text
+    finally:
+        recorder._stop_event.set()
+        atexit.unregister(recorder.close)
+
+
+def test_cached_results_are_copies_with_fresh_query_time(tmp_path):
+    stats = statistics_system.StatisticsSystem()
+    stats.import_db_file = str(tmp_path / 'processed_emails_import.db')
+    stats.export_db_file = str(tmp_path / 'processed_emails.db')
+    db_schema.migrate(stats.import_db_file)
+    with db_access.transaction(stats.import_db_file) as conn:
+        statistics_system.insert_attachment_rows(conn, 'import_attachments', [
+            statistics_system.attachment_row({'attachment_name': 'manifest.txt', 'process_date': '2024-01-05',
+                                              'has_dangerous': 1, 'matched_keywords': 'Urea'})])
+    statistics_system.query_cache.clear()
+
+    first = stats.query_statistics_with_keywords('import', '2024-01-01', '2024-01-31')
+    first['attachments'].clear()
+    first['query_time'] = 'stale'
+    hits = statistics_system.query_cache.hits
+    second = stats.query_statistics_with_keywords('import', '2024-01-01', '2024-01-31')
+    assert statistics_system.query_cache.hits == hits + 1
+    assert len(second['attachments']) == 1 and second['query_time'] != 'stale'
+    second['selected_keywords'].append('Urea')
+    assert stats.query_statistics_with_keywords('import', '2024-01-01', '2024-01-31')['selected_keywords'] == []
@@ -0,0 +1,58 @@
+"""趋势图粒度选择与时间段计数"""
+
+from datetime import datetime
+
+import pytest
+
+import trends
+
+
+@pytest.mark.parametrize('start, end, resolution, expected', [
+    ('2024-01-01 00', '2024-01-01 23', 'hour', 24),
+    ('2024-01-01', '2024-01-31', 'day', 31),
+    ('2024-01-01', '2024-12-31', 'day', 366),
+    ('2024-01-01', '2024-01-14', 'week', 2),
+    ('2024-01-03', '2024-01-08', 'week', 2),
+    ('2023-11-15', '2024-02-01', 'month', 4),
+])
+def test_bucket_count(start, end, resolution, expected):
+    assert trends.bucket_count(trends._parse(start), trends._parse(end), resolution) == expected
+
+
+def test_bucket_count_matches_generated_labels():
+    start, end = datetime(2023, 12, 30, 5), datetime(2024, 3, 2, 7)
+    for resolution in trends.RESOLUTIONS:
+        labels = []
+        moment = trends.bucket_start(start, resolution)
+        while moment <= end:
+            labels.append(trends.bucket_label(moment, resolution))
+            moment = trends.next_bucket(moment, resolution)
+        assert trends.bucket_count(start, end, resolution) == len(labels)
+
+
+@pytest.mark.parametrize('days, expected', [
+    (1, 'hour'),
+    (8, 'hour'),
+    (9, 'day'),
+    (200, 'day'),
+    (201, 'week'),
+    (365 * 3, 'week'),
+    (365 * 5, 'month'),
+    (365 * 30, 'month'),
+])
+def test_choose_resolution(days, expected):
+    start = datetime(2000, 1, 3)
+    end = datetime.fromordinal(start.toordinal() + days - 1).replace(hour=23)
+    assert trends.choose_resolution(start, end) == expected
+
+
+def test_choose_resolution_respects_minimum():
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 1, 23)
+    assert trends.choose_resolution(start, end) == 'hour'
+    assert trends.choose_resolution(start, end, min_resolution='day') == 'day'
+
+
+def test_parse_date_only_end_is_last_hour():
+    assert trends._parse('2024-05-06', end=True) == datetime(2024, 5, 6, 23)
+    with pytest.raises(ValueError):
+        trends._parse('06/05/2024')
@@ -0,0 +1,135 @@
+"""
+趋势图数据（按时间段降采样）
+每日图表原来固定按天取点，一年就是 365 个点。这里按请求的时间跨度自动选择粒度：
+    hour   读按小时汇总表（keyword_email_hourly，只有总数）
+    day / week / month  读每日汇总表，在 SQL 中按天/周/月分组
+选择“点数不超过 max_points 的最细粒度”；指定的粒度点数仍然超过上限时（例如按月看十几年），
+再把相邻时间段合并，保证每条曲线最多 max_points 个点。
+每个库只查询一次、只取回每个时间段一行，看一年和看一周的开销相同。
+"""
+
+import math
+from datetime import datetime, timedelta
+
+import email_store
+import email_repository
+
+RESOLUTIONS = ('hour', 'day', 'week', 'month')
+
+# 每条曲线默认最多的点数
+MAX_POINTS = 200
+
+
+def _parse(value, end=False):
+    """'YYYY-MM-DD'、'YYYY-MM-DD HH' 或 'YYYY-MM-DD HH:MM[:SS]' 转为 datetime；只有日期的结束时间取当天最后一小时"""
+    if isinstance(value, datetime):
+        return value
+    value = value.strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H', '%Y-%m-%d'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end and fmt == '%Y-%m-%d':
+            parsed = parsed.replace(hour=23)
+        return parsed
+    raise ValueError(f'无法识别的时间: {value}')
+
+
+def bucket_start(moment, resolution):
+    """moment 所在时间段的开始时间"""
+    if resolution == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == 'week':
+        return day - timedelta(days=day.weekday())
+    if resolution == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(moment, resolution):
+    if resolution == 'hour':
+        return moment + timedelta(hours=1)
+    if resolution == 'day':
+        return moment + timedelta(days=1)
+    if resolution == 'week':
+        return moment + timedelta(days=7)
+    return (moment.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_label(moment, resolution):
+    """时间段的键（与 email_repository 的分组结果一致）"""
+    if resolution == 'hour':
+        return moment.strftime(email_store.HOUR_FORMAT)
+    if resolution == 'month':
+        return moment.strftime('%Y-%m')
+    return moment.strftime('%Y-%m-%d')
+
+
+def bucket_count(start, end, resolution):
+    """start ~ end 之间的时间段数（不逐个生成）"""
+    first = bucket_start(start, resolution)
+    last = bucket_start(end, resolution)
+    if resolution == 'hour':
+        return int((last - first).total_seconds() // 3600) + 1
+    if resolution == 'day':
+        return (last - first).days + 1
+    if resolution == 'week':
+        return (last - first).days // 7 + 1
+    return (last.year - first.year) * 12 + last.month - first.month + 1
+
+
+def choose_resolution(start, end, max_points=MAX_POINTS, min_resolution='hour'):
+    """点数不超过 max_points 的最细粒度；都超过时用 month"""
+    for resolution in RESOLUTIONS[RESOLUTIONS.index(min_resolution):]:
+        if bucket_count(start, end, resolution) <= max_points:
+            return resolution
+    return 'month'
+
+
+def trend(start, end, resolution='auto', directions=None, keyword=email_store.TOTAL_KEYWORD,
+          max_points=MAX_POINTS, min_resolution='hour', repository=None):
+    """
+    start ~ end 之间各库的邮件数趋势
+    resolution 为 'auto' 时按时间跨度选择；按小时只有总数，指定了关键词时最细到按天
+    返回 {'resolution', 'labels': [...], 'series': {方向: [...]}, 'group_size': 每个点合并的时间段数}
+    """
+    start = _parse(start)
+    end = _parse(end, end=True)
+    if end < start:
+        start, end = end, start
+    max_points = max(int(max_points), 1)
+    if keyword and min_resolution == 'hour':
+        min_resolution = 'day'
+    if resolution == 'auto' or resolution not in RESOLUTIONS:
+        resolution = choose_resolution(start, end, max_points, min_resolution)
+    elif resolution == 'hour' and keyword:
+        resolution = 'day'
+
+    labels = []
+    moment = bucket_start(start, resolution)
+    while moment <= end:
+        labels.append(bucket_label(moment, resolution))
+        moment = next_bucket(moment, resolution)
+
+    repository = repository or email_repository.EmailRepository()
+    if resolution == 'hour':
+        counts = repository.bucket_counts('hour', labels[0], labels[-1], directions)
+    else:
+        counts = repository.bucket_counts(resolution, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'),
+                                          directions, keyword)
+
+    # 点数仍然超过上限时合并相邻时间段，以每组第一个时间段作为标签
+    group_size = max(math.ceil(len(labels) / max_points), 1)
+    series = {}
+    for direction, values in counts.items():
+        points = [values.get(label, 0) for label in labels]
+        series[direction] = [sum(points[i:i + group_size]) for i in range(0, len(points), group_size)]
+
+    return {
+        'resolution': resolution,
+        'labels': labels[::group_size],
+        'series': series,
+        'group_size': group_size,
+    }
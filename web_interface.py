@@ -6,20 +6,28 @@
 
 import sys
 import os
+import re
 import sqlite3
+import db_access
+import processing_log
+import db_schema
+import keyword_index
+import container_store
+import email_search
+import keyset_pagination
+import email_repository
+import archive_store
+import keyword_rescan
+import goods_index
+import trends
 import csv
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import Flask, render_template, request, jsonify, send_file, Response
 from flask_cors import CORS
 import threading
 import time
 import logging
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-import matplotlib
-matplotlib.use('Agg')  # 使用非GUI后端
 import io
 import base64
 import subprocess
@@ -28,6 +36,13 @@ config_manager = ConfigManager()
 import subprocess
 import threading
 
+def get_pyplot():
+    """按需导入matplotlib（启动Web界面时不加载，只有生成图表的接口才会用到）"""
+    import matplotlib
+    matplotlib.use('Agg')  # 使用非GUI后端
+    import matplotlib.pyplot as plt
+    return plt
+
 # 全局变量
 system_process = None
 system_running = False
@@ -134,7 +149,7 @@ class HistoryMailSyncManager:
             # 检查进口数据库
             import_db = 'processed_emails_import.db'
             if os.path.exists(import_db):
-                conn = sqlite3.connect(import_db)
+                conn = db_access.connect(import_db)
                 cursor = conn.cursor()
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails';")
                 table_exists = cursor.fetchone()
@@ -147,7 +162,7 @@ class HistoryMailSyncManager:
             # 检查出口数据库
             export_db = 'processed_emails.db'
             if os.path.exists(export_db):
-                conn = sqlite3.connect(export_db)
+                conn = db_access.connect(export_db)
                 cursor = conn.cursor()
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails';")
                 table_exists = cursor.fetchone()
@@ -193,82 +208,13 @@ system_status = {
     'last_check': None
 }
 
+# 进口/出口合并统计的只读查询
+repository = email_repository.EmailRepository()
+
 def ensure_database_exists():
-    """确保数据库表存在"""
+    """确保数据库表结构为最新版本（本进程迁移过后只是一次集合查找）"""
     try:
-        # 进口数据库
-        import_db_file = 'processed_emails_import.db'
-        if os.path.exists(import_db_file):
-            conn = sqlite3.connect(import_db_file)
-            cursor = conn.cursor()
-            
-            # 检查表是否存在 - 更详细的日志
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails';")
-            table_exists = cursor.fetchone()
-            
-            if not table_exists:
-                # 创建与 InputAutoRW_FullFunc_2_0.py 一致的表结构
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS keyword_emails (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        email_uid TEXT NOT NULL,
-                        sender TEXT NOT NULL,
-                        sender_address TEXT,
-                        subject TEXT NOT NULL,
-                        received_date TEXT,
-                        processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        matched_keywords TEXT NOT NULL,
-                        excel_sent INTEGER DEFAULT 1,
-                        txt_attachment TEXT,
-                        container_count INTEGER DEFAULT 0,
-                        attachment_names TEXT,
-                        english_goods_descriptions TEXT,
-                        chinese_goods_descriptions TEXT,
-                        sync_source TEXT DEFAULT '',
-                        UNIQUE(email_uid)
-                    )
-                ''')
-                # 创建索引
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_uid ON keyword_emails(email_uid)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_date ON keyword_emails(processed_date)')
-                conn.commit()
-                logger.info("创建进口数据库表成功")
-            else:
-                logger.info("进口数据库表已存在")
-                
-            conn.close()
-        
-        # 出口数据库（保持不变）
-        export_db_file = 'processed_emails.db'
-        if os.path.exists(export_db_file):
-            conn = sqlite3.connect(export_db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='keyword_emails';")
-            if not cursor.fetchone():
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS keyword_emails (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        email_uid TEXT NOT NULL,
-                        sender TEXT,
-                        sender_address TEXT,
-                        subject TEXT,
-                        received_date TEXT,
-                        processed_date TEXT,
-                        matched_keywords TEXT,
-                        excel_sent INTEGER DEFAULT 0,
-                        txt_attachment TEXT,
-                        container_count INTEGER DEFAULT 0,
-                        attachment_names TEXT
-                    )
-                ''')
-                conn.commit()
-                logger.info("创建出口数据库表")
-            
-            conn.close()
-            
-        logger.info("数据库检查完成")
-        
+        db_schema.migrate_all()
     except Exception as e:
         logger.error(f"确保数据库存在失败: {e}", exc_info=True)
 
@@ -352,10 +298,21 @@ def save_keywords():
         import_keywords = data.get('import', [])
         export_keywords = data.get('export', [])
         
+        # 可选：每个关键词的匹配方式 {关键词: 'exact' / 'normalized'} 和默认方式
+        if 'match_modes' in data or 'default_match_mode' in data:
+            if not config_manager.set_keyword_match_config(data.get('match_modes', {}),
+                                                           data.get('default_match_mode')):
+                return jsonify({
+                    'success': False,
+                    'message': '保存关键词匹配方式失败'
+                })
+        
         if config_manager.set_keywords(import_keywords, export_keywords):
+            job = start_keyword_rescan(data.get('rescan_queue_replies', False))
             return jsonify({
                 'success': True,
-                'message': '关键词配置已保存'
+                'message': '关键词配置已保存' + ('，已开始重扫已保存的舱单' if job else ''),
+                'rescan_started': job is not None
             })
         else:
             return jsonify({
@@ -369,6 +326,47 @@ def save_keywords():
             'message': str(e)
         })
 
+def start_keyword_rescan(queue_replies=False):
+    """按当前关键词启动后台重扫（只扫描存在的数据库），已有任务在运行时返回 None"""
+    keywords = config_manager.get_keywords()
+    targets = [(direction, db_file, keywords.get(direction, []))
+               for direction, db_file in CONTAINER_DB_FILES.items() if os.path.exists(db_file)]
+    if not targets:
+        return None
+    return keyword_rescan.start_rescan(targets, queue_replies=bool(queue_replies),
+                                       match_config=config_manager.get_keyword_match_config())
+
+@app.route('/api/rescan/start', methods=['POST'])
+def start_rescan():
+    """手动启动关键词重扫"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job = start_keyword_rescan(data.get('queue_replies', False))
+        if job is None:
+            return jsonify({
+                'success': False,
+                'message': '已有重扫任务在运行或没有可用的数据库'
+            })
+        return jsonify({
+            'success': True,
+            'message': '已开始重扫'
+        })
+    except Exception as e:
+        logger.error(f"启动关键词重扫失败: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        })
+
+@app.route('/api/rescan/status')
+def rescan_status():
+    """关键词重扫进度和新匹配结果"""
+    job = keyword_rescan.current_job()
+    return jsonify({
+        'success': True,
+        'data': job.snapshot() if job else None
+    })
+
 @app.route('/api/config/sms', methods=['POST'])
 def save_sms_config():
     """保存短信配置"""
@@ -529,47 +527,10 @@ def get_system_status():
         system_status['export_running'] = export_running
         system_status['last_check'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        import_db_file = 'processed_emails_import.db'
-        export_db_file = 'processed_emails.db'
-        
-        import_count = 0
-        export_count = 0
-        today_import = 0
-        today_export = 0
-        
-        # 进口数据库统计
-        if os.path.exists(import_db_file):
-            try:
-                conn = sqlite3.connect(import_db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM keyword_emails')
-                import_count = cursor.fetchone()[0]
-                
-                # 获取今日统计
-                today = datetime.now().strftime('%Y-%m-%d')
-                cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (today,))
-                today_import = cursor.fetchone()[0]
-                
-                conn.close()
-            except Exception as e:
-                logger.warning(f"进口数据库查询失败: {e}")
-        
-        # 出口数据库统计
-        if os.path.exists(export_db_file):
-            try:
-                conn = sqlite3.connect(export_db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM keyword_emails')
-                export_count = cursor.fetchone()[0]
-                
-                # 获取今日统计
-                today = datetime.now().strftime('%Y-%m-%d')
-                cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (today,))
-                today_export = cursor.fetchone()[0]
-                
-                conn.close()
-            except Exception as e:
-                logger.warning(f"出口数据库查询失败: {e}")
+        # 两个库的总数和今日数一条语句查出
+        counts = repository.status_counts(datetime.now().strftime('%Y-%m-%d'))
+        import_counts = counts.get('import', {})
+        export_counts = counts.get('export', {})
         
         status = {
             'system': {
@@ -578,10 +539,10 @@ def get_system_status():
                 'last_check': system_status['last_check']
             },
             'database': {
-                'import_total': import_count,
-                'export_total': export_count,
-                'today_import': today_import,
-                'today_export': today_export
+                'import_total': import_counts.get('total', 0),
+                'export_total': export_counts.get('total', 0),
+                'today_import': import_counts.get('today', 0),
+                'today_export': export_counts.get('today', 0)
             }
         }
         
@@ -683,99 +644,148 @@ def check_database():
         logger.error(f"检查数据库失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/import/database')
-def get_import_database():
-    """获取进口数据库记录"""
+# 列表接口按写入版本缓存总数，翻页时不再重复 COUNT(*)
+listing_count_cache = keyset_pagination.CountCache()
+
+def list_keyword_emails(db_file, columns, page, page_size, start_date, end_date, keywords):
+    """
+    进口/出口列表的公共查询
+    默认按 page 用 LIMIT/OFFSET 分页；传入 cursor 参数（或 mode=keyset）时按
+    (processed_day, processed_date, id) 游标分页，任意深度的翻页代价都和第一页相同。
+    两种模式的总数都按表的写入版本缓存。
+    """
+    cursor_token = request.args.get('cursor')
+    keyset = cursor_token is not None or request.args.get('mode') == 'keyset'
+    
+    db_schema.migrate(db_file)
+    
+    conn = db_access.connect(db_file)
+    conn.row_factory = sqlite3.Row
     try:
-        logger.info("开始查询进口数据库...")
-        
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 50))
-        start_date = request.args.get('start_date', '')
-        end_date = request.args.get('end_date', '')
-        keywords = request.args.get('keywords', '')
-        
-        offset = (page - 1) * page_size
-        
-        db_file = 'processed_emails_import.db'
-        
-        if not os.path.exists(db_file):
-            logger.warning(f"进口数据库文件不存在: {db_file}")
-            return jsonify({'success': True, 'data': [], 'total': 0, 'page': page})
-        
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # 构建查询条件
         conditions = []
         params = []
         
         if start_date:
-            # 使用正确的列名 processed_date
-            conditions.append("DATE(processed_date) >= ?")
+            # 使用 processed_day 列按天过滤（可走索引）
+            conditions.append("processed_day >= ?")
             params.append(start_date)
         
         if end_date:
-            # 使用正确的列名 processed_date
-            conditions.append("DATE(processed_date) <= ?")
+            conditions.append("processed_day <= ?")
             params.append(end_date)
         
         if keywords:
             keyword_list = [k.strip() for k in keywords.split(',') if k.strip()]
             if keyword_list:
-                keyword_conditions = []
-                for keyword in keyword_list:
-                    keyword_conditions.append("matched_keywords LIKE ?")
-                    params.append(f'%{keyword}%')
-                conditions.append(f"({' OR '.join(keyword_conditions)})")
+                # 按关键词关联表精确匹配，不再 LIKE 子串扫描
+                keyword_sql, keyword_params = keyword_index.filter_clause('keyword_emails', keyword_list)
+                conditions.append(keyword_sql)
+                params.extend(keyword_params)
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
+        select = f"SELECT {columns}, processed_day FROM keyword_emails"
         
-        # 获取总数
         try:
-            count_query = f"SELECT COUNT(*) FROM keyword_emails WHERE {where_clause}"
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
+            total = listing_count_cache.count(conn, db_file, 'keyword_emails',
+                                              f"SELECT COUNT(*) FROM keyword_emails WHERE {where_clause}", params)
         except sqlite3.OperationalError as e:
             logger.error(f"查询总数失败: {e}")
             total = 0
         
-        # 获取分页数据 - 使用正确的列名
-        query = f"""
-        SELECT id, email_uid, sender, sender_address, subject, received_date,
-               processed_date, matched_keywords, excel_sent, txt_attachment,
-               container_count, attachment_names, sync_source,
-               english_goods_descriptions, chinese_goods_descriptions
-        FROM keyword_emails
-        WHERE {where_clause}
-        ORDER BY processed_date DESC
-        LIMIT ? OFFSET ?
-        """
-        
-        params.extend([page_size, offset])
-        
-        data = []
-        try:
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            # 转换为字典列表
-            data = [dict(row) for row in rows]
-            logger.info(f"成功查询到 {len(data)} 条进口记录")
-        except sqlite3.OperationalError as e:
-            logger.error(f"查询数据失败: {e}")
-            data = []
-        
-        conn.close()
+        if not keyset:
+            offset = (page - 1) * page_size
+            rows = conn.execute(f"""
+                {select} WHERE {where_clause}
+                ORDER BY processed_day DESC, processed_date DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, params + [page_size, offset]).fetchall()
+            return {
+                'success': True,
+                'data': [dict(row) for row in rows],
+                'total': total,
+                'page': page,
+                'page_size': page_size,
+                'total_pages': (total + page_size - 1) // page_size if total > 0 else 0
+            }
         
-        return jsonify({
+        last = None
+        if cursor_token:
+            last = keyset_pagination.decode_cursor(cursor_token, 3)
+            if last is None:
+                return {'success': False, 'error': '无效的分页游标'}
+        
+        # 先取 processed_day 非空的部分（行值比较可直接从索引定位），不够一页再接上日期为空的尾部
+        rows = []
+        if last is None or last[0] is not None:
+            seek = "processed_day IS NOT NULL"
+            seek_params = []
+            if last is not None:
+                seek = "(processed_day, processed_date, id) < (?, ?, ?)"
+                seek_params = list(last)
+            rows = conn.execute(f"""
+                {select} WHERE {where_clause} AND {seek}
+                ORDER BY processed_day DESC, processed_date DESC, id DESC
+                LIMIT ?
+            """, params + seek_params + [page_size + 1]).fetchall()
+        if len(rows) <= page_size:
+            tail = "processed_day IS NULL"
+            tail_params = []
+            if last is not None and last[0] is None:
+                tail += " AND id < ?"
+                tail_params = [last[2]]
+            rows += conn.execute(f"""
+                {select} WHERE {where_clause} AND {tail}
+                ORDER BY id DESC
+                LIMIT ?
+            """, params + tail_params + [page_size + 1 - len(rows)]).fetchall()
+        
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = None
+        if has_more:
+            end = rows[-1]
+            next_cursor = keyset_pagination.encode_cursor([end['processed_day'], end['processed_date'], end['id']])
+        
+        return {
             'success': True,
-            'data': data,
+            'data': [dict(row) for row in rows],
             'total': total,
-            'page': page,
             'page_size': page_size,
-            'total_pages': (total + page_size - 1) // page_size if total > 0 else 0
-        })
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+    finally:
+        conn.close()
+
+@app.route('/api/import/database')
+def get_import_database():
+    """获取进口数据库记录"""
+    try:
+        logger.info("开始查询进口数据库...")
+        
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 50))
+        start_date = request.args.get('start_date', '')
+        end_date = request.args.get('end_date', '')
+        keywords = request.args.get('keywords', '')
+        
+        db_file = 'processed_emails_import.db'
+        
+        if not os.path.exists(db_file):
+            logger.warning(f"进口数据库文件不存在: {db_file}")
+            return jsonify({'success': True, 'data': [], 'total': 0, 'page': page})
+        
+        result = list_keyword_emails(db_file, """
+            id, email_uid, sender, sender_address, subject, received_date,
+            processed_date, matched_keywords, excel_sent, txt_attachment,
+            container_count, attachment_names, sync_source,
+            english_goods_descriptions, chinese_goods_descriptions""",
+            page, page_size, start_date, end_date, keywords)
+        if result['success']:
+            logger.info(f"成功查询到 {len(result['data'])} 条进口记录")
+        
+        return jsonify(result)
     except Exception as e:
         logger.error(f"获取进口数据库失败: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
@@ -793,231 +803,34 @@ def get_export_database():
         end_date = request.args.get('end_date', '')
         keywords = request.args.get('keywords', '')
         
-        offset = (page - 1) * page_size
-        
         db_file = 'processed_emails.db'
         
         if not os.path.exists(db_file):
             return jsonify({'success': True, 'data': [], 'total': 0, 'page': page})
         
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # 构建查询条件
-        conditions = []
-        params = []
-        
-        if start_date:
-            conditions.append("DATE(processed_date) >= ?")
-            params.append(start_date)
-        
-        if end_date:
-            conditions.append("DATE(processed_date) <= ?")
-            params.append(end_date)
-        
-        if keywords:
-            keyword_list = [k.strip() for k in keywords.split(',') if k.strip()]
-            if keyword_list:
-                keyword_conditions = []
-                for keyword in keyword_list:
-                    keyword_conditions.append("matched_keywords LIKE ?")
-                    params.append(f'%{keyword}%')
-                conditions.append(f"({' OR '.join(keyword_conditions)})")
-        
-        where_clause = " AND ".join(conditions) if conditions else "1=1"
-        
-        # 获取总数
-        try:
-            count_query = f"SELECT COUNT(*) FROM keyword_emails WHERE {where_clause}"
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
-        except sqlite3.OperationalError:
-            total = 0
-        
-        # 获取分页数据
-        query = f"""
-        SELECT id, email_uid, sender, sender_address, subject, received_date,
-               processed_date, matched_keywords, excel_sent, txt_attachment,
-               container_count, attachment_names
-        FROM keyword_emails
-        WHERE {where_clause}
-        ORDER BY processed_date DESC
-        LIMIT ? OFFSET ?
-        """
-        
-        params.extend([page_size, offset])
-        
-        data = []
-        try:
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            # 转换为字典列表
-            data = [dict(row) for row in rows]
-        except sqlite3.OperationalError:
-            data = []
-        
-        conn.close()
+        result = list_keyword_emails(db_file, """
+            id, email_uid, sender, sender_address, subject, received_date,
+            processed_date, matched_keywords, excel_sent, txt_attachment,
+            container_count, attachment_names""",
+            page, page_size, start_date, end_date, keywords)
         
-        return jsonify({
-            'success': True,
-            'data': data,
-            'total': total,
-            'page': page,
-            'page_size': page_size,
-            'total_pages': (total + page_size - 1) // page_size if total > 0 else 0
-        })
+        return jsonify(result)
     except Exception as e:
         logger.error(f"获取出口数据库失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/statistics/keywords')
 def get_keyword_statistics():
-    """获取关键词统计"""
+    """获取关键词统计（读取每日汇总表，两个库合并为一次查询）"""
     try:
         start_date = request.args.get('start_date', '')
         end_date = request.args.get('end_date', '')
         
-        # 手动统计进口数据库
-        import_stats = {}
-        export_stats = {}
-        all_keywords = set()
+        results = repository.keyword_counts(start_date or None, end_date or None)
+        import_stats, total_import = results.get('import', ({}, 0))
+        export_stats, total_export = results.get('export', ({}, 0))
         
-        # 统计进口数据库 - 使用正确的列名
-        import_db_file = 'processed_emails_import.db'
-        if os.path.exists(import_db_file):
-            try:
-                conn = sqlite3.connect(import_db_file)
-                cursor = conn.cursor()
-                
-                # 构建查询条件 - 使用 processed_date
-                conditions = []
-                params = []
-                
-                if start_date:
-                    conditions.append("DATE(processed_date) >= ?")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("DATE(processed_date) <= ?")
-                    params.append(end_date)
-                
-                where_clause = " AND ".join(conditions) if conditions else "1=1"
-                
-                # 查询匹配关键词
-                query = f"""
-                SELECT matched_keywords, COUNT(*) as count
-                FROM keyword_emails
-                WHERE {where_clause}
-                GROUP BY matched_keywords
-                """
-                
-                cursor.execute(query, params)
-                for keyword_str, count in cursor.fetchall():
-                    if keyword_str:
-                        # 关键词可能是逗号分隔的多个
-                        keywords = [k.strip() for k in keyword_str.split(',') if k.strip()]
-                        for keyword in keywords:
-                            import_stats[keyword] = import_stats.get(keyword, 0) + 1
-                            all_keywords.add(keyword)
-                
-                conn.close()
-            except Exception as e:
-                logger.error(f"统计进口关键词失败: {e}")
-        
-        # 统计出口数据库 - 保持原有逻辑
-        export_db_file = 'processed_emails.db'
-        if os.path.exists(export_db_file):
-            try:
-                conn = sqlite3.connect(export_db_file)
-                cursor = conn.cursor()
-                
-                # 构建查询条件
-                conditions = []
-                params = []
-                
-                if start_date:
-                    conditions.append("DATE(processed_date) >= ?")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("DATE(processed_date) <= ?")
-                    params.append(end_date)
-                
-                where_clause = " AND ".join(conditions) if conditions else "1=1"
-                
-                # 查询匹配关键词
-                query = f"""
-                SELECT matched_keywords, COUNT(*) as count
-                FROM keyword_emails
-                WHERE {where_clause}
-                GROUP BY matched_keywords
-                """
-                
-                cursor.execute(query, params)
-                for keyword_str, count in cursor.fetchall():
-                    if keyword_str:
-                        # 关键词可能是逗号分隔的多个
-                        keywords = [k.strip() for k in keyword_str.split(',') if k.strip()]
-                        for keyword in keywords:
-                            export_stats[keyword] = export_stats.get(keyword, 0) + 1
-                            all_keywords.add(keyword)
-                
-                conn.close()
-            except Exception as e:
-                logger.error(f"统计出口关键词失败: {e}")
-        
-        # 获取总数 - 进口使用 processed_date
-        total_import = 0
-        total_export = 0
-        
-        if os.path.exists(import_db_file):
-            try:
-                conn = sqlite3.connect(import_db_file)
-                cursor = conn.cursor()
-                
-                conditions = []
-                params = []
-                
-                if start_date:
-                    conditions.append("DATE(processed_date) >= ?")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("DATE(processed_date) <= ?")
-                    params.append(end_date)
-                
-                where_clause = " AND ".join(conditions) if conditions else "1=1"
-                
-                cursor.execute(f"SELECT COUNT(*) FROM keyword_emails WHERE {where_clause}", params)
-                total_import = cursor.fetchone()[0] or 0
-                conn.close()
-            except:
-                total_import = 0
-        
-        if os.path.exists(export_db_file):
-            try:
-                conn = sqlite3.connect(export_db_file)
-                cursor = conn.cursor()
-                
-                conditions = []
-                params = []
-                
-                if start_date:
-                    conditions.append("DATE(processed_date) >= ?")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("DATE(processed_date) <= ?")
-                    params.append(end_date)
-                
-                where_clause = " AND ".join(conditions) if conditions else "1=1"
-                
-                cursor.execute(f"SELECT COUNT(*) FROM keyword_emails WHERE {where_clause}", params)
-                total_export = cursor.fetchone()[0] or 0
-                conn.close()
-            except:
-                total_export = 0
+        all_keywords = set(import_stats) | set(export_stats)
         
         return jsonify({
             'success': True,
@@ -1042,6 +855,33 @@ def get_keyword_statistics():
             }
         })
 
+def get_daily_counts(days, db_type):
+    """最近 days 天每天的进口/出口邮件数，两个库的每日汇总表合并为一次查询"""
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days-1)
+    dates = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    
+    directions = ['import', 'export'] if db_type == 'all' else [db_type]
+    try:
+        counts = repository.daily_counts(dates[0], dates[-1], directions)
+    except Exception as e:
+        logger.error(f"查询每日统计失败: {e}")
+        counts = {}
+    
+    def series(direction):
+        if direction not in counts:
+            return []
+        return [counts[direction].get(day, 0) for day in dates]
+    
+    import_counts = series('import')
+    export_counts = series('export')
+    
+    return {
+        'dates': dates,
+        'import_counts': import_counts if import_counts else None,
+        'export_counts': export_counts if export_counts else None
+    }
+
 @app.route('/api/statistics/daily')
 def get_daily_statistics():
     """获取每日统计"""
@@ -1049,66 +889,51 @@ def get_daily_statistics():
         days = int(request.args.get('days', 30))
         db_type = request.args.get('type', 'all')
         
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days-1)
-        
-        dates = []
-        import_counts = []
-        export_counts = []
-        
-        for i in range(days):
-            current_date = (start_date + timedelta(days=i)).strftime('%Y-%m-%d')
-            dates.append(current_date)
-            
-            # 进口统计 - 使用正确的列名 processed_date
-            if db_type in ['all', 'import']:
-                import_count = 0
-                db_file = 'processed_emails_import.db'
-                if os.path.exists(db_file):
-                    try:
-                        conn = sqlite3.connect(db_file)
-                        cursor = conn.cursor()
-                        # 使用 DATE 函数处理 processed_date
-                        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (current_date,))
-                        result = cursor.fetchone()
-                        import_count = result[0] if result else 0
-                        conn.close()
-                    except Exception as e:
-                        logger.error(f"查询进口数据库失败 {current_date}: {e}")
-                        import_count = 0
-                import_counts.append(import_count)
-            
-            # 出口统计
-            if db_type in ['all', 'export']:
-                export_count = 0
-                db_file = 'processed_emails.db'
-                if os.path.exists(db_file):
-                    try:
-                        conn = sqlite3.connect(db_file)
-                        cursor = conn.cursor()
-                        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (current_date,))
-                        result = cursor.fetchone()
-                        export_count = result[0] if result else 0
-                        conn.close()
-                    except Exception as e:
-                        logger.error(f"查询出口数据库失败 {current_date}: {e}")
-                        export_count = 0
-                export_counts.append(export_count)
-        
-        data = {
-            'dates': dates,
-            'import_counts': import_counts if import_counts else None,
-            'export_counts': export_counts if export_counts else None
-        }
+        data = get_daily_counts(days, db_type)
         
         return jsonify({'success': True, 'data': data})
     except Exception as e:
         logger.error(f"获取每日统计失败: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
+def get_trend(args, min_resolution='hour'):
+    """
+    按请求参数取趋势数据：start_date / end_date 或最近 days 天，resolution（auto/hour/day/week/month），
+    max_points 每条曲线最多的点数，type 库类型，keyword 关键词（为空时统计全部邮件）
+    processed_date 由 CURRENT_TIMESTAMP 写入（UTC），汇总表的日期和小时都是 UTC，时间窗口和标签也按 UTC 计算
+    """
+    db_type = args.get('type', 'all')
+    now = datetime.now(timezone.utc)
+    start = args.get('start_date', '') or None
+    end = args.get('end_date', '') or now.strftime('%Y-%m-%d %H')
+    if not start:
+        days = max(int(args.get('days', 30)), 1)
+        start = (now - timedelta(days=days-1)).strftime('%Y-%m-%d')
+    max_points = min(max(int(args.get('max_points', trends.MAX_POINTS)), 1), trends.MAX_POINTS)
+    
+    return trends.trend(start, end,
+                        resolution=args.get('resolution', 'auto'),
+                        directions=['import', 'export'] if db_type == 'all' else [db_type],
+                        keyword=args.get('keyword', ''),
+                        max_points=max_points,
+                        min_resolution=min_resolution,
+                        repository=repository)
+
+@app.route('/api/statistics/trends')
+def get_trend_statistics():
+    """趋势统计（按时间跨度自动选择 小时/天/周/月 粒度，每条曲线的点数有上限）"""
+    try:
+        return jsonify({'success': True, 'data': get_trend(request.args)})
+    except Exception as e:
+        logger.error(f"获取趋势统计失败: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+# 图表标题中各粒度的名称
+RESOLUTION_NAMES = {'hour': '按小时', 'day': '按天', 'week': '按周', 'month': '按月'}
+
 @app.route('/api/chart/daily')
 def get_daily_chart():
-    """生成每日统计图表"""
+    """生成每日统计图表（时间跨度较长时自动按周/按月汇总，点数有上限）"""
     try:
         # 确保数据库表存在
         ensure_database_exists()
@@ -1117,66 +942,24 @@ def get_daily_chart():
         db_type = request.args.get('type', 'all')
         
         # 直接调用函数获取数据，而不是通过 HTTP 请求
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days-1)
-        
-        dates = []
-        import_counts = []
-        export_counts = []
-        
-        for i in range(days):
-            current_date = (start_date + timedelta(days=i)).strftime('%Y-%m-%d')
-            dates.append(current_date)
-            
-            # 进口统计
-            if db_type in ['all', 'import']:
-                import_count = 0
-                db_file = 'processed_emails_import.db'
-                if os.path.exists(db_file):
-                    try:
-                        conn = sqlite3.connect(db_file)
-                        cursor = conn.cursor()
-                        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (current_date,))
-                        import_count = cursor.fetchone()[0]
-                        conn.close()
-                    except:
-                        import_count = 0
-                import_counts.append(import_count)
-            
-            # 出口统计
-            if db_type in ['all', 'export']:
-                export_count = 0
-                db_file = 'processed_emails.db'
-                if os.path.exists(db_file):
-                    try:
-                        conn = sqlite3.connect(db_file)
-                        cursor = conn.cursor()
-                        cursor.execute('SELECT COUNT(*) FROM keyword_emails WHERE DATE(processed_date) = ?', (current_date,))
-                        export_count = cursor.fetchone()[0]
-                        conn.close()
-                    except:
-                        export_count = 0
-                export_counts.append(export_count)
-        
-        chart_data = {
-            'dates': dates,
-            'import_counts': import_counts if import_counts else None,
-            'export_counts': export_counts if export_counts else None
-        }
+        chart_data = get_trend(request.args, min_resolution='day')
+        labels = chart_data['labels']
         
         # 创建图表
+        plt = get_pyplot()
         fig, ax = plt.subplots(figsize=(12, 6))
         
-        if db_type in ['all', 'import'] and chart_data['import_counts']:
-            ax.plot(chart_data['dates'], chart_data['import_counts'], 
+        if db_type in ['all', 'import'] and chart_data['series'].get('import'):
+            ax.plot(labels, chart_data['series']['import'], 
                    marker='o', label='进口', color='#3498db', linewidth=2)
         
-        if db_type in ['all', 'export'] and chart_data['export_counts']:
-            ax.plot(chart_data['dates'], chart_data['export_counts'], 
+        if db_type in ['all', 'export'] and chart_data['series'].get('export'):
+            ax.plot(labels, chart_data['series']['export'], 
                    marker='s', label='出口', color='#2ecc71', linewidth=2)
         
         # 设置图表样式
-        ax.set_title(f'最近{days}天舱单处理统计', fontsize=16, fontweight='bold')
+        resolution_name = RESOLUTION_NAMES[chart_data['resolution']]
+        ax.set_title(f'最近{days}天舱单处理统计（{resolution_name}）', fontsize=16, fontweight='bold')
         ax.set_xlabel('日期', fontsize=12)
         ax.set_ylabel('处理数量', fontsize=12)
         ax.legend(fontsize=12)
@@ -1236,6 +1019,7 @@ def get_keywords_chart():
             }
         
         # 创建图表
+        plt = get_pyplot()
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
         
         # 进口关键词统计
@@ -1282,41 +1066,35 @@ def get_keywords_chart():
         logger.error(f"生成关键词图表失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+LOG_DB_FILES = {
+    'import': 'processed_emails_import.db',
+    'export': 'processed_emails.db'
+}
+
+def legacy_log_csv(log_type):
+    """旧CSV日志文件（第一次读取日志时导入）"""
+    return config_manager.get_file_paths()[f'{log_type}_log']
+
+def read_processing_logs(log_type):
+    """读取处理日志最新N条，支持按UID、发件人、关键词过滤"""
+    db_file = LOG_DB_FILES[log_type]
+    if not os.path.exists(db_file):
+        return []
+    
+    return processing_log.tail(
+        db_file,
+        limit=int(request.args.get('lines', 100)),
+        email_uid=request.args.get('uid') or None,
+        sender=request.args.get('sender') or None,
+        keyword=request.args.get('keyword') or None,
+        legacy_csv=legacy_log_csv(log_type)
+    )
+
 @app.route('/api/logs/import')
 def get_import_logs():
     """获取进口日志"""
     try:
-        lines = int(request.args.get('lines', 100))
-        log_file = 'email_processing_log_import.csv'
-        
-        if not os.path.exists(log_file):
-            return jsonify({'success': True, 'data': []})
-        
-        # 读取最后N行
-        with open(log_file, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-        
-        # 反转顺序，最新的在前
-        log_lines = all_lines[-lines:] if lines < len(all_lines) else all_lines
-        
-        # 解析CSV
-        logs = []
-        reader = csv.reader(log_lines)
-        
-        for row in reader:
-            if len(row) >= 8:
-                logs.append({
-                    'timestamp': row[0],
-                    'email_uid': row[1],
-                    'sender': row[2],
-                    'subject': row[3],
-                    'has_keyword': row[4] == '1',
-                    'excel_sent': row[5] == '1',
-                    'matched_keywords': row[6],
-                    'container_count': row[7]
-                })
-        
-        return jsonify({'success': True, 'data': logs})
+        return jsonify({'success': True, 'data': read_processing_logs('import')})
     except Exception as e:
         logger.error(f"获取进口日志失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -1325,41 +1103,34 @@ def get_import_logs():
 def get_export_logs():
     """获取出口日志"""
     try:
-        lines = int(request.args.get('lines', 100))
-        log_file = 'email_processing_log.csv'
-        
-        if not os.path.exists(log_file):
-            return jsonify({'success': True, 'data': []})
-        
-        # 读取最后N行
-        with open(log_file, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-        
-        # 反转顺序，最新的在前
-        log_lines = all_lines[-lines:] if lines < len(all_lines) else all_lines
-        
-        # 解析CSV
-        logs = []
-        reader = csv.reader(log_lines)
-        
-        for row in reader:
-            if len(row) >= 8:
-                logs.append({
-                    'timestamp': row[0],
-                    'email_uid': row[1],
-                    'sender': row[2],
-                    'subject': row[3],
-                    'has_keyword': row[4] == '1',
-                    'excel_sent': row[5] == '1',
-                    'matched_keywords': row[6],
-                    'container_count': row[7]
-                })
-        
-        return jsonify({'success': True, 'data': logs})
+        return jsonify({'success': True, 'data': read_processing_logs('export')})
     except Exception as e:
         logger.error(f"获取出口日志失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/logs/<log_type>/csv')
+def export_logs_csv(log_type):
+    """按原CSV日志格式导出处理日志"""
+    try:
+        if log_type not in LOG_DB_FILES:
+            return jsonify({'success': False, 'error': '未知的日志类型'})
+        
+        db_file = LOG_DB_FILES[log_type]
+        if not os.path.exists(db_file):
+            return jsonify({'success': False, 'error': '数据库文件不存在'})
+        
+        output = io.StringIO()
+        processing_log.write_csv(db_file, output, legacy_log_csv(log_type))
+        filename = 'email_processing_log_import.csv' if log_type == 'import' else 'email_processing_log.csv'
+        return Response(
+            output.getvalue(),
+            mimetype="text/csv",
+            headers={"Content-disposition": f"attachment; filename={filename}"}
+        )
+    except Exception as e:
+        logger.error(f"导出处理日志失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/sms/test')
 def test_sms():
     """测试短信发送"""
@@ -1438,6 +1209,7 @@ def export_csv():
         db_type = request.args.get('type', 'import')
         start_date = request.args.get('start_date', '')
         end_date = request.args.get('end_date', '')
+        keywords = request.args.get('keywords', '')
         
         if db_type == 'import':
             db_file = 'processed_emails_import.db'
@@ -1449,7 +1221,7 @@ def export_csv():
         if not os.path.exists(db_file):
             return jsonify({'success': False, 'error': '数据库文件不存在'})
         
-        conn = sqlite3.connect(db_file)
+        conn = db_access.connect(db_file)
         cursor = conn.cursor()
         
         # 构建查询条件
@@ -1457,13 +1229,20 @@ def export_csv():
         params = []
         
         if start_date:
-            conditions.append("DATE(processed_date) >= ?")
+            conditions.append("processed_day >= ?")
             params.append(start_date)
         
         if end_date:
-            conditions.append("DATE(processed_date) <= ?")
+            conditions.append("processed_day <= ?")
             params.append(end_date)
         
+        keyword_list = [k.strip() for k in keywords.split(',') if k.strip()]
+        if keyword_list:
+            db_schema.migrate(db_file)
+            keyword_sql, keyword_params = keyword_index.filter_clause('keyword_emails', keyword_list)
+            conditions.append(keyword_sql)
+            params.extend(keyword_params)
+        
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
         # 查询数据
@@ -1472,7 +1251,7 @@ def export_csv():
                container_count, attachment_names
         FROM keyword_emails
         WHERE {where_clause}
-        ORDER BY processed_date DESC
+        ORDER BY processed_day DESC, processed_date DESC
         """
         
         try:
@@ -1505,6 +1284,138 @@ def export_csv():
         logger.error(f"导出CSV失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+CONTAINER_DB_FILES = {
+    'import': 'processed_emails_import.db',
+    'export': 'processed_emails.db'
+}
+
+def split_lookup_values(value):
+    """把逗号、空白或换行分隔的号码拆成列表"""
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if v]
+    return [v for v in re.split(r'[\s,，;；]+', value or '') if v]
+
+@app.route('/api/containers/lookup', methods=['GET', 'POST'])
+def lookup_containers():
+    """按箱号/提单号查询是否被标记过（支持单个或批量）"""
+    try:
+        if request.method == 'POST':
+            payload = request.get_json(silent=True) or {}
+            container_nos = split_lookup_values(payload.get('containers', []))
+            bl_nos = split_lookup_values(payload.get('bills', []))
+            db_type = payload.get('type', 'all')
+        else:
+            container_nos = split_lookup_values(request.args.get('container', ''))
+            bl_nos = split_lookup_values(request.args.get('bl', ''))
+            db_type = request.args.get('type', 'all')
+        
+        if not container_nos and not bl_nos:
+            return jsonify({'success': False, 'error': '请提供箱号或提单号'})
+        
+        results = []
+        for direction, db_file in CONTAINER_DB_FILES.items():
+            if db_type not in ('all', direction) or not os.path.exists(db_file):
+                continue
+            db_schema.migrate(db_file)
+            results.extend(container_store.lookup(db_file, container_nos, bl_nos))
+        
+        found_containers = {item['container_no'] for item in results}
+        found_bills = {item['bill_of_lading'] for item in results}
+        not_found = [v for v in container_nos if container_store.normalize_no(v) not in found_containers]
+        not_found += [v for v in bl_nos if container_store.normalize_no(v) not in found_bills]
+        
+        return jsonify({
+            'success': True,
+            'data': results,
+            'total': len(results),
+            'not_found': not_found
+        })
+    except Exception as e:
+        logger.error(f"查询箱号失败: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/search')
+def search_emails():
+    """全文检索主题、发件人和货名（按相关度排序，支持前缀查询 nitr*）"""
+    try:
+        text = request.args.get('q', '').strip()
+        db_type = request.args.get('type', 'all')
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), 200)
+        start_date = request.args.get('start_date', '') or None
+        end_date = request.args.get('end_date', '') or None
+        
+        if not text:
+            return jsonify({'success': False, 'error': '请输入检索内容'})
+        
+        # 每个库取到当前页末尾为止的结果，再按相关度合并分页
+        offset = (page - 1) * page_size
+        total = 0
+        results = []
+        for direction, db_file in CONTAINER_DB_FILES.items():
+            if db_type not in ('all', direction) or not os.path.exists(db_file):
+                continue
+            db_schema.migrate(db_file)
+            if not email_search.available(db_file):
+                return jsonify({'success': False, 'error': '全文检索不可用（SQLite 未启用 FTS5）'})
+            count, rows = email_search.search(db_file, text, start_date, end_date,
+                                              limit=offset + page_size, offset=0)
+            # 日期范围覆盖到已归档的月份时一并检索归档库
+            archived_count, archived_rows = archive_store.search(db_file, text, start_date, end_date,
+                                                                 limit=offset + page_size)
+            total += count + archived_count
+            for row in rows + archived_rows:
+                row['direction'] = direction
+            results.extend(rows + archived_rows)
+        
+        results.sort(key=lambda row: row['score'])
+        data = results[offset:offset + page_size]
+        
+        return jsonify({
+            'success': True,
+            'data': data,
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': (total + page_size - 1) // page_size if total > 0 else 0
+        })
+    except Exception as e:
+        logger.error(f"全文检索失败: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/goods/lookup')
+def lookup_goods():
+    """按货名查询包含该货物的舱单和箱号（读倒排索引，不解析舱单）；phrase=1 时按短语匹配"""
+    try:
+        text = request.args.get('q', '').strip()
+        db_type = request.args.get('type', 'all')
+        phrase = request.args.get('phrase', '0') in ('1', 'true')
+        limit = min(max(int(request.args.get('limit', goods_index.LOOKUP_LIMIT)), 1), goods_index.LOOKUP_LIMIT)
+        start_date = request.args.get('start_date', '') or None
+        end_date = request.args.get('end_date', '') or None
+        days = request.args.get('days', '')
+        if days and not start_date:
+            start_date = (datetime.now() - timedelta(days=int(days))).strftime('%Y-%m-%d')
+        
+        if not text:
+            return jsonify({'success': False, 'error': '请输入货名'})
+        
+        data = {}
+        for direction, db_file in CONTAINER_DB_FILES.items():
+            if db_type not in ('all', direction) or not os.path.exists(db_file):
+                continue
+            db_schema.migrate(db_file)
+            data[direction] = goods_index.lookup(db_file, text, phrase=phrase, start_day=start_date,
+                                                 end_day=end_date, limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'data': data
+        })
+    except Exception as e:
+        logger.error(f"货名查询失败: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/settings/keywords')
 def get_keywords():
     """获取关键词设置"""
@@ -1543,19 +1454,9 @@ def start_system():
         # ===== 启动前预检：数据库结构升级 + 历史邮件同步 =====
         # 目的：把“已手动发送过的舱单邮件”同步进数据库，避免自动回复时重复发送。
         try:
-            # 1) 数据库结构升级（补齐 sync_source 列）
-            upgrade = subprocess.run(
-                [sys.executable, 'UpdateDatabaseSchema.py'],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='ignore',
-                timeout=120
-            )
-            if upgrade.stdout:
-                system_logs.append("[预检] 数据库结构升级完成")
-            if upgrade.returncode != 0:
-                logger.warning(f"⚠️ 数据库升级脚本返回非0: {upgrade.returncode} | {upgrade.stderr}")
+            # 1) 数据库结构升级：上面的 ensure_database_exists 已在进程内按版本迁移
+            versions = db_schema.migrate_all()
+            system_logs.append(f"[预检] 数据库结构版本: {versions}")
 
             # 2) 同步历史邮件（必须步骤，失败则阻止启动，避免重复发送）
             from HistoryMailSync import HistoryMailSync
@@ -3095,8 +2996,9 @@ def create_html_templates():
         function exportCSV(type) {
             const startDate = document.getElementById('db-start-date').value;
             const endDate = document.getElementById('db-end-date').value;
+            const keywords = encodeURIComponent(document.getElementById('db-keywords').value);
             
-            window.open(`/api/export/csv?type=${type}&start_date=${startDate}&end_date=${endDate}`, '_blank');
+            window.open(`/api/export/csv?type=${type}&start_date=${startDate}&end_date=${endDate}&keywords=${keywords}`, '_blank');
         }
 
         // 导出图表